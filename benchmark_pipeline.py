@@ -0,0 +1,995 @@
+"""
+Benchmarks for the vectorization pipeline.
+Run directly to time each stage on the images in IMAGE_FOLDER.
+"""
+
+import os
+import math
+import time
+from collections import defaultdict
+from functools import partial
+import cv2
+import numpy as np
+
+from pipeline_skeleton import get_skeleton, SKELETON_METHODS
+from pipeline_vectorize import (process_skeleton, get_line_detector, LINE_DETECTORS,
+                                merge_parallel_lines, stitch_sequential_lines, merge_diagonals_wobble,
+                                fuse_close_endpoints, connect_corners_vh_and_lock,
+                                snap_free_vh_to_diagonal,
+                                get_line_params, get_dist_point_to_line, get_intersection, is_locked,
+                                MERGE_ALIGN_TOL, MERGE_GAP_TOL, STITCH_ALIGN_TOL, STITCH_GAP_TOL,
+                                PATH_WIDTH_TOL, PATH_GAP_TOL, FUSE_DIST, CORNER_SNAP_DIST, DIAG_SNAP_DIST)
+from pipeline_pyramid import vectorize_pyramid
+from pipeline_jsonfix import align_walls_globally, GLOBAL_ALIGN_THRESHOLD, SKEW_TOLERANCE
+from pipeline_extend_endpoints import (extend_endpoints, line_intersection, distance_point_to_line_segment,
+                                       distance_point_to_point)
+from pipeline_match import match_coordinates, extract_unique_points
+
+# ===== CONFIGURATION =====
+IMAGE_FOLDER = "images/original"
+PARITY_TOL = 2                        # px, skeleton pixels closer than this count as matching
+WALL_PARITY_TOL = 6                   # px, same for rasterized walls
+PYRAMID_FACTORS = [2, 3]
+SCALING_SIZES = [100, 1000, 10000, 100000]   # Synthetic segment counts
+REFERENCE_MAX_SEGMENTS = 10000        # The quadratic reference versions are skipped above this
+# =========================
+
+
+def list_images(folder):
+    """Return the image files in folder that OpenCV can decode."""
+    if not os.path.exists(folder):
+        print(f"Error: Folder '{folder}' does not exist.")
+        return []
+    paths = []
+    for name in sorted(os.listdir(folder)):
+        if name.lower().endswith(('.jpg', '.jpeg', '.png', '.bmp', '.tiff')):
+            paths.append(os.path.join(folder, name))
+    return paths
+
+
+def skeleton_agreement(skel, reference, tol=PARITY_TOL):
+    """
+    Fraction of skeleton pixels lying within tol px of the reference skeleton,
+    and vice versa.
+    """
+    def covered(src, dst):
+        pts = src > 0
+        if not pts.any():
+            return 1.0
+        dist = cv2.distanceTransform(np.where(dst > 0, 0, 255).astype(np.uint8), cv2.DIST_L2, 3)
+        return float((dist[pts] <= tol).mean())
+
+    return covered(skel, reference), covered(reference, skel)
+
+
+def benchmark_skeleton(folder=IMAGE_FOLDER, methods=None):
+    """
+    Time every skeletonization backend against the original erosion loop and
+    report output parity (differing pixels, pixel agreement and final wall
+    count).
+    """
+    if methods is None:
+        methods = [m for m in SKELETON_METHODS
+                   if not m.startswith('ximgproc') or hasattr(cv2, 'ximgproc')]
+    images = list_images(folder)
+    print(f"Skeleton benchmark on {len(images)} images (reference: original erosion loop)")
+
+    for path in images:
+        print(f"\n{os.path.basename(path)}")
+        start = time.perf_counter()
+        _, reference = get_skeleton_reference(path)
+        elapsed = time.perf_counter() - start
+        if reference is None:
+            continue
+        walls = process_skeleton(reference)['walls']
+        print(f"  {'reference':<18} {elapsed:8.2f}s  {int(np.count_nonzero(reference)):>8} px  {len(walls):>5} walls")
+
+        results = {}
+        for method in methods:
+            start = time.perf_counter()
+            _, skel = get_skeleton(path, method=method)
+            elapsed = time.perf_counter() - start
+            walls = process_skeleton(skel)['walls']
+            results[method] = skel
+
+            diff = int(np.count_nonzero(skel != reference))
+            line = f"  {method:<18} {elapsed:8.2f}s  {int(np.count_nonzero(skel)):>8} px  {len(walls):>5} walls"
+            if diff == 0:
+                line += "  identical"
+            else:
+                precision, recall = skeleton_agreement(skel, reference)
+                line += f"  {diff} px differ, agree {precision:6.1%} / {recall:6.1%}"
+            print(line)
+
+        if 'ximgproc' in results and 'zhangsuen' in results:
+            diff = int(np.count_nonzero(results['ximgproc'] != results['zhangsuen']))
+            print(f"  zhangsuen vs ximgproc: {diff} differing pixels")
+
+
+def draw_walls(shape, walls):
+    """Rasterize wall segments one pixel wide."""
+    canvas = np.zeros(shape[:2], np.uint8)
+    for x1, y1, x2, y2 in walls:
+        cv2.line(canvas, (int(x1), int(y1)), (int(x2), int(y2)), 255, 1)
+    return canvas
+
+
+def benchmark_pyramid(folder=IMAGE_FOLDER, factors=None):
+    """
+    Time coarse-to-fine vectorization against the full-resolution pipeline.
+    Hough output is sensitive to single-pixel shifts, so parity is reported as
+    rasterized wall agreement rather than per-segment matches; the full
+    pipeline re-run on a crop shifted by one pixel gives the noise floor.
+    """
+    if factors is None:
+        factors = PYRAMID_FACTORS
+    images = list_images(folder)
+    print(f"Pyramid benchmark on {len(images)} images (tol {WALL_PARITY_TOL} px)")
+
+    for path in images:
+        start = time.perf_counter()
+        img, skel = get_skeleton(path)
+        if skel is None:
+            continue
+        walls = process_skeleton(skel)['walls']
+        elapsed = time.perf_counter() - start
+        reference = draw_walls(img.shape, walls)
+
+        shifted = process_skeleton(skel[1:, 1:])['walls']
+        shifted = [[x1 + 1, y1 + 1, x2 + 1, y2 + 1] for x1, y1, x2, y2 in shifted]
+        precision, recall = skeleton_agreement(draw_walls(img.shape, shifted), reference, WALL_PARITY_TOL)
+
+        print(f"\n{os.path.basename(path)} ({img.shape[1]}x{img.shape[0]})")
+        print(f"  {'full':<10} {elapsed:8.2f}s  {len(walls):>5} walls  1px-shift agree {precision:6.1%} / {recall:6.1%}")
+
+        for factor in factors:
+            start = time.perf_counter()
+            _, data = vectorize_pyramid(path, factor)
+            elapsed = time.perf_counter() - start
+            precision, recall = skeleton_agreement(draw_walls(img.shape, data['walls']), reference, WALL_PARITY_TOL)
+            print(f"  {'x' + str(factor):<10} {elapsed:8.2f}s  {len(data['walls']):>5} walls  agree {precision:6.1%} / {recall:6.1%}")
+
+
+def benchmark_detectors(folder=IMAGE_FOLDER, detectors=None):
+    """
+    Compare line detector backends: raw segment count, detection time, full
+    process_skeleton time, final wall count and rasterized wall agreement with
+    the HoughLinesP baseline.
+    """
+    if detectors is None:
+        detectors = [d for d in LINE_DETECTORS if d != 'edlines' or hasattr(cv2, 'ximgproc')]
+    images = list_images(folder)
+    print(f"Line detector benchmark on {len(images)} images (tol {WALL_PARITY_TOL} px)")
+
+    for path in images:
+        img, skel = get_skeleton(path)
+        if skel is None:
+            continue
+        print(f"\n{os.path.basename(path)}")
+        reference = None
+        for detector in ['hough'] + [d for d in detectors if d != 'hough']:
+            start = time.perf_counter()
+            raw = get_line_detector(detector)(skel)
+            detect_time = time.perf_counter() - start
+
+            start = time.perf_counter()
+            walls = process_skeleton(skel, detector=detector)['walls']
+            total_time = time.perf_counter() - start
+
+            line = f"  {detector:<18} {len(raw):>6} segments  detect {detect_time:6.2f}s  total {total_time:6.2f}s  {len(walls):>5} walls"
+            drawn = draw_walls(img.shape, walls)
+            if reference is None:
+                reference = drawn
+            else:
+                precision, recall = skeleton_agreement(drawn, reference, WALL_PARITY_TOL)
+                line += f"  agree {precision:6.1%} / {recall:6.1%}"
+            print(line)
+
+
+# --- REFERENCE IMPLEMENTATIONS ---
+# Verbatim copies of the original quadratic stages, kept to check that the
+# rewrites in pipeline_vectorize return identical output.
+
+def get_skeleton_reference(img_path):
+    img = cv2.imread(img_path, 0)
+    if img is None:
+        print("Error: Image not found.")
+        return None, None
+
+    img_blurred = cv2.GaussianBlur(img, (5, 5), 0)
+    ret, thresh = cv2.threshold(img_blurred, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
+    kernel = np.ones((3,3), np.uint8)
+    closing = cv2.morphologyEx(thresh, cv2.MORPH_CLOSE, kernel, iterations=4)
+
+    def thinning(img_input):
+        skel = np.zeros(img_input.shape, np.uint8)
+        element = cv2.getStructuringElement(cv2.MORPH_CROSS, (3,3))
+        done = False
+
+        eroded = img_input.copy()
+        while not done:
+            open_op = cv2.morphologyEx(eroded, cv2.MORPH_OPEN, element)
+            temp = cv2.subtract(eroded, open_op)
+            eroded = cv2.erode(eroded, element)
+            skel = cv2.bitwise_or(skel, temp)
+            if cv2.countNonZero(eroded) == 0:
+                done = True
+        return skel
+
+    skeleton = thinning(closing)
+    kernel_bridge = np.ones((3,3), np.uint8)
+    bridged = cv2.dilate(skeleton, kernel_bridge, iterations=1)
+    final_skeleton = thinning(bridged)
+
+    return img, final_skeleton
+
+
+def merge_parallel_lines_reference(lines, orientation='horizontal'):
+    if not lines: return []
+    norm_lines = [[*l] for l in lines]
+    idx_align = 1 if orientation == 'horizontal' else 0
+    idx_start = 0 if orientation == 'horizontal' else 1
+    norm_lines.sort(key=lambda l: (l[idx_align], l[idx_start]))
+
+    merged = []
+    while norm_lines:
+        current = norm_lines.pop(0)
+        i = 0
+        while i < len(norm_lines):
+            cand = norm_lines[i]
+            pos_diff = abs(current[idx_align] - cand[idx_align])
+            if pos_diff <= MERGE_ALIGN_TOL:
+                c_start, c_end = min(current[idx_start], current[idx_start+2]), max(current[idx_start], current[idx_start+2])
+                n_start, n_end = min(cand[idx_start], cand[idx_start+2]), max(cand[idx_start], cand[idx_start+2])
+                if (c_end + MERGE_GAP_TOL >= n_start) and (n_end + MERGE_GAP_TOL >= c_start):
+                    new_start = min(c_start, n_start)
+                    new_end = max(c_end, n_end)
+                    new_pos = (current[idx_align] + cand[idx_align]) // 2
+                    if orientation == 'horizontal': current = [new_start, new_pos, new_end, new_pos]
+                    else:                           current = [new_pos, new_start, new_pos, new_end]
+                    norm_lines.pop(i)
+                    continue 
+            i += 1
+        merged.append(current)
+    return merged
+
+
+def stitch_sequential_lines_reference(lines, orientation='horizontal'):
+    if not lines: return []
+    idx_align = 1 if orientation == 'horizontal' else 0
+    idx_start = 0 if orientation == 'horizontal' else 1
+    buckets = []
+    processed = [False] * len(lines)
+    for i in range(len(lines)):
+        if processed[i]: continue
+        bucket = [lines[i]]
+        processed[i] = True
+        for j in range(i + 1, len(lines)):
+            if processed[j]: continue
+            if abs(lines[i][idx_align] - lines[j][idx_align]) < STITCH_ALIGN_TOL:
+                bucket.append(lines[j])
+                processed[j] = True
+        buckets.append(bucket)
+    final_lines = []
+    for bucket in buckets:
+        bucket.sort(key=lambda l: min(l[idx_start], l[idx_start+2]))
+        if not bucket: continue
+        curr = bucket[0]
+        c_min = min(curr[idx_start], curr[idx_start+2])
+        c_max = max(curr[idx_start], curr[idx_start+2])
+        avg_pos = curr[idx_align]
+        count = 1
+        for k in range(1, len(bucket)):
+            next_l = bucket[k]
+            n_min = min(next_l[idx_start], next_l[idx_start+2])
+            n_max = max(next_l[idx_start], next_l[idx_start+2])
+            if n_min <= c_max + STITCH_GAP_TOL:
+                c_max = max(c_max, n_max)
+                avg_pos += next_l[idx_align]
+                count += 1
+            else:
+                final_pos = int(avg_pos / count)
+                if orientation == 'horizontal': final_lines.append([c_min, final_pos, c_max, final_pos])
+                else:                           final_lines.append([final_pos, c_min, final_pos, c_max])
+                curr = next_l
+                c_min, c_max = n_min, n_max
+                avg_pos = curr[idx_align]
+                count = 1
+        final_pos = int(avg_pos / count)
+        if orientation == 'horizontal': final_lines.append([c_min, final_pos, c_max, final_pos])
+        else:                           final_lines.append([final_pos, c_min, final_pos, c_max])
+    return final_lines
+
+
+def merge_diagonals_wobble_reference(lines):
+    if not lines: return []
+    current_lines = [list(map(float, l)) for l in lines]
+    changed = True
+    while changed:
+        changed = False
+        new_lines = []
+        used = [False] * len(current_lines)
+        current_lines.sort(key=lambda l: math.hypot(l[2]-l[0], l[3]-l[1]), reverse=True)
+        
+        for i in range(len(current_lines)):
+            if used[i]: continue
+            base = current_lines[i]
+            used[i] = True
+            bx1, by1, bx2, by2 = base
+            cluster_pts = [(bx1, by1), (bx2, by2)]
+            
+            for j in range(i + 1, len(current_lines)):
+                if used[j]: continue
+                cand = current_lines[j]
+                cx1, cy1, cx2, cy2 = cand
+                angle_base = get_line_params(base)
+                angle_cand = get_line_params(cand)
+                diff = abs(angle_base - angle_cand)
+                if diff > 170: diff = abs(diff - 180)
+                if diff > 15.0: continue 
+                
+                d1 = get_dist_point_to_line(cx1, cy1, bx1, by1, bx2, by2)
+                d2 = get_dist_point_to_line(cx2, cy2, bx1, by1, bx2, by2)
+                
+                if d1 < PATH_WIDTH_TOL and d2 < PATH_WIDTH_TOL:
+                    dist_gap = min(
+                        math.hypot(cx1-bx1, cy1-by1), math.hypot(cx1-bx2, cy1-by2),
+                        math.hypot(cx2-bx1, cy2-by1), math.hypot(cx2-bx2, cy2-by2)
+                    )
+                    if dist_gap < PATH_GAP_TOL:
+                        cluster_pts.append((cx1, cy1))
+                        cluster_pts.append((cx2, cy2))
+                        used[j] = True
+                        changed = True
+            
+            if len(cluster_pts) > 2:
+                best_p1, best_p2 = cluster_pts[0], cluster_pts[0]
+                max_d = 0
+                for p1 in cluster_pts:
+                    for p2 in cluster_pts:
+                        d = (p1[0]-p2[0])**2 + (p1[1]-p2[1])**2
+                        if d > max_d:
+                            max_d = d
+                            best_p1, best_p2 = p1, p2
+                new_lines.append([best_p1[0], best_p1[1], best_p2[0], best_p2[1]])
+            else:
+                new_lines.append(base)
+        current_lines = new_lines
+    return [list(map(int, l)) for l in current_lines]
+
+
+def fuse_close_endpoints_reference(lines):
+    points = []
+    for i, l in enumerate(lines):
+        points.append({'idx':i, 'pos':0, 'x':l[0], 'y':l[1]})
+        points.append({'idx':i, 'pos':1, 'x':l[2], 'y':l[3]})
+        
+    for i in range(len(points)):
+        for j in range(i+1, len(points)):
+            p1 = points[i]
+            p2 = points[j]
+            
+            if p1['idx'] == p2['idx']: continue
+            
+            dist = math.hypot(p1['x'] - p2['x'], p1['y'] - p2['y'])
+            
+            if dist < FUSE_DIST:
+                avg_x = (p1['x'] + p2['x']) // 2
+                avg_y = (p1['y'] + p2['y']) // 2
+                
+                p1['x'], p1['y'] = avg_x, avg_y
+                line1 = lines[p1['idx']]
+                if p1['pos'] == 0: line1[0], line1[1] = avg_x, avg_y
+                else:              line1[2], line1[3] = avg_x, avg_y
+                
+                p2['x'], p2['y'] = avg_x, avg_y
+                line2 = lines[p2['idx']]
+                if p2['pos'] == 0: line2[0], line2[1] = avg_x, avg_y
+                else:              line2[2], line2[3] = avg_x, avg_y
+    return lines
+
+
+def connect_corners_vh_and_lock_reference(verticals, horizontals):
+    locked_points = set()
+    verts = [list(l) for l in verticals]
+    horzs = [list(l) for l in horizontals]
+    
+    for v in verts:
+        vx, vy1, vy2 = v[0], min(v[1], v[3]), max(v[1], v[3])
+        for h in horzs:
+            hx1, hx2, hy = min(h[0], h[2]), max(h[0], h[2]), h[1]
+            
+            v_near_h = (abs(vy1 - hy) < CORNER_SNAP_DIST) or (abs(vy2 - hy) < CORNER_SNAP_DIST)
+            h_near_v = (abs(hx1 - vx) < CORNER_SNAP_DIST) or (abs(hx2 - vx) < CORNER_SNAP_DIST)
+            v_in_h = (hx1 - 10 <= vx <= hx2 + 10)
+            h_in_v = (vy1 - 10 <= hy <= vy2 + 10)
+            
+            snap_pt = None
+            
+            if v_near_h and h_near_v:
+                if abs(vy1 - hy) < abs(vy2 - hy): v[1] = hy 
+                else:                             v[3] = hy
+                if abs(hx1 - vx) < abs(hx2 - vx): h[0] = vx
+                else:                             h[2] = vx
+                snap_pt = (vx, hy)
+                
+            elif v_near_h and v_in_h:
+                if abs(vy1 - hy) < abs(vy2 - hy): v[1] = hy
+                else:                             v[3] = hy
+                snap_pt = (vx, hy)
+                
+            elif h_near_v and h_in_v:
+                if abs(hx1 - vx) < abs(hx2 - vx): h[0] = vx
+                else:                             h[2] = vx
+                snap_pt = (vx, hy)
+                
+            if snap_pt:
+                locked_points.add((int(snap_pt[0]), int(snap_pt[1])))
+                
+    return verts, horzs, locked_points
+
+
+def snap_free_vh_to_diagonal_reference(orthos, diagonals, locked_set):
+    for o in orthos:
+        for i in [0, 2]:
+            ox, oy = o[i], o[i+1]
+            if is_locked((ox, oy), locked_set): continue 
+            
+            best_dist = DIAG_SNAP_DIST
+            best_int = None
+            
+            for d in diagonals:
+                inter = get_intersection(o, d)
+                if inter:
+                    ix, iy = inter
+                    dist = math.hypot(ox - ix, oy - iy)
+                    if dist < best_dist:
+                        dx_min, dx_max = min(d[0], d[2]), max(d[0], d[2])
+                        dy_min, dy_max = min(d[1], d[3]), max(d[1], d[3])
+                        if (dx_min - 20 <= ix <= dx_max + 20) and (dy_min - 20 <= iy <= dy_max + 20):
+                            best_dist = dist
+                            best_int = (int(ix), int(iy))
+            if best_int:
+                o[i], o[i+1] = best_int
+
+
+def align_walls_globally_reference(lines_data):
+    if not lines_data:
+        return []
+    lines = [dict(l) for l in lines_data]
+
+    v_x_coords = []
+    h_y_coords = []
+    for line in lines:
+        x1, y1, x2, y2 = line['x1'], line['y1'], line['x2'], line['y2']
+        if abs(x1 - x2) < SKEW_TOLERANCE:
+            v_x_coords.extend([x1, x2])
+            h_y_coords.extend([y1, y2])
+        elif abs(y1 - y2) < SKEW_TOLERANCE:
+            h_y_coords.extend([y1, y2])
+            v_x_coords.extend([x1, x2])
+
+    def get_snap_rules(coords, threshold):
+        if not coords: return []
+        unique_coords = sorted(list(set(coords)))
+        clusters = []
+        current_cluster = [unique_coords[0]]
+        for i in range(1, len(unique_coords)):
+            val = unique_coords[i]
+            if val - current_cluster[-1] <= threshold:
+                current_cluster.append(val)
+            else:
+                clusters.append(current_cluster)
+                current_cluster = [val]
+        clusters.append(current_cluster)
+        rules = []
+        for clust in clusters:
+            avg_val = int(round(sum(clust) / len(clust)))
+            rules.append({'min': min(clust) - 2, 'max': max(clust) + 2, 'target': avg_val})
+        return rules
+
+    x_rules = get_snap_rules(v_x_coords, GLOBAL_ALIGN_THRESHOLD)
+    y_rules = get_snap_rules(h_y_coords, GLOBAL_ALIGN_THRESHOLD)
+
+    for line in lines:
+        orig_x1, orig_y1 = line['x1'], line['y1']
+        orig_x2, orig_y2 = line['x2'], line['y2']
+        new_x1, new_y1 = orig_x1, orig_y1
+        new_x2, new_y2 = orig_x2, orig_y2
+        for r in x_rules:
+            if r['min'] <= orig_x1 <= r['max']: new_x1 = r['target']
+            if r['min'] <= orig_x2 <= r['max']: new_x2 = r['target']
+        for r in y_rules:
+            if r['min'] <= orig_y1 <= r['max']: new_y1 = r['target']
+            if r['min'] <= orig_y2 <= r['max']: new_y2 = r['target']
+        if (new_x1 != orig_x1) or (new_y1 != orig_y1) or \
+           (new_x2 != orig_x2) or (new_y2 != orig_y2):
+            line['x1'], line['y1'] = new_x1, new_y1
+            line['x2'], line['y2'] = new_x2, new_y2
+    return lines
+
+
+def extend_endpoints_reference(lines_data, max_iterations=3, tolerance=2.0, snap_distance=50.0):
+    if not lines_data:
+        return lines_data
+
+    # Deep copy to avoid modifying input
+    lines = [dict(line) for line in lines_data]
+
+    total_modifications = 0
+
+    for iteration in range(max_iterations):
+
+        # ============= STEP 1: Find free endpoints =============
+        endpoint_usage = {}
+
+        for line_idx, line in enumerate(lines):
+            p1 = (line['x1'], line['y1'])
+            p2 = (line['x2'], line['y2'])
+
+            if p1 not in endpoint_usage:
+                endpoint_usage[p1] = []
+            if p2 not in endpoint_usage:
+                endpoint_usage[p2] = []
+
+            endpoint_usage[p1].append((line_idx, 'start'))
+            endpoint_usage[p2].append((line_idx, 'end'))
+
+        # Identify free endpoints (used by exactly 1 line)
+        free_endpoints = {pt: uses for pt, uses in endpoint_usage.items() if len(uses) == 1}
+
+
+        # ============= STEP 2: Process each free endpoint =============
+        modifications_this_iteration = 0
+
+        for endpoint_pt, uses in free_endpoints.items():
+            line_idx, position = uses[0]
+            current_line = lines[line_idx]
+
+            # Get line endpoints
+            x1, y1 = current_line['x1'], current_line['y1']
+            x2, y2 = current_line['x2'], current_line['y2']
+
+            px, py = endpoint_pt
+
+            # ============= CHECK: Is this endpoint already on another line? =============
+            already_on_line = False
+
+            for other_idx, other_line in enumerate(lines):
+                if other_idx == line_idx:
+                    continue  # Skip own line
+
+                ox1, oy1 = other_line['x1'], other_line['y1']
+                ox2, oy2 = other_line['x2'], other_line['y2']
+
+                # Calculate distance from endpoint to other line (using projection)
+                dx = ox2 - ox1
+                dy = oy2 - oy1
+
+                if dx == 0 and dy == 0:
+                    continue
+
+                # Project point onto line
+                t = ((px - ox1) * dx + (py - oy1) * dy) / (dx * dx + dy * dy)
+                proj_x = ox1 + t * dx
+                proj_y = oy1 + t * dy
+
+                # Distance to line
+                dist_to_line = distance_point_to_point((px, py), (proj_x, proj_y))
+
+                if dist_to_line <= tolerance:
+                    already_on_line = True
+                    break
+
+            # If already on a line, skip this endpoint
+            if already_on_line:
+                continue
+
+            # ============= CHECK: Does line already intersect another line? =============
+            # Check if the current line segment already crosses any other line
+            already_intersects = []
+
+            for other_idx, other_line in enumerate(lines):
+                if other_idx == line_idx:
+                    continue
+
+                ox1, oy1 = other_line['x1'], other_line['y1']
+                ox2, oy2 = other_line['x2'], other_line['y2']
+
+                # Find intersection of infinite lines
+                intersection = line_intersection(x1, y1, x2, y2, ox1, oy1, ox2, oy2)
+
+                if intersection is not None:
+                    ix, iy = intersection
+
+                    # Check if endpoint has already passed this intersection
+                    # (i.e., is on the far side of the intersection from the other endpoint)
+                    # Calculate parameter t for the endpoint on the current line
+                    dx_current = x2 - x1
+                    dy_current = y2 - y1
+
+                    if abs(dx_current) > abs(dy_current):
+                        # Use x as reference
+                        if dx_current != 0:
+                            t_endpoint = (px - x1) / dx_current
+                            t_intersection = (ix - x1) / dx_current
+                        else:
+                            continue
+                    else:
+                        # Use y as reference
+                        if dy_current != 0:
+                            t_endpoint = (py - y1) / dy_current
+                            t_intersection = (iy - y1) / dy_current
+                        else:
+                            continue
+
+                    # If endpoint parameter is beyond intersection parameter (same direction),
+                    # the endpoint has already passed the intersection
+                    if (t_endpoint > 0 and t_intersection > 0 and t_endpoint >= t_intersection) or \
+                       (t_endpoint < 0 and t_intersection < 0 and t_endpoint <= t_intersection):
+                        # Endpoint is on the far side - it has already crossed this line
+                        dist_to_intersection = distance_point_to_point((px, py), (ix, iy))
+                        already_intersects.append((dist_to_intersection, (ix, iy), other_idx))
+
+            # If endpoint already intersects/crosses another line, snap it back to that intersection
+            if already_intersects:
+                already_intersects.sort(key=lambda x: x[0])
+                closest_dist, snap_pt, snap_line_idx = already_intersects[0]
+
+                new_x = int(round(snap_pt[0]))
+                new_y = int(round(snap_pt[1]))
+
+                if new_x != px or new_y != py:
+                    old_pt = (px, py)
+                    new_pt = (new_x, new_y)
+
+                    if position == 'start':
+                        current_line['x1'] = new_x
+                        current_line['y1'] = new_y
+                    else:
+                        current_line['x2'] = new_x
+                        current_line['y2'] = new_y
+
+                    modifications_this_iteration += 1
+                    total_modifications += 1
+
+                continue  # Skip to next endpoint
+
+            # ============= FIND: Intersection points of this line with other lines =============
+            intersections = []
+
+            for other_idx, other_line in enumerate(lines):
+                if other_idx == line_idx:
+                    continue  # Skip own line
+
+                ox1, oy1 = other_line['x1'], other_line['y1']
+                ox2, oy2 = other_line['x2'], other_line['y2']
+
+                # Find intersection between current line and other line
+                intersection = line_intersection(x1, y1, x2, y2, ox1, oy1, ox2, oy2)
+
+                if intersection is not None:
+                    ix, iy = intersection
+
+                    # VALIDATION: Check if intersection is actually on the other line segment
+                    dist_to_segment = distance_point_to_line_segment((ix, iy), (ox1, oy1), (ox2, oy2))
+
+                    # Only accept if intersection is on the segment (within 2px tolerance)
+                    if dist_to_segment > 2.0:
+                        continue
+
+                    # Calculate distance from endpoint to this intersection
+                    dist = distance_point_to_point((px, py), (ix, iy))
+
+                    # Only consider intersections within snap_distance
+                    if dist <= snap_distance:
+                        intersections.append((dist, (ix, iy), other_idx))
+
+            # ============= STEP 3: Snap to closest intersection =============
+            if intersections:
+                # Sort by distance and get the closest one
+                intersections.sort(key=lambda x: x[0])
+                closest_dist, closest_pt, closest_line_idx = intersections[0]
+
+                # Snap to the intersection point
+                new_x = int(round(closest_pt[0]))
+                new_y = int(round(closest_pt[1]))
+
+                # Only apply if position actually changed
+                if new_x != px or new_y != py:
+                    old_pt = (px, py)
+                    new_pt = (new_x, new_y)
+
+                    if position == 'start':
+                        current_line['x1'] = new_x
+                        current_line['y1'] = new_y
+                    else:  # end
+                        current_line['x2'] = new_x
+                        current_line['y2'] = new_y
+
+                    modifications_this_iteration += 1
+                    total_modifications += 1
+
+        # If no changes, we've converged
+        if modifications_this_iteration == 0:
+            break
+
+    return lines
+
+
+def match_coordinates_reference(reference_segments, target_segments, threshold=50.0):
+    """
+    Snap coordinates in target to nearby points in reference while preserving geometry.
+    Groups points that share X or Y coordinates (building walls on same line) and snaps them together.
+    
+    Args:
+        reference_segments: List of reference segment dicts
+        target_segments: List of target segment dicts (will be modified)
+        threshold: Maximum snapping distance
+    
+    Returns:
+        Tuple: (modified_target_segments, snap_stats)
+    """
+    # Extract reference points
+    reference_points = list(extract_unique_points(reference_segments).values())
+    
+    # Extract target points with their positions
+    target_points = extract_unique_points(target_segments)
+    
+    # Group target points by X coordinate (vertical lines)
+    x_groups = defaultdict(list)  # x -> [y values]
+    # Group target points by Y coordinate (horizontal lines)
+    y_groups = defaultdict(list)  # y -> [x values]
+    
+    for point in target_points.values():
+        x, y = point
+        x_groups[x].append(y)
+        y_groups[y].append(x)
+    
+    # For each group, find the best snap value
+    x_snap_mapping = {}  # old_x -> new_x
+    y_snap_mapping = {}  # old_y -> new_y
+    
+    # Process vertical lines (groups sharing same X)
+    for target_x in x_groups:
+        y_values = x_groups[target_x]
+        
+        # Find best X snap by checking reference points
+        best_snap_x = None
+        best_distance = threshold
+        
+        for ref_point in reference_points:
+            ref_x, _ = ref_point
+            distance = abs(ref_x - target_x)
+            
+            if distance < best_distance:
+                best_distance = distance
+                best_snap_x = ref_x
+        
+        if best_snap_x is not None:
+            x_snap_mapping[target_x] = best_snap_x
+    
+    # Process horizontal lines (groups sharing same Y)
+    for target_y in y_groups:
+        x_values = y_groups[target_y]
+        
+        # Find best Y snap by checking reference points
+        best_snap_y = None
+        best_distance = threshold
+        
+        for ref_point in reference_points:
+            _, ref_y = ref_point
+            distance = abs(ref_y - target_y)
+            
+            if distance < best_distance:
+                best_distance = distance
+                best_snap_y = ref_y
+        
+        if best_snap_y is not None:
+            y_snap_mapping[target_y] = best_snap_y
+    
+    # Apply snaps to all segments
+    modified_segments = []
+    for seg in target_segments:
+        if not isinstance(seg, dict):
+            modified_segments.append(seg)
+            continue
+        
+        new_seg = seg.copy()
+        
+        # Snap p1
+        if 'x1' in seg and 'y1' in seg:
+            old_x1 = seg['x1']
+            old_y1 = seg['y1']
+            new_x1 = x_snap_mapping.get(old_x1, old_x1)
+            new_y1 = y_snap_mapping.get(old_y1, old_y1)
+            new_seg['x1'] = new_x1
+            new_seg['y1'] = new_y1
+        
+        # Snap p2
+        if 'x2' in seg and 'y2' in seg:
+            old_x2 = seg['x2']
+            old_y2 = seg['y2']
+            new_x2 = x_snap_mapping.get(old_x2, old_x2)
+            new_y2 = y_snap_mapping.get(old_y2, old_y2)
+            new_seg['x2'] = new_x2
+            new_seg['y2'] = new_y2
+        
+        modified_segments.append(new_seg)
+    
+    # Calculate stats
+    snapped_x = len(x_snap_mapping)
+    snapped_y = len(y_snap_mapping)
+    total_lines = len(x_groups) + len(y_groups)
+    
+    stats = {
+        'total_reference_points': len(reference_points),
+        'total_target_points': len(target_points),
+        'vertical_lines_snapped': snapped_x,
+        'horizontal_lines_snapped': snapped_y,
+        'total_lines': total_lines,
+        'snap_percentage': ((snapped_x + snapped_y) / total_lines * 100) if total_lines else 0
+    }
+    
+    return modified_segments, stats
+
+
+def synthetic_segments(n, orientation='horizontal', seed=0):
+    """
+    Hough-like fragments of axis-aligned walls: every wall is broken into
+    about eight jittered, overlapping or slightly separated pieces, some with
+    reversed endpoints. The canvas grows with sqrt(n) so density stays
+    similar to a real floor plan.
+    """
+    rng = np.random.default_rng(seed)
+    extent = int(300 * math.sqrt(n)) + 500
+    segments = []
+    while len(segments) < n:
+        align = int(rng.integers(0, extent))
+        start = int(rng.integers(0, extent))
+        length = int(rng.integers(50, 1500))
+        pos = start
+        while pos < start + length and len(segments) < n:
+            frag = int(rng.integers(10, 200))
+            a = align + int(rng.integers(-4, 5))
+            s, e = pos, pos + frag
+            if rng.random() < 0.3:
+                s, e = e, s
+            segments.append([s, a, e, a] if orientation == 'horizontal' else [a, s, a, e])
+            pos += frag + int(rng.integers(-30, 60))
+    return segments
+
+
+def synthetic_diagonals(n, seed=0):
+    """
+    Hough-like fragments of diagonal walls: each wall at a random angle is
+    broken into wobbly pieces a few pixels off its centre line.
+    """
+    rng = np.random.default_rng(seed)
+    extent = int(300 * math.sqrt(n)) + 500
+    segments = []
+    while len(segments) < n:
+        x, y = rng.uniform(0, extent, 2)
+        theta = rng.uniform(0.2, math.pi / 2 - 0.2) * (1 if rng.random() < 0.5 else -1)
+        dx, dy = math.cos(theta), math.sin(theta)
+        length = rng.uniform(50, 1200)
+        t = 0.0
+        while t < length and len(segments) < n:
+            frag = rng.uniform(10, 150)
+            off = rng.uniform(-4, 4)
+            x1, y1 = x + t * dx - off * dy, y + t * dy + off * dx
+            x2, y2 = x1 + frag * dx, y1 + frag * dy
+            segments.append([int(x1), int(y1), int(x2), int(y2)])
+            t += frag + rng.uniform(-20, 50)
+    return segments
+
+
+def synthetic_orthogonal(n, seed=0):
+    """Half horizontal, half vertical synthetic fragments on one canvas."""
+    return synthetic_segments(n - n // 2, 'vertical', seed) + synthetic_segments(n // 2, 'horizontal', seed + 1)
+
+
+def _on_orthogonal(corner_func):
+    """Adapt a (verticals, horizontals) corner stage to a mixed segment list."""
+    def run(segments):
+        verticals = [s for s in segments if s[0] == s[2]]
+        horizontals = [s for s in segments if s[0] != s[2]]
+        verts, horzs, locked = corner_func(verticals, horizontals)
+        return verts + horzs + sorted(locked)
+    return run
+
+
+def synthetic_mixed(n, seed=0):
+    """Three quarters orthogonal, one quarter diagonal synthetic fragments."""
+    return synthetic_orthogonal(n - n // 4, seed) + synthetic_diagonals(n // 4, seed + 2)
+
+
+def _on_mixed(snap_func):
+    """Adapt an (orthos, diagonals, locked) snap stage to a mixed segment list."""
+    def run(segments):
+        orthos = [s for s in segments if s[0] == s[2] or s[1] == s[3]]
+        diagonals = [s for s in segments if s[0] != s[2] and s[1] != s[3]]
+        snap_func(orthos, diagonals, set())
+        return orthos
+    return run
+
+
+def _on_dicts(json_func):
+    """Adapt a stage on {x1, y1, x2, y2} dicts to [x1, y1, x2, y2] lists."""
+    def run(segments):
+        lines = [{'x1': s[0], 'y1': s[1], 'x2': s[2], 'y2': s[3]} for s in segments]
+        return [[l['x1'], l['y1'], l['x2'], l['y2']] for l in json_func(lines)]
+    return run
+
+
+def _on_floor_pair(match_func):
+    """Adapt a floor matching stage: match a shifted copy of the segments back onto them."""
+    def run(segments):
+        reference = [{'x1': s[0], 'y1': s[1], 'x2': s[2], 'y2': s[3]} for s in segments]
+        target = [{k: v + (i * 7 + j * 3) % 41 - 20 for j, (k, v) in enumerate(seg.items())}
+                  for i, seg in enumerate(reference)]
+        matched, _ = match_func(reference, target)
+        return [[l['x1'], l['y1'], l['x2'], l['y2']] for l in matched]
+    return run
+
+
+# Stage name -> (current implementation, original implementation, synthetic
+# input, largest size the original is still run on)
+SCALING_STAGES = {
+    'merge_parallel_lines': (merge_parallel_lines, merge_parallel_lines_reference, synthetic_segments, REFERENCE_MAX_SEGMENTS),
+    'stitch_sequential_lines': (stitch_sequential_lines, stitch_sequential_lines_reference, synthetic_segments, REFERENCE_MAX_SEGMENTS),
+    'merge_diagonals_wobble': (merge_diagonals_wobble, merge_diagonals_wobble_reference, synthetic_diagonals, REFERENCE_MAX_SEGMENTS),
+    'fuse_close_endpoints': (fuse_close_endpoints, fuse_close_endpoints_reference, synthetic_segments, REFERENCE_MAX_SEGMENTS // 4),
+    'connect_corners_vh_and_lock': (_on_orthogonal(connect_corners_vh_and_lock),
+                                    _on_orthogonal(connect_corners_vh_and_lock_reference),
+                                    synthetic_orthogonal, REFERENCE_MAX_SEGMENTS),
+    'snap_free_vh_to_diagonal': (_on_mixed(snap_free_vh_to_diagonal), _on_mixed(snap_free_vh_to_diagonal_reference),
+                                 synthetic_mixed, REFERENCE_MAX_SEGMENTS // 4),
+    'align_walls_globally': (_on_dicts(align_walls_globally), _on_dicts(align_walls_globally_reference),
+                             synthetic_orthogonal, REFERENCE_MAX_SEGMENTS),
+    'extend_endpoints': (_on_dicts(partial(extend_endpoints, max_iterations=3)),
+                         _on_dicts(partial(extend_endpoints_reference, max_iterations=3)),
+                         synthetic_mixed, REFERENCE_MAX_SEGMENTS // 10),
+    'match_coordinates': (_on_floor_pair(match_coordinates), _on_floor_pair(match_coordinates_reference),
+                          synthetic_orthogonal, REFERENCE_MAX_SEGMENTS // 10),
+}
+
+
+def benchmark_scaling(sizes=None, stages=None):
+    """
+    Time the rewritten pipeline stages on 100 to 100k synthetic segments
+    and check them against the original implementations where those are
+    still affordable.
+    """
+    if sizes is None:
+        sizes = SCALING_SIZES
+    if stages is None:
+        stages = list(SCALING_STAGES)
+    for name in stages:
+        func, reference_func, make_input, reference_max = SCALING_STAGES[name]
+        print(f"{name} scaling")
+        for n in sizes:
+            segments = make_input(n)
+            start = time.perf_counter()
+            result = func([list(s) for s in segments])
+            elapsed = time.perf_counter() - start
+            line = f"  {n:>7} segments  {elapsed:8.3f}s  {len(result):>6} out"
+            if n <= reference_max:
+                start = time.perf_counter()
+                reference = reference_func([list(s) for s in segments])
+                ref_elapsed = time.perf_counter() - start
+                if result == reference:
+                    verdict = 'identical'
+                else:
+                    ref_set = {tuple(r) for r in reference}
+                    shared = sum(1 for r in result if tuple(r) in ref_set)
+                    verdict = f"{shared}/{len(reference)} lines shared"
+                line += f"  reference {ref_elapsed:8.3f}s  {verdict}"
+            print(line)
+
+
+if __name__ == "__main__":
+    benchmark_skeleton()
+    benchmark_pyramid()
+    benchmark_detectors()
+    benchmark_scaling()
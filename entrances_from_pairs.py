@@ -1,5 +1,6 @@
 import json
 import math
+import numpy as np
 
 def load_json(filepath):
     with open(filepath, 'r') as f:
@@ -30,6 +31,53 @@ def line_intersection(p1, p2, p3, p4):
     
     return (x, y)
 
+def cast_rays(origins, ends, skip, segments, block=1000000):
+    """
+    Nearest intersection for a batch of rays, with the same rules as calling
+    line_intersection against every segment: lines are treated as infinite,
+    near-parallel pairs are ignored, hits within 1 px of the origin are
+    dropped and ties go to the earlier segment.
+    
+    Args:
+        origins: List of (x, y) ray start points
+        ends: List of (x, y) points the rays run through
+        skip: For each ray, the index of the segment it comes from
+        segments: List of segment dicts
+        block: Max ray x segment pairs evaluated at once (bounds memory)
+    
+    Returns:
+        List with the nearest intersection (x, y) per ray, or None
+    """
+    if not origins:
+        return []
+    seg = np.array([[s['x1'], s['y1'], s['x2'], s['y2']] for s in segments], dtype=np.float64).reshape(-1, 4)
+    x3, y3, x4, y4 = (seg[:, k] for k in range(4))
+    results = []
+    rows = max(1, block // max(len(seg), 1))
+    for lo in range(0, len(origins), rows):
+        o = np.array(origins[lo:lo + rows], dtype=np.float64)
+        e = np.array(ends[lo:lo + rows], dtype=np.float64)
+        x1, y1 = o[:, :1], o[:, 1:]
+        x2, y2 = e[:, :1], e[:, 1:]
+        # Same arithmetic as line_intersection, one row per ray
+        denom = (x1 - x2) * (y3 - y4) - (y1 - y2) * (x3 - x4)
+        parallel = np.abs(denom) < 1e-10
+        with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+            t = ((x1 - x3) * (y3 - y4) - (y1 - y3) * (x3 - x4)) / denom
+            x = x1 + t * (x2 - x1)
+            y = y1 + t * (y2 - y1)
+            dist = np.sqrt((x1 - x) ** 2 + (y1 - y) ** 2)
+        valid = ~parallel & (dist > 1)
+        valid[np.arange(len(o)), skip[lo:lo + rows]] = False
+        dist = np.where(valid, dist, np.inf)
+        best = dist.argmin(axis=1)
+        for r, k in enumerate(best.tolist()):
+            if dist[r, k] < np.inf:
+                results.append((float(x[r, k]), float(y[r, k])))
+            else:
+                results.append(None)
+    return results
+
 def create_entrances_from_pairs(points_mapping_file, pairs_list):
     """
     Takes a list of point ID pairs and creates entrances from their midpoints.
@@ -93,8 +141,17 @@ def create_entrances_from_points(floor_file, points_mapping_file, individual_poi
     points_mapping = load_json(points_mapping_file)
     points = {int(pid): (coord['x'], coord['y']) for pid, coord in points_mapping['points'].items()}
     
-    entrances = []
-    entrance_id = 0
+    # Segments by endpoint, so each point finds its segments with one lookup
+    segments_at = {}
+    for i, seg in enumerate(segments):
+        p1 = (seg['x1'], seg['y1'])
+        p2 = (seg['x2'], seg['y2'])
+        segments_at.setdefault(p1, []).append((i, p1, p2, True))  # True = p1 is our point
+        if p2 != p1:
+            segments_at.setdefault(p2, []).append((i, p1, p2, False))  # False = p2 is our point
+    
+    # Collect one ray per (point, segment), then cast them all in one batch
+    rays = []  # (point_id, is_stairs, point, line_end, seg_idx)
     
     for item in individual_points:
         # Handle both int and tuple formats
@@ -110,32 +167,12 @@ def create_entrances_from_points(floor_file, points_mapping_file, individual_poi
         
         point = points[int(point_id)]
         
-        # Find segments that have this point as endpoint
-        segments_with_point = []
-        for i, seg in enumerate(segments):
-            p1 = (seg['x1'], seg['y1'])
-            p2 = (seg['x2'], seg['y2'])
-            
-            if p1 == point:
-                segments_with_point.append((i, p1, p2, True))  # True = p1 is our point
-            elif p2 == point:
-                segments_with_point.append((i, p1, p2, False))  # False = p2 is our point
-        
         # For each segment containing this point, extend from the point
-        for seg_idx, p1, p2, is_p1 in segments_with_point:
-            seg = segments[seg_idx]
-            
+        for seg_idx, p1, p2, is_p1 in segments_at.get(point, []):
             # Determine direction: extend FROM the point AWAY from the other end
-            if is_p1:
-                # Point is p1, extend away from p2 (in direction p1->p2 extended beyond p1 = reverse)
-                other_point = p2
-                dx = point[0] - other_point[0]  # Direction AWAY from p2
-                dy = point[1] - other_point[1]
-            else:
-                # Point is p2, extend away from p1 (in direction p1->p2 extended beyond p2)
-                other_point = p1
-                dx = point[0] - other_point[0]  # Direction AWAY from p1
-                dy = point[1] - other_point[1]
+            other_point = p2 if is_p1 else p1
+            dx = point[0] - other_point[0]
+            dy = point[1] - other_point[1]
             
             norm = math.sqrt(dx**2 + dy**2)
             
@@ -151,48 +188,35 @@ def create_entrances_from_points(floor_file, points_mapping_file, individual_poi
                 point[0] + dx_norm * extension_length,
                 point[1] + dy_norm * extension_length
             )
+            rays.append((point_id, is_stairs, point, line_end, seg_idx))
+    
+    # Check intersection with all other segments (walls and stairs)
+    hits = cast_rays([r[2] for r in rays], [r[3] for r in rays],
+                     np.array([r[4] for r in rays], dtype=np.intp), segments)
+    
+    entrances = []
+    entrance_id = 0
+    
+    for (point_id, is_stairs, point, _, _), best_intersection in zip(rays, hits):
+        # If found intersection with any segment, add entrance
+        if best_intersection:
+            midpoint = (
+                (point[0] + best_intersection[0]) / 2,
+                (point[1] + best_intersection[1]) / 2
+            )
             
-            # Check intersection with all segments (walls and stairs)
-            best_intersection = None
-            best_distance = float('inf')
+            entrance_id += 1
+            entrance = {
+                'id': entrance_id,
+                'x': round(midpoint[0], 1),
+                'y': round(midpoint[1], 1)
+            }
             
-            for other_seg in segments:
-                # Skip the segment this point belongs to
-                if other_seg == seg:
-                    continue
-                
-                other_seg_p1 = (other_seg['x1'], other_seg['y1'])
-                other_seg_p2 = (other_seg['x2'], other_seg['y2'])
-                
-                # Find intersection
-                intersection = line_intersection(point, line_end, other_seg_p1, other_seg_p2)
-                
-                if intersection:
-                    dist = distance(point, intersection)
-                    # Only accept if it's a reasonable distance and not at origin
-                    if dist > 1 and dist < best_distance:
-                        best_distance = dist
-                        best_intersection = intersection
+            if is_stairs:
+                entrance['stairs'] = True
             
-            # If found intersection with any segment, add entrance
-            if best_intersection:
-                midpoint = (
-                    (point[0] + best_intersection[0]) / 2,
-                    (point[1] + best_intersection[1]) / 2
-                )
-                
-                entrance_id += 1
-                entrance = {
-                    'id': entrance_id,
-                    'x': round(midpoint[0], 1),
-                    'y': round(midpoint[1], 1)
-                }
-                
-                if is_stairs:
-                    entrance['stairs'] = True
-                
-                entrances.append(entrance)
-                print(f"Point {point_id} -> intersection at {best_intersection}, midpoint: {midpoint}")
+            entrances.append(entrance)
+            print(f"Point {point_id} -> intersection at {best_intersection}, midpoint: {midpoint}")
     
     return entrances, entrance_id
 
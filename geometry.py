@@ -0,0 +1,346 @@
+"""
+Shared spatial helpers for the vectorization and snapping stages: a
+union-find, a uniform-grid neighbour search on NumPy point arrays, a
+point index for radius and nearest-neighbour lookups, a vertex welder and
+a segment grid for box queries over line segments.
+"""
+
+import math
+import numpy as np
+
+try:
+    from scipy.spatial import cKDTree
+except ImportError:
+    cKDTree = None
+
+
+class UnionFind:
+    """Disjoint sets over 0..n-1. The root of a set is always its smallest member."""
+
+    def __init__(self, n):
+        self.parent = list(range(n))
+
+    def find(self, a):
+        parent = self.parent
+        while parent[a] != a:
+            parent[a] = parent[parent[a]]
+            a = parent[a]
+        return a
+
+    def union(self, a, b):
+        ra, rb = self.find(a), self.find(b)
+        if ra == rb:
+            return False
+        if rb < ra:
+            ra, rb = rb, ra
+        self.parent[rb] = ra
+        return True
+
+    def labels(self):
+        """Root of every element as an int array."""
+        return np.array([self.find(a) for a in range(len(self.parent))], dtype=np.intp)
+
+
+def find_close_pairs(points, radius):
+    """
+    All index pairs (i, j), i < j, of points strictly closer than radius.
+
+    Points are hashed into square cells of size radius, so only the 3x3 block
+    of cells around each point is compared: near-linear for evenly spread
+    points instead of all O(n^2) pairs.
+
+    Args:
+        points: (N, 2) array-like of x, y
+        radius: Distance threshold (exclusive)
+
+    Returns:
+        (M, 2) int array of pairs, sorted by i then j
+    """
+    pts = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+    n = len(pts)
+    if n < 2 or radius <= 0:
+        return np.empty((0, 2), dtype=np.intp)
+
+    cells = np.floor(pts / radius).astype(np.int64)
+    cells -= cells.min(axis=0) - 1          # Keep neighbour keys non-negative
+    width = int(cells[:, 0].max()) + 2
+    keys = cells[:, 1] * width + cells[:, 0]
+    order = np.argsort(keys, kind='stable')
+    sorted_keys = keys[order]
+
+    found = []
+    for dy in (-1, 0, 1):
+        for dx in (-1, 0, 1):
+            target = keys + dy * width + dx
+            lo = np.searchsorted(sorted_keys, target, side='left')
+            hi = np.searchsorted(sorted_keys, target, side='right')
+            counts = hi - lo
+            if not counts.any():
+                continue
+            i = np.repeat(np.arange(n), counts)
+            offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+            j = order[np.repeat(lo, counts) + offsets]
+            keep = i < j
+            i, j = i[keep], j[keep]
+            d2 = ((pts[i] - pts[j]) ** 2).sum(axis=1)
+            close = d2 < radius * radius
+            found.append(np.stack([i[close], j[close]], axis=1))
+
+    if not found:
+        return np.empty((0, 2), dtype=np.intp)
+    pairs = np.concatenate(found)
+    pairs = pairs[np.lexsort((pairs[:, 1], pairs[:, 0]))]
+    return pairs
+
+
+def cluster_points(points, radius, groups=None):
+    """
+    Leader clusters: every member lies closer than radius to its cluster's seed.
+
+    Points are visited in (x, y) order. The first unassigned point seeds a
+    cluster and takes every unassigned neighbour closer than radius, so a
+    cluster is at most 2 * radius across however densely points chain, and
+    the result does not depend on input order.
+
+    Args:
+        points: (N, 2) array-like of x, y
+        radius: Link distance (exclusive)
+        groups: Optional length-N labels; points sharing a label never end up
+                in the same cluster (e.g. the two endpoints of one line)
+
+    Returns:
+        Length-N int array with the seed index of each point's cluster
+    """
+    pts = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+    n = len(pts)
+    visit = np.lexsort((np.arange(n), pts[:, 1], pts[:, 0]))
+    rank = np.empty(n, dtype=np.intp)
+    rank[visit] = np.arange(n)
+
+    # Neighbour lists in CSR form, each in visiting order
+    pairs = find_close_pairs(pts, radius)
+    src = np.concatenate([pairs[:, 0], pairs[:, 1]])
+    dst = np.concatenate([pairs[:, 1], pairs[:, 0]])
+    order = np.lexsort((rank[dst], src))
+    neighbours = dst[order].tolist()
+    starts = np.searchsorted(src[order], np.arange(n + 1)).tolist()
+
+    groups = None if groups is None else np.asarray(groups).tolist()
+    labels = [-1] * n
+    for seed in visit.tolist():
+        if labels[seed] >= 0:
+            continue
+        labels[seed] = seed
+        taken = {groups[seed]} if groups is not None else None
+        for j in neighbours[starts[seed]:starts[seed + 1]]:
+            if labels[j] >= 0:
+                continue
+            if taken is not None:
+                if groups[j] in taken:
+                    continue
+                taken.add(groups[j])
+            labels[j] = seed
+    return np.array(labels, dtype=np.intp)
+
+
+class PointIndex:
+    """
+    Dynamic index of 2D points for radius, box and nearest lookups.
+
+    Points live in a hash grid of square cells, so a query only looks at the
+    cells its radius overlaps: O(1) amortized when the cell size is close to
+    the usual query radius. With use_kdtree=True (and scipy installed) radius
+    and nearest queries go through a cKDTree instead, rebuilt lazily after
+    insertions; that suits static sets with widely varying query radii.
+
+    Results are always in insertion order, and ties in nearest() go to the
+    earliest inserted point, so results match a linear scan over the points
+    in the order they were added.
+    """
+
+    def __init__(self, points=(), cell_size=1.0, use_kdtree=False):
+        self.cell_size = float(cell_size) if cell_size > 0 else 1.0
+        self.points = []
+        self.grid = {}
+        self.use_kdtree = use_kdtree and cKDTree is not None
+        self._tree = None
+        for p in points:
+            self.add(p)
+
+    def __len__(self):
+        return len(self.points)
+
+    def _cell(self, x, y):
+        return math.floor(x / self.cell_size), math.floor(y / self.cell_size)
+
+    def add(self, p):
+        """Insert a point; returns its index."""
+        idx = len(self.points)
+        self.points.append(p)
+        self.grid.setdefault(self._cell(p[0], p[1]), []).append(idx)
+        self._tree = None
+        return idx
+
+    def _candidates(self, p, r):
+        if not math.isfinite(r):
+            return list(range(len(self.points)))
+        if self.use_kdtree and self.points:
+            if self._tree is None:
+                self._tree = cKDTree(np.asarray(self.points, dtype=np.float64).reshape(-1, 2))
+            return sorted(self._tree.query_ball_point((float(p[0]), float(p[1])), r + 1e-9))
+        x0, y0 = self._cell(p[0] - r, p[1] - r)
+        x1, y1 = self._cell(p[0] + r, p[1] + r)
+        if (x1 - x0 + 1) * (y1 - y0 + 1) > len(self.grid):
+            cells = [c for c in self.grid if x0 <= c[0] <= x1 and y0 <= c[1] <= y1]
+        else:
+            cells = [(cx, cy) for cx in range(x0, x1 + 1) for cy in range(y0, y1 + 1)]
+        found = []
+        for c in cells:
+            found.extend(self.grid.get(c, ()))
+        found.sort()
+        return found
+
+    def query_radius(self, p, r):
+        """Indices of points strictly closer than r to p."""
+        px, py = p[0], p[1]
+        return [i for i in self._candidates(p, r)
+                if math.hypot(px - self.points[i][0], py - self.points[i][1]) < r]
+
+    def query_box(self, p, half):
+        """Indices of points with |dx| < half and |dy| < half."""
+        px, py = p[0], p[1]
+        return [i for i in self._candidates(p, half * math.sqrt(2))
+                if abs(px - self.points[i][0]) < half and abs(py - self.points[i][1]) < half]
+
+    def nearest(self, p, max_dist):
+        """
+        (index, distance) of the closest point strictly within max_dist of p,
+        or None. Ties go to the earliest inserted point.
+        """
+        px, py = p[0], p[1]
+        best, best_dist = None, max_dist
+        for i in self._candidates(p, max_dist):
+            d = math.hypot(px - self.points[i][0], py - self.points[i][1])
+            if d < best_dist:
+                best, best_dist = i, d
+        return None if best is None else (best, best_dist)
+
+
+class VertexWelder(PointIndex):
+    """
+    Tolerance-based vertex welding on a PointIndex.
+
+    Points added to the welder are representatives; lookups match a point to
+    a representative at distance <= tolerance (inclusive, unlike the strict
+    PointIndex queries). The cell size equals the tolerance, so only the
+    neighbouring cells are searched and welding n points is near-linear.
+
+    Which representative wins is deterministic: first() returns the earliest
+    added one within tolerance, closest() the nearest with ties going to the
+    earliest added.
+    """
+
+    def __init__(self, tolerance, points=()):
+        self.tolerance = tolerance
+        super().__init__(points, cell_size=tolerance)
+
+    def _within(self, p):
+        px, py = p[0], p[1]
+        tol2 = self.tolerance * self.tolerance
+        for i in self._candidates(p, self.tolerance):
+            q = self.points[i]
+            if (px - q[0]) ** 2 + (py - q[1]) ** 2 <= tol2:
+                yield i, (px - q[0]) ** 2 + (py - q[1]) ** 2
+
+    def first(self, p):
+        """Earliest added representative within tolerance of p, or None."""
+        for i, _ in self._within(p):
+            return self.points[i]
+        return None
+
+    def closest(self, p):
+        """Nearest representative within tolerance of p, or None."""
+        best, best_d2 = None, None
+        for i, d2 in self._within(p):
+            if best_d2 is None or d2 < best_d2:
+                best, best_d2 = i, d2
+        return None if best is None else self.points[best]
+
+    def weld(self, p):
+        """Representative for p: the earliest one within tolerance, else p itself as a new one."""
+        rep = self.first(p)
+        if rep is None:
+            self.add(p)
+            rep = p
+        return rep
+
+
+class SegmentGrid:
+    """
+    Dynamic uniform-grid index of segment bounding boxes.
+
+    Each segment is registered in every cell its bounding box overlaps, so a
+    box query returns every segment whose bounding box may touch the box
+    (plus a few false positives). Segments covering more than max_cells cells
+    are kept in a separate list that every query returns, which keeps long
+    diagonal walls from filling thousands of cells.
+    """
+
+    def __init__(self, cell_size=1.0, max_cells=256):
+        self.cell_size = float(cell_size) if cell_size > 0 else 1.0
+        self.max_cells = max_cells
+        self.grid = {}
+        self.large = set()
+        self._cells = {}           # Segment id -> cells it is registered in
+
+    def __len__(self):
+        return len(self._cells)
+
+    def _cell_range(self, x0, y0, x1, y1):
+        c = self.cell_size
+        return (math.floor(min(x0, x1) / c), math.floor(min(y0, y1) / c),
+                math.floor(max(x0, x1) / c), math.floor(max(y0, y1) / c))
+
+    def add(self, idx, seg):
+        """Register segment idx with endpoints seg = (x1, y1, x2, y2)."""
+        cx0, cy0, cx1, cy1 = self._cell_range(*seg[:4])
+        if (cx1 - cx0 + 1) * (cy1 - cy0 + 1) > self.max_cells:
+            self.large.add(idx)
+            self._cells[idx] = None
+            return
+        cells = [(cx, cy) for cx in range(cx0, cx1 + 1) for cy in range(cy0, cy1 + 1)]
+        for cell in cells:
+            self.grid.setdefault(cell, set()).add(idx)
+        self._cells[idx] = cells
+
+    def remove(self, idx):
+        cells = self._cells.pop(idx)
+        if cells is None:
+            self.large.discard(idx)
+            return
+        for cell in cells:
+            members = self.grid[cell]
+            members.discard(idx)
+            if not members:
+                del self.grid[cell]
+
+    def move(self, idx, seg):
+        """Re-register segment idx after its endpoints changed."""
+        self.remove(idx)
+        self.add(idx, seg)
+
+    def query_box(self, x0, y0, x1, y1):
+        """Sorted ids of segments whose cells overlap the box [x0, x1] x [y0, y1]."""
+        cx0, cy0, cx1, cy1 = self._cell_range(x0, y0, x1, y1)
+        found = set(self.large)
+        if (cx1 - cx0 + 1) * (cy1 - cy0 + 1) > len(self.grid):
+            for (cx, cy), members in self.grid.items():
+                if cx0 <= cx <= cx1 and cy0 <= cy <= cy1:
+                    found |= members
+        else:
+            for cx in range(cx0, cx1 + 1):
+                for cy in range(cy0, cy1 + 1):
+                    members = self.grid.get((cx, cy))
+                    if members:
+                        found |= members
+        return sorted(found)
@@ -1,10 +1,193 @@
 import json
+import math
 import cv2
 import numpy as np
 
-def group_stair_polygons(input_file, output_file, visualize=True, vis_output="stair_polygons_visualization.jpg"):
+from geometry import UnionFind
+
+
+def _shoelace(points):
+    """Signed area and centroid moments (sum of (x_i + x_i+1) * cross, same for y)."""
+    area2 = mx = my = 0.0
+    for (x0, y0), (x1, y1) in zip(points, points[1:] + points[:1]):
+        cross = x0 * y1 - x1 * y0
+        area2 += cross
+        mx += (x0 + x1) * cross
+        my += (y0 + y1) * cross
+    return area2 / 2.0, mx, my
+
+
+def _outline(vertices, edges):
+    """
+    Outer boundary of a connected set of edges as a closed vertex walk.
+
+    Faces are traced by always taking the next edge clockwise at each vertex;
+    the outer face encloses every bounded face, so it is the face with the
+    largest absolute shoelace area. Edges that stick out of the polygon are
+    walked twice in opposite directions and add nothing to the area.
+
+    Args:
+        vertices: List of (x, y) points
+        edges: Set of (i, j) vertex index pairs, i != j
+
+    Returns:
+        List of (x, y) points of the outer face (first point not repeated)
+    """
+    neighbours = {}
+    for i, j in edges:
+        neighbours.setdefault(i, []).append(j)
+        neighbours.setdefault(j, []).append(i)
+    for i, nbrs in neighbours.items():
+        x0, y0 = vertices[i]
+        nbrs.sort(key=lambda j: (math.atan2(vertices[j][1] - y0, vertices[j][0] - x0), j))
+    position = {(i, j): k for i, nbrs in neighbours.items() for k, j in enumerate(nbrs)}
+
+    best, best_area = [], -1.0
+    visited = set()
+    for start in sorted(position):
+        if start in visited:
+            continue
+        face = []
+        half_edge = start
+        while half_edge not in visited:
+            visited.add(half_edge)
+            i, j = half_edge
+            face.append(i)
+            nbrs = neighbours[j]
+            half_edge = (j, nbrs[(position[(j, i)] - 1) % len(nbrs)])
+        area = abs(_shoelace([vertices[i] for i in face])[0])
+        if area > best_area:
+            best, best_area = face, area
+    return [vertices[i] for i in best]
+
+
+def _polygon_record(poly_id, segments, indices):
+    """Table row for the polygon made of segments[indices] (see polygon_table)."""
+    vertex_ids = {}
+    degree = []
+    edges = set()
+    length_sum = mid_x = mid_y = 0.0
+    for idx in indices:
+        seg = segments[idx]
+        ends = []
+        for vertex in ((seg['x1'], seg['y1']), (seg['x2'], seg['y2'])):
+            if vertex not in vertex_ids:
+                vertex_ids[vertex] = len(vertex_ids)
+                degree.append(0)
+            degree[vertex_ids[vertex]] += 1
+            ends.append(vertex_ids[vertex])
+        if ends[0] != ends[1]:
+            edges.add((min(ends), max(ends)))
+        length = math.hypot(seg['x2'] - seg['x1'], seg['y2'] - seg['y1'])
+        length_sum += length
+        mid_x += length * (seg['x1'] + seg['x2']) / 2.0
+        mid_y += length * (seg['y1'] + seg['y2']) / 2.0
+
+    vertices = list(vertex_ids)
+    xs = [v[0] for v in vertices]
+    ys = [v[1] for v in vertices]
+
+    area, mx, my = _shoelace(_outline(vertices, edges)) if edges else (0.0, 0.0, 0.0)
+    if abs(area) > 1e-9:
+        centroid = (mx / (6.0 * area), my / (6.0 * area))
+    elif length_sum > 0:
+        # Open chain: centroid of the segments themselves
+        centroid = (mid_x / length_sum, mid_y / length_sum)
+    else:
+        centroid = (sum(xs) / len(xs), sum(ys) / len(ys))
+
+    return {
+        'id': poly_id,
+        'segments': list(indices),
+        'closed': bool(edges) and min(degree) >= 2,
+        'bbox': (min(xs), min(ys), max(xs), max(ys)),
+        'area': abs(area),
+        'centroid': centroid,
+    }
+
+
+def polygon_table(segments, polygon_assignments=None):
+    """
+    Geometry of every stair polygon, computed once for all consumers.
+
+    Args:
+        segments: List of segment dicts
+        polygon_assignments: Dict mapping segment index to polygon ID; by
+                             default the segments' own 'stair_polygon_id'
+
+    Returns:
+        List of dicts sorted by polygon ID, each with:
+            id: Polygon ID
+            segments: Indices into segments, in list order
+            closed: True if no endpoint is left dangling (every vertex is
+                    shared by at least two segment ends)
+            bbox: (min_x, min_y, max_x, max_y)
+            area: Shoelace area enclosed by the outer boundary (0 if open)
+            centroid: (x, y) area centroid of the outer boundary; for open
+                      polygons the length-weighted centroid of the segments
+    """
+    if polygon_assignments is None:
+        polygon_assignments = {idx: seg['stair_polygon_id'] for idx, seg in enumerate(segments)
+                               if 'stair_polygon_id' in seg}
+    members = {}
+    for idx in sorted(polygon_assignments):
+        members.setdefault(polygon_assignments[idx], []).append(idx)
+    return [_polygon_record(poly_id, segments, members[poly_id]) for poly_id in sorted(members)]
+
+
+def group_stair_segments(segments):
     """
     Group stair segments that form polygons together and assign polygon IDs.
+
+    Stair segments sharing an endpoint are joined with a union-find, so each
+    connected set of stairs becomes one polygon. IDs count up from 1 in the
+    order of each polygon's first segment in the list; walls never link
+    stairs together.
+
+    Args:
+        segments: List of segment dicts with walls and stairs ('type' key)
+
+    Returns:
+        Tuple (output_segments, polygons): copies of the segments with
+        'stair_polygon_id' set on every stair, and the polygon_table rows
+        of the polygons
+    """
+    stair_indices = [idx for idx, seg in enumerate(segments) if seg.get('type') == 'stair']
+
+    # Union stairs that share a vertex with the first stair seen at that vertex
+    uf = UnionFind(len(stair_indices))
+    first_at_vertex = {}
+    for k, idx in enumerate(stair_indices):
+        seg = segments[idx]
+        for vertex in ((seg['x1'], seg['y1']), (seg['x2'], seg['y2'])):
+            other = first_at_vertex.setdefault(vertex, k)
+            if other != k:
+                uf.union(k, other)
+
+    # Roots are the smallest member, so numbering roots as they first appear
+    # follows the order of each polygon's first segment
+    root_ids = {}
+    polygon_assignments = {}
+    for k, idx in enumerate(stair_indices):
+        root = uf.find(k)
+        if root not in root_ids:
+            root_ids[root] = len(root_ids) + 1
+        polygon_assignments[idx] = root_ids[root]
+
+    output_segments = []
+    for idx, seg in enumerate(segments):
+        seg_copy = seg.copy()
+        if idx in polygon_assignments:
+            seg_copy['stair_polygon_id'] = polygon_assignments[idx]
+        output_segments.append(seg_copy)
+
+    return output_segments, polygon_table(segments, polygon_assignments)
+
+
+def group_stair_polygons(input_file, output_file, visualize=True, vis_output="stair_polygons_visualization.jpg"):
+    """
+    Group stair segments of a combined JSON file into polygons and save the
+    result (see group_stair_segments).
     
     Args:
         input_file: Path to combined JSON with walls and stairs
@@ -16,102 +199,32 @@ def group_stair_polygons(input_file, output_file, visualize=True, vis_output="st
     
     print(f"Loaded {len(segments)} segments")
     
-    # Extract stair segments
-    stair_segments = {}
-    stair_indices = []
-    
-    for idx, seg in enumerate(segments):
-        if seg.get('type') == 'stair':
-            stair_segments[idx] = seg
-            stair_indices.append(idx)
-    
-    print(f"Found {len(stair_segments)} stair segments")
-    
-    # Build adjacency graph
-    # Map (x,y) to list of segment indices that have this as start or end point
-    vertex_to_segments = {}
-    
-    for idx in stair_indices:
-        seg = segments[idx]
-        start = (seg['x1'], seg['y1'])
-        end = (seg['x2'], seg['y2'])
-        
-        if start not in vertex_to_segments:
-            vertex_to_segments[start] = []
-        if end not in vertex_to_segments:
-            vertex_to_segments[end] = []
-        
-        vertex_to_segments[start].append((idx, 'start'))
-        vertex_to_segments[end].append((idx, 'end'))
-    
-    # Group connected stair segments into polygons
-    polygon_id = 0
-    assigned = set()
-    polygon_assignments = {}  # Maps segment index to polygon ID
+    output_segments, polygons = group_stair_segments(segments)
+    stair_count = sum(len(poly['segments']) for poly in polygons)
     
-    for start_idx in stair_indices:
-        if start_idx in assigned:
-            continue
-        
-        # BFS to find all connected segments
-        polygon_segments = []
-        queue = [start_idx]
-        polygon_id += 1
-        
-        while queue:
-            idx = queue.pop(0)
-            
-            if idx in assigned:
-                continue
-            
-            assigned.add(idx)
-            polygon_segments.append(idx)
-            polygon_assignments[idx] = polygon_id
-            
-            seg = segments[idx]
-            start = (seg['x1'], seg['y1'])
-            end = (seg['x2'], seg['y2'])
-            
-            # Find adjacent segments
-            for adjacent_idx, _ in vertex_to_segments[start]:
-                if adjacent_idx not in assigned and adjacent_idx in stair_segments:
-                    queue.append(adjacent_idx)
-            
-            for adjacent_idx, _ in vertex_to_segments[end]:
-                if adjacent_idx not in assigned and adjacent_idx in stair_segments:
-                    queue.append(adjacent_idx)
-        
-        print(f"  Polygon {polygon_id}: {len(polygon_segments)} segments")
-    
-    # Add polygon IDs to segments
-    output_segments = []
+    print(f"Found {stair_count} stair segments")
     
-    for idx, seg in enumerate(segments):
-        seg_copy = seg.copy()
-        
-        if idx in polygon_assignments:
-            seg_copy['stair_polygon_id'] = polygon_assignments[idx]
-        
-        output_segments.append(seg_copy)
+    for poly in polygons:
+        print(f"  Polygon {poly['id']}: {len(poly['segments'])} segments")
     
     # Save output
     with open(output_file, 'w') as f:
         json.dump(output_segments, f, indent=2)
     
-    print(f"\nGrouped {len(stair_segments)} stair segments into {polygon_id} polygons")
+    print(f"\nGrouped {stair_count} stair segments into {len(polygons)} polygons")
     print(f"Saved to {output_file}")
     
     # Generate visualization if requested
     if visualize:
-        visualize_stair_polygons(segments, polygon_assignments, vis_output)
+        visualize_stair_polygons(segments, polygons, vis_output)
 
-def visualize_stair_polygons(segments, polygon_assignments, output_img_path):
+def visualize_stair_polygons(segments, polygons, output_img_path):
     """
     Create an image visualization of the floor plan with stair polygon IDs.
     
     Args:
         segments: List of all segments with type information
-        polygon_assignments: Dict mapping segment index to polygon ID
+        polygons: polygon_table rows of the stair polygons
         output_img_path: Path to save the visualization image
     """
     
@@ -152,25 +265,10 @@ def visualize_stair_polygons(segments, polygon_assignments, output_img_path):
     
     # Draw polygon IDs for stairs
     font = cv2.FONT_HERSHEY_SIMPLEX
-    polygon_centroids = {}
-    
-    for idx, seg in enumerate(segments):
-        if idx in polygon_assignments:
-            poly_id = polygon_assignments[idx]
-            
-            if poly_id not in polygon_centroids:
-                polygon_centroids[poly_id] = {'x_sum': 0, 'y_sum': 0, 'count': 0}
-            
-            polygon_centroids[poly_id]['x_sum'] += seg['x1'] + seg['x2']
-            polygon_centroids[poly_id]['y_sum'] += seg['y1'] + seg['y2']
-            polygon_centroids[poly_id]['count'] += 2
-    
-    # Draw polygon ID labels at centroids
-    for poly_id, centroid_data in polygon_centroids.items():
-        cx = int(centroid_data['x_sum'] / centroid_data['count'])
-        cy = int(centroid_data['y_sum'] / centroid_data['count'])
+    for poly in polygons:
+        cx, cy = int(poly['centroid'][0]), int(poly['centroid'][1])
         
-        label = f"ID {poly_id}"
+        label = f"ID {poly['id']}"
         cv2.putText(img, label, (cx - 20, cy), font, 0.6, (0, 0, 255), 2, cv2.LINE_AA)
     
     # Legend
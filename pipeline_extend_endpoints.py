@@ -1,7 +1,18 @@
 import cv2
+import bisect
+import heapq
 import numpy as np
 from typing import List, Dict, Tuple, Optional
 
+from geometry import SegmentGrid
+
+# Slack added to every index query so float rounding in the exact checks can
+# never make the index miss a candidate
+INDEX_EPS = 1e-6
+
+# Safety bound on extend_endpoints passes when it runs to convergence
+EXTEND_MAX_PASSES = 50
+
 def line_intersection(x1: float, y1: float, x2: float, y2: float, 
                      x3: float, y3: float, x4: float, y4: float) -> Optional[Tuple[float, float]]:
     """
@@ -72,7 +83,412 @@ def distance_point_to_point(p1: Tuple[float, float], p2: Tuple[float, float]) ->
     """Calculate Euclidean distance between two points."""
     return ((p1[0] - p2[0]) ** 2 + (p1[1] - p2[1]) ** 2) ** 0.5
 
-def extend_endpoints(lines_data: List[Dict], max_iterations: int = 3, tolerance: float = 2.0, snap_distance: float = 50.0) -> List[Dict]:
+class _LineIndex:
+    """
+    Candidate lookups for extend_endpoints.
+
+    The on-line and already-crossed checks treat the other lines as infinite,
+    so they cannot be answered from a local neighbourhood. Horizontal lines
+    are bucketed by y and vertical lines by x, which turns those checks into
+    range queries; the remaining oblique lines are tested with one vectorized
+    pass. The intersection search only accepts points within 2 px of the
+    other segment, so it uses a SegmentGrid around the endpoint.
+
+    Every query returns a superset of the lines the original full scans would
+    accept; the exact checks are then run on the candidates alone.
+    """
+
+    def __init__(self, lines, cell_size):
+        self.lines = lines
+        self.coords = np.zeros((len(lines), 4), dtype=np.float64)
+        self.kinds = [None] * len(lines)
+        self.h_keys, self.h_lines = [], {}     # Sorted ys, y -> ids of horizontals
+        self.v_keys, self.v_lines = [], {}     # Sorted xs, x -> ids of verticals
+        self.obliques = set()
+        self._oblique = None                   # Cached oblique columns, see _oblique_columns
+        self.grid = SegmentGrid(cell_size)
+        for i in range(len(lines)):
+            self._insert(i)
+
+    @staticmethod
+    def _bucket_add(keys, buckets, key, i):
+        if key not in buckets:
+            bisect.insort(keys, key)
+            buckets[key] = set()
+        buckets[key].add(i)
+
+    @staticmethod
+    def _bucket_remove(keys, buckets, key, i):
+        members = buckets[key]
+        members.discard(i)
+        if not members:
+            del buckets[key]
+            del keys[bisect.bisect_left(keys, key)]
+
+    @staticmethod
+    def _bucket_range(keys, buckets, lo, hi):
+        found = []
+        for key in keys[bisect.bisect_left(keys, lo):bisect.bisect_right(keys, hi)]:
+            found.extend(buckets[key])
+        return found
+
+    def _insert(self, i):
+        line = self.lines[i]
+        x1, y1, x2, y2 = line['x1'], line['y1'], line['x2'], line['y2']
+        self.coords[i] = (x1, y1, x2, y2)
+        self.grid.add(i, (x1, y1, x2, y2))
+        if x1 == x2 and y1 == y2:
+            kind = None                        # A point: never matches anything
+        elif y1 == y2:
+            kind = ('h', y1)
+            self._bucket_add(self.h_keys, self.h_lines, y1, i)
+        elif x1 == x2:
+            kind = ('v', x1)
+            self._bucket_add(self.v_keys, self.v_lines, x1, i)
+        else:
+            kind = 'o'
+            self.obliques.add(i)
+        self.kinds[i] = kind
+
+    def update(self, i):
+        """Refresh line i after one of its endpoints moved."""
+        kind = self.kinds[i]
+        if kind == 'o':
+            self.obliques.discard(i)
+        elif kind is not None and kind[0] == 'h':
+            self._bucket_remove(self.h_keys, self.h_lines, kind[1], i)
+        elif kind is not None:
+            self._bucket_remove(self.v_keys, self.v_lines, kind[1], i)
+        self.grid.remove(i)
+        self._insert(i)
+
+        if kind == 'o' and self.kinds[i] == 'o' and self._oblique is not None:
+            # Still oblique: patch its row of the cached columns in place
+            ids, ox, oy, dx, dy, norm, rows = self._oblique
+            r = rows[i]
+            x1, y1, x2, y2 = self.coords[i]
+            ox[r], oy[r], dx[r], dy[r] = x1, y1, x2 - x1, y2 - y1
+            norm[r] = np.hypot(dx[r], dy[r])
+        elif kind == 'o' or self.kinds[i] == 'o':
+            self._oblique = None
+
+    def _oblique_columns(self):
+        """(ids, x1, y1, dx, dy, length, id -> row) of the oblique lines."""
+        if self._oblique is None:
+            ids = np.array(sorted(self.obliques), dtype=np.intp)
+            c = self.coords[ids]
+            dx, dy = c[:, 2] - c[:, 0], c[:, 3] - c[:, 1]
+            rows = {i: r for r, i in enumerate(ids.tolist())}
+            self._oblique = (ids, c[:, 0].copy(), c[:, 1].copy(), dx, dy, np.hypot(dx, dy), rows)
+        return self._oblique
+
+    def near_lines(self, px, py, tol):
+        """
+        Ids of lines whose infinite extension may pass within tol of (px, py).
+        A generator: horizontals and verticals come first, and the obliques
+        are only tested if the caller has not stopped by then.
+        """
+        r = tol + INDEX_EPS
+        yield from self._bucket_range(self.h_keys, self.h_lines, py - r, py + r)
+        yield from self._bucket_range(self.v_keys, self.v_lines, px - r, px + r)
+        if self.obliques:
+            ids, ox, oy, dx, dy, norm, _ = self._oblique_columns()
+            cross = np.abs((px - ox) * dy - (py - oy) * dx)
+            yield from ids[cross <= r * norm].tolist()
+
+    def crossing_lines(self, ax, ay, bx, by):
+        """Sorted ids of lines whose infinite extension may cross the segment a-b."""
+        e = INDEX_EPS
+        found = self._bucket_range(self.h_keys, self.h_lines, min(ay, by) - e, max(ay, by) + e)
+        found += self._bucket_range(self.v_keys, self.v_lines, min(ax, bx) - e, max(ax, bx) + e)
+        if self.obliques:
+            ids, ox, oy, dx, dy, norm, _ = self._oblique_columns()
+            side_a = (ax - ox) * dy - (ay - oy) * dx
+            side_b = (bx - ox) * dy - (by - oy) * dx
+            tol = e * norm
+            apart = ((side_a > tol) & (side_b > tol)) | ((side_a < -tol) & (side_b < -tol))
+            found += ids[~apart].tolist()
+        found.sort()
+        return found
+
+    def endpoints_near_line(self, seg, tol):
+        """
+        Endpoint ids (2 * line + 0/1) that may lie within tol of the infinite
+        line through seg; the reverse of near_lines.
+        """
+        x1, y1, x2, y2 = seg
+        dx, dy = x2 - x1, y2 - y1
+        if dx == 0 and dy == 0:
+            return []
+        pts = self.coords.reshape(-1, 2)
+        cross = np.abs((pts[:, 0] - x1) * dy - (pts[:, 1] - y1) * dx)
+        return np.flatnonzero(cross <= (tol + INDEX_EPS) * np.hypot(dx, dy)).tolist()
+
+    def lines_crossed_by(self, seg):
+        """Ids of lines the infinite line through seg may cross; the reverse of crossing_lines."""
+        x1, y1, x2, y2 = seg
+        dx, dy = x2 - x1, y2 - y1
+        if dx == 0 and dy == 0:
+            return []
+        c = self.coords
+        side_a = (c[:, 0] - x1) * dy - (c[:, 1] - y1) * dx
+        side_b = (c[:, 2] - x1) * dy - (c[:, 3] - y1) * dx
+        tol = INDEX_EPS * np.hypot(dx, dy)
+        apart = ((side_a > tol) & (side_b > tol)) | ((side_a < -tol) & (side_b < -tol))
+        return np.flatnonzero(~apart).tolist()
+
+    def segments_near(self, px, py, r):
+        """Sorted ids of segments that may come within r of (px, py)."""
+        r += INDEX_EPS
+        return self.grid.query_box(px - r, py - r, px + r, py + r)
+
+
+def _snap_free_endpoint(lines: List[Dict], index: _LineIndex, line_idx: int, position: str,
+                        tolerance: float, snap_distance: float) -> Optional[Tuple[int, int]]:
+    """
+    Decide where one free endpoint should move.
+
+    Every check only looks at the candidate lines the index returns, so the
+    results are the same as scanning all lines.
+
+    Args:
+        lines: All line segments
+        index: _LineIndex over lines
+        line_idx: Line the endpoint belongs to
+        position: 'start' or 'end'
+        tolerance: Distance threshold to consider endpoint "on" a line (pixels)
+        snap_distance: Maximum distance to an intersection the endpoint is snapped to
+
+    Returns:
+        New (x, y) of the endpoint, or None if it stays where it is
+    """
+    current_line = lines[line_idx]
+    
+    # Get line endpoints
+    x1, y1 = current_line['x1'], current_line['y1']
+    x2, y2 = current_line['x2'], current_line['y2']
+    
+    px, py = (x1, y1) if position == 'start' else (x2, y2)
+    
+    # ============= CHECK: Is this endpoint already on another line? =============
+    already_on_line = False
+    
+    for other_idx in index.near_lines(px, py, tolerance):
+        if other_idx == line_idx:
+            continue  # Skip own line
+        other_line = lines[other_idx]
+        
+        ox1, oy1 = other_line['x1'], other_line['y1']
+        ox2, oy2 = other_line['x2'], other_line['y2']
+        
+        # Calculate distance from endpoint to other line (using projection)
+        dx = ox2 - ox1
+        dy = oy2 - oy1
+        
+        if dx == 0 and dy == 0:
+            continue
+        
+        # Project point onto line
+        t = ((px - ox1) * dx + (py - oy1) * dy) / (dx * dx + dy * dy)
+        proj_x = ox1 + t * dx
+        proj_y = oy1 + t * dy
+        
+        # Distance to line
+        dist_to_line = distance_point_to_point((px, py), (proj_x, proj_y))
+        
+        if dist_to_line <= tolerance:
+            already_on_line = True
+            break
+    
+    # If already on a line, skip this endpoint
+    if already_on_line:
+        return None
+    
+    # ============= CHECK: Does line already intersect another line? =============
+    # Check if the current line segment already crosses any other line
+    already_intersects = []
+    
+    # Calculate parameter t for the endpoint on the current line. Only the
+    # part of the line between its start and the endpoint can hold a
+    # crossing that the endpoint has passed
+    crossing_candidates = []
+    dx_current = x2 - x1
+    dy_current = y2 - y1
+    if abs(dx_current) > abs(dy_current):
+        t_endpoint = (px - x1) / dx_current
+    else:
+        t_endpoint = (py - y1) / dy_current if dy_current != 0 else 0
+    if t_endpoint != 0:
+        crossing_candidates = index.crossing_lines(x1, y1, x1 + t_endpoint * dx_current,
+                                                   y1 + t_endpoint * dy_current)
+    
+    for other_idx in crossing_candidates:
+        if other_idx == line_idx:
+            continue
+        other_line = lines[other_idx]
+        
+        ox1, oy1 = other_line['x1'], other_line['y1']
+        ox2, oy2 = other_line['x2'], other_line['y2']
+        
+        # Find intersection of infinite lines
+        intersection = line_intersection(x1, y1, x2, y2, ox1, oy1, ox2, oy2)
+        
+        if intersection is not None:
+            ix, iy = intersection
+            
+            # Check if endpoint has already passed this intersection
+            # (i.e., is on the far side of the intersection from the other endpoint)
+            # Calculate parameter t for the intersection on the current line
+            if abs(dx_current) > abs(dy_current):
+                t_intersection = (ix - x1) / dx_current  # Use x as reference
+            else:
+                t_intersection = (iy - y1) / dy_current  # Use y as reference
+            
+            # If endpoint parameter is beyond intersection parameter (same direction),
+            # the endpoint has already passed the intersection
+            if (t_endpoint > 0 and t_intersection > 0 and t_endpoint >= t_intersection) or \
+               (t_endpoint < 0 and t_intersection < 0 and t_endpoint <= t_intersection):
+                # Endpoint is on the far side - it has already crossed this line
+                dist_to_intersection = distance_point_to_point((px, py), (ix, iy))
+                already_intersects.append((dist_to_intersection, (ix, iy), other_idx))
+    
+    # If endpoint already intersects/crosses another line, snap it back to that intersection
+    if already_intersects:
+        already_intersects.sort(key=lambda x: x[0])
+        closest_dist, snap_pt, snap_line_idx = already_intersects[0]
+        
+        new_x = int(round(snap_pt[0]))
+        new_y = int(round(snap_pt[1]))
+        
+        if new_x != px or new_y != py:
+            return new_x, new_y
+        return None  # Skip to next endpoint
+    
+    # ============= FIND: Intersection points of this line with other lines =============
+    intersections = []
+    
+    # Accepted intersections lie within 2px of the other segment
+    for other_idx in index.segments_near(px, py, snap_distance + 2.0):
+        if other_idx == line_idx:
+            continue  # Skip own line
+        other_line = lines[other_idx]
+        
+        ox1, oy1 = other_line['x1'], other_line['y1']
+        ox2, oy2 = other_line['x2'], other_line['y2']
+        
+        # Find intersection between current line and other line
+        intersection = line_intersection(x1, y1, x2, y2, ox1, oy1, ox2, oy2)
+        
+        if intersection is not None:
+            ix, iy = intersection
+            
+            # VALIDATION: Check if intersection is actually on the other line segment
+            dist_to_segment = distance_point_to_line_segment((ix, iy), (ox1, oy1), (ox2, oy2))
+            
+            # Only accept if intersection is on the segment (within 2px tolerance)
+            if dist_to_segment > 2.0:
+                continue
+            
+            # Calculate distance from endpoint to this intersection
+            dist = distance_point_to_point((px, py), (ix, iy))
+            
+            # Only consider intersections within snap_distance
+            if dist <= snap_distance:
+                intersections.append((dist, (ix, iy), other_idx))
+    
+    # ============= STEP 3: Snap to closest intersection =============
+    if intersections:
+        # Sort by distance and get the closest one
+        intersections.sort(key=lambda x: x[0])
+        closest_dist, closest_pt, closest_line_idx = intersections[0]
+        
+        # Snap to the intersection point
+        new_x = int(round(closest_pt[0]))
+        new_y = int(round(closest_pt[1]))
+        
+        # Only apply if position actually changed
+        if new_x != px or new_y != py:
+            return new_x, new_y
+    return None
+
+
+def _same_infinite_line(old, new):
+    """
+    True if two integer segments are the same horizontal or vertical line.
+    The on-line and already-crossed checks only see the infinite line of the
+    other segment, and for integer horizontals and verticals their float
+    results depend on nothing but its y (or x), so moving such a line along
+    itself cannot change them.
+    """
+    if not all(isinstance(v, (int, np.integer)) for v in (*old, *new)):
+        return False
+    ox1, oy1, ox2, oy2 = old
+    nx1, ny1, nx2, ny2 = new
+    if oy1 == oy2 == ny1 == ny2:
+        return ox1 != ox2 and nx1 != nx2
+    if ox1 == ox2 == nx1 == nx2:
+        return oy1 != oy2 and ny1 != ny2
+    return False
+
+
+class _EndpointTracker:
+    """
+    Endpoint bookkeeping for the extend_endpoints worklist.
+
+    Endpoint e is the start (e even) or end (e odd) of line e // 2, which is
+    also the order a full pass over the free endpoints visits them in. The
+    tracker keeps which endpoints share each point, so free endpoints are
+    known without rebuilding the usage map, and a SegmentGrid of endpoints
+    for finding the ones near a moved line.
+    """
+
+    def __init__(self, lines, cell_size):
+        self.lines = lines
+        self.at_point = {}
+        self.grid = SegmentGrid(cell_size)
+        self._start_counts = {}
+        for e in range(2 * len(lines)):
+            pt = self.point(e)
+            self.at_point.setdefault(pt, set()).add(e)
+            self.grid.add(e, pt + pt)
+
+    def point(self, e):
+        line = self.lines[e >> 1]
+        return (line['x1'], line['y1']) if e & 1 == 0 else (line['x2'], line['y2'])
+
+    def begin_round(self):
+        self._start_counts = {}
+
+    def free_at_round_start(self, e):
+        """
+        Whether e was free when the current round began. Only valid while e
+        itself has not moved this round, which holds for every endpoint the
+        round has still to visit.
+        """
+        pt = self.point(e)
+        return self._start_counts.get(pt, len(self.at_point[pt])) == 1
+
+    def move(self, e, old_pt):
+        """Record that endpoint e moved from old_pt; returns the endpoints at both points."""
+        new_pt = self.point(e)
+        for pt in (old_pt, new_pt):
+            self._start_counts.setdefault(pt, len(self.at_point.get(pt, ())))
+        members = self.at_point[old_pt]
+        members.discard(e)
+        if not members:
+            del self.at_point[old_pt]
+        self.at_point.setdefault(new_pt, set()).add(e)
+        self.grid.move(e, new_pt + new_pt)
+        return members | self.at_point[new_pt]
+
+    def near_segment(self, seg, r):
+        """Endpoints that may lie within r of the segment seg."""
+        x1, y1, x2, y2 = seg
+        return self.grid.query_box(min(x1, x2) - r, min(y1, y2) - r, max(x1, x2) + r, max(y1, y2) + r)
+
+
+def extend_endpoints(lines_data: List[Dict], max_iterations: Optional[int] = None, tolerance: float = 2.0,
+                     snap_distance: float = 50.0, stats: Optional[Dict] = None) -> List[Dict]:
     """
     Extend/shrink line endpoints to snap them to line intersections.
     
@@ -84,10 +500,23 @@ def extend_endpoints(lines_data: List[Dict], max_iterations: int = 3, tolerance:
     5. Snap to the closest intersection
     6. Repeat until convergence
     
+    Passes are driven by a worklist: after an endpoint moves, only the
+    endpoints whose checks could see the change are queued again (those of
+    the moved line, those sharing its old or new point, those within reach
+    of the moved segment and, if the line's infinite extension changed,
+    those near it or on lines it crosses). Each pass visits its queued
+    endpoints in the order a full pass would, so a pass gives the same
+    result as re-checking every free endpoint.
+    
     Args:
         lines_data: List of line segments with x1, y1, x2, y2 keys
-        max_iterations: Maximum number of passes to attempt
+        max_iterations: Maximum number of passes; None runs until no endpoint
+                        is queued (bounded by EXTEND_MAX_PASSES)
         tolerance: Distance threshold to consider endpoint "on" a line (pixels)
+        snap_distance: Maximum distance to an intersection the endpoint is snapped to
+        stats: Optional dict; receives 'passes', a list with the number of
+               endpoints processed, moved and queued for the next pass, the
+               total 'modifications' and whether the worklist 'converged'
     
     Returns:
         Modified lines_data with endpoints snapped to line intersections
@@ -97,207 +526,87 @@ def extend_endpoints(lines_data: List[Dict], max_iterations: int = 3, tolerance:
     
     # Deep copy to avoid modifying input
     lines = [dict(line) for line in lines_data]
+    index = _LineIndex(lines, cell_size=snap_distance)
+    endpoints = _EndpointTracker(lines, cell_size=snap_distance)
+    reach = snap_distance + 2.0 + INDEX_EPS
+    if max_iterations is None:
+        max_iterations = EXTEND_MAX_PASSES
         
     total_modifications = 0
+    passes = []
+    queued = set(range(2 * len(lines)))
     
     for iteration in range(max_iterations):
+        if not queued:
+            break
         
-        # ============= STEP 1: Find free endpoints =============
-        endpoint_usage = {}
-        
-        for line_idx, line in enumerate(lines):
-            p1 = (line['x1'], line['y1'])
-            p2 = (line['x2'], line['y2'])
-            
-            if p1 not in endpoint_usage:
-                endpoint_usage[p1] = []
-            if p2 not in endpoint_usage:
-                endpoint_usage[p2] = []
-            
-            endpoint_usage[p1].append((line_idx, 'start'))
-            endpoint_usage[p2].append((line_idx, 'end'))
-        
-        # Identify free endpoints (used by exactly 1 line)
-        free_endpoints = {pt: uses for pt, uses in endpoint_usage.items() if len(uses) == 1}
-        
+        # ============= STEP 1: Queue the free endpoints that need a look =============
+        endpoints.begin_round()
+        heap = sorted(e for e in queued if endpoints.free_at_round_start(e))
+        in_heap = set(heap)
+        queued = set()
         
-        # ============= STEP 2: Process each free endpoint =============
+        # ============= STEP 2: Process queued free endpoints in pass order =============
+        processed = 0
         modifications_this_iteration = 0
         
-        for endpoint_pt, uses in free_endpoints.items():
-            line_idx, position = uses[0]
+        while heap:
+            e = heapq.heappop(heap)
+            processed += 1
+            line_idx, position = e >> 1, ('start' if e & 1 == 0 else 'end')
             current_line = lines[line_idx]
+            old_seg = (current_line['x1'], current_line['y1'], current_line['x2'], current_line['y2'])
             
-            # Get line endpoints
-            x1, y1 = current_line['x1'], current_line['y1']
-            x2, y2 = current_line['x2'], current_line['y2']
-            
-            px, py = endpoint_pt
-            
-            # ============= CHECK: Is this endpoint already on another line? =============
-            already_on_line = False
-            
-            for other_idx, other_line in enumerate(lines):
-                if other_idx == line_idx:
-                    continue  # Skip own line
-                
-                ox1, oy1 = other_line['x1'], other_line['y1']
-                ox2, oy2 = other_line['x2'], other_line['y2']
-                
-                # Calculate distance from endpoint to other line (using projection)
-                dx = ox2 - ox1
-                dy = oy2 - oy1
-                
-                if dx == 0 and dy == 0:
-                    continue
-                
-                # Project point onto line
-                t = ((px - ox1) * dx + (py - oy1) * dy) / (dx * dx + dy * dy)
-                proj_x = ox1 + t * dx
-                proj_y = oy1 + t * dy
-                
-                # Distance to line
-                dist_to_line = distance_point_to_point((px, py), (proj_x, proj_y))
-                
-                if dist_to_line <= tolerance:
-                    already_on_line = True
-                    break
-            
-            # If already on a line, skip this endpoint
-            if already_on_line:
+            new_pt = _snap_free_endpoint(lines, index, line_idx, position, tolerance, snap_distance)
+            if new_pt is None:
                 continue
             
-            # ============= CHECK: Does line already intersect another line? =============
-            # Check if the current line segment already crosses any other line
-            already_intersects = []
+            old_pt = endpoints.point(e)
+            if position == 'start':
+                current_line['x1'], current_line['y1'] = new_pt
+            else:
+                current_line['x2'], current_line['y2'] = new_pt
+            index.update(line_idx)
+            new_seg = (current_line['x1'], current_line['y1'], current_line['x2'], current_line['y2'])
             
-            for other_idx, other_line in enumerate(lines):
-                if other_idx == line_idx:
-                    continue
-                
-                ox1, oy1 = other_line['x1'], other_line['y1']
-                ox2, oy2 = other_line['x2'], other_line['y2']
-                
-                # Find intersection of infinite lines
-                intersection = line_intersection(x1, y1, x2, y2, ox1, oy1, ox2, oy2)
-                
-                if intersection is not None:
-                    ix, iy = intersection
-                    
-                    # Check if endpoint has already passed this intersection
-                    # (i.e., is on the far side of the intersection from the other endpoint)
-                    # Calculate parameter t for the endpoint on the current line
-                    dx_current = x2 - x1
-                    dy_current = y2 - y1
-                    
-                    if abs(dx_current) > abs(dy_current):
-                        # Use x as reference
-                        if dx_current != 0:
-                            t_endpoint = (px - x1) / dx_current
-                            t_intersection = (ix - x1) / dx_current
-                        else:
-                            continue
-                    else:
-                        # Use y as reference
-                        if dy_current != 0:
-                            t_endpoint = (py - y1) / dy_current
-                            t_intersection = (iy - y1) / dy_current
-                        else:
-                            continue
-                    
-                    # If endpoint parameter is beyond intersection parameter (same direction),
-                    # the endpoint has already passed the intersection
-                    if (t_endpoint > 0 and t_intersection > 0 and t_endpoint >= t_intersection) or \
-                       (t_endpoint < 0 and t_intersection < 0 and t_endpoint <= t_intersection):
-                        # Endpoint is on the far side - it has already crossed this line
-                        dist_to_intersection = distance_point_to_point((px, py), (ix, iy))
-                        already_intersects.append((dist_to_intersection, (ix, iy), other_idx))
+            modifications_this_iteration += 1
+            total_modifications += 1
             
-            # If endpoint already intersects/crosses another line, snap it back to that intersection
-            if already_intersects:
-                already_intersects.sort(key=lambda x: x[0])
-                closest_dist, snap_pt, snap_line_idx = already_intersects[0]
-                
-                new_x = int(round(snap_pt[0]))
-                new_y = int(round(snap_pt[1]))
-                
-                if new_x != px or new_y != py:
-                    old_pt = (px, py)
-                    new_pt = (new_x, new_y)
-                    
-                    if position == 'start':
-                        current_line['x1'] = new_x
-                        current_line['y1'] = new_y
-                    else:
-                        current_line['x2'] = new_x
-                        current_line['y2'] = new_y
-                    
-                    modifications_this_iteration += 1
-                    total_modifications += 1
-                                    
-                continue  # Skip to next endpoint
+            # ============= STEP 3: Re-queue the endpoints this move can affect =============
+            affected = {2 * line_idx, 2 * line_idx + 1}
+            affected |= endpoints.move(e, old_pt)
+            affected.update(endpoints.near_segment(old_seg, reach))
+            affected.update(endpoints.near_segment(new_seg, reach))
+            if not _same_infinite_line(old_seg, new_seg):
+                for seg in (old_seg, new_seg):
+                    affected.update(index.endpoints_near_line(seg, tolerance))
+                    for other_idx in index.lines_crossed_by(seg):
+                        affected.update((2 * other_idx, 2 * other_idx + 1))
             
-            # ============= FIND: Intersection points of this line with other lines =============
-            intersections = []
-            
-            for other_idx, other_line in enumerate(lines):
-                if other_idx == line_idx:
-                    continue  # Skip own line
-                
-                ox1, oy1 = other_line['x1'], other_line['y1']
-                ox2, oy2 = other_line['x2'], other_line['y2']
-                
-                # Find intersection between current line and other line
-                intersection = line_intersection(x1, y1, x2, y2, ox1, oy1, ox2, oy2)
-                
-                if intersection is not None:
-                    ix, iy = intersection
-                    
-                    # VALIDATION: Check if intersection is actually on the other line segment
-                    dist_to_segment = distance_point_to_line_segment((ix, iy), (ox1, oy1), (ox2, oy2))
-                    
-                    # Only accept if intersection is on the segment (within 2px tolerance)
-                    if dist_to_segment > 2.0:
-                        continue
-                    
-                    # Calculate distance from endpoint to this intersection
-                    dist = distance_point_to_point((px, py), (ix, iy))
-                    
-                    # Only consider intersections within snap_distance
-                    if dist <= snap_distance:
-                        intersections.append((dist, (ix, iy), other_idx))
-            
-            # ============= STEP 3: Snap to closest intersection =============
-            if intersections:
-                # Sort by distance and get the closest one
-                intersections.sort(key=lambda x: x[0])
-                closest_dist, closest_pt, closest_line_idx = intersections[0]
-                
-                # Snap to the intersection point
-                new_x = int(round(closest_pt[0]))
-                new_y = int(round(closest_pt[1]))
-                
-                # Only apply if position actually changed
-                if new_x != px or new_y != py:
-                    old_pt = (px, py)
-                    new_pt = (new_x, new_y)
-                    
-                    if position == 'start':
-                        current_line['x1'] = new_x
-                        current_line['y1'] = new_y
-                    else:  # end
-                        current_line['x2'] = new_x
-                        current_line['y2'] = new_y
-                    
-                    modifications_this_iteration += 1
-                    total_modifications += 1
+            for a in affected:
+                # Still ahead in this pass: a full pass would see the move too
+                if a > e and a not in in_heap and endpoints.free_at_round_start(a):
+                    heapq.heappush(heap, a)
+                    in_heap.add(a)
+                elif a <= e or a not in in_heap:
+                    queued.add(a)
+        
+        passes.append({'processed': processed, 'moved': modifications_this_iteration,
+                       'queued': len(queued)})
         
         # If no changes, we've converged
         if modifications_this_iteration == 0:
+            queued = set()
             break
     
+    if stats is not None:
+        stats['passes'] = passes
+        stats['modifications'] = total_modifications
+        stats['converged'] = not queued
+    
     return lines
 
+
 def visualize_extended_endpoints(lines_data: List[Dict], original_lines_data: List[Dict] = None) -> np.ndarray:
     """
     Visualize the extended endpoints with optional before/after comparison.
@@ -1,100 +1,276 @@
 import json
+import numpy as np
+
+from segment_array import SegmentArray
 
 # --- TUNING ---
 GLOBAL_ALIGN_THRESHOLD = 20 
 SKEW_TOLERANCE = 15 
+FLOOR_MERGE_DIST = 10      # px, per-floor grid lines closer than this to a shared line's seed join it
+
+def get_snap_rules(coords, threshold):
+    """
+    Cluster coordinate values into grid lines.
+
+    Sorted unique values join the current cluster while the gap to the
+    previous value is at most threshold. Each cluster becomes a rule that
+    snaps anything in [min - 2, max + 2] to the cluster's rounded mean.
+
+    Returns:
+        Tuple of (mins, maxs, targets) arrays sorted by min. The ranges of
+        neighbouring rules never overlap, because clusters are more than
+        threshold apart.
+    """
+    if not len(coords):
+        empty = np.empty(0, dtype=np.int64)
+        return empty, empty, empty
+    unique_coords = np.unique(np.asarray(coords))
+
+    starts = np.flatnonzero(np.diff(unique_coords) > threshold) + 1
+    starts = np.concatenate([[0], starts])
+    counts = np.diff(np.append(starts, len(unique_coords)))
+    sums = np.add.reduceat(unique_coords, starts)
+    targets = np.array([int(round(v)) for v in (sums / counts).tolist()], dtype=np.int64)
+
+    mins = unique_coords[starts] - 2
+    maxs = unique_coords[starts + counts - 1] + 2
+    return mins, maxs, targets
+
+
+def apply_snap_rules(values, rules):
+    """
+    Look up the rule covering each value with a binary search over the rule
+    minimums.
+
+    Args:
+        values: Array of coordinates (any shape)
+        rules: (mins, maxs, targets) from get_snap_rules
+
+    Returns:
+        Tuple (hit, snapped): a boolean array marking values inside a rule and
+        the values with every hit replaced by its rule's target
+    """
+    values = np.asarray(values)
+    mins, maxs, targets = rules
+    if not len(mins):
+        return np.zeros(values.shape, dtype=bool), values.copy()
+    idx = np.searchsorted(mins, values, side='right') - 1
+    safe = np.maximum(idx, 0)
+    hit = (idx >= 0) & (values <= maxs[safe])
+    return hit, np.where(hit, targets[safe], values)
+
+
+def grid_coordinates(coords):
+    """
+    Master grid input: the x and y values of every line that is vertical or
+    horizontal within SKEW_TOLERANCE.
+
+    Args:
+        coords: (N, 4) array of x1, y1, x2, y2
+
+    Returns:
+        Tuple (v_x_coords, h_y_coords, skewed_count)
+    """
+    dx = np.abs(coords[:, 0] - coords[:, 2])
+    dy = np.abs(coords[:, 1] - coords[:, 3])
+    # Check Vertical, then Horizontal (Relaxed Tolerance)
+    vertical = dx < SKEW_TOLERANCE
+    horizontal = ~vertical & (dy < SKEW_TOLERANCE)
+    ortho = vertical | horizontal
+    skewed = int(np.count_nonzero(vertical & (dx > 0)) + np.count_nonzero(horizontal & (dy > 0)))
+    return coords[ortho][:, [0, 2]].ravel(), coords[ortho][:, [1, 3]].ravel(), skewed
+
+
+def snap_coordinates(coords, x_rules, y_rules):
+    """
+    Apply the x and y grid rules to every endpoint.
+
+    Returns:
+        Tuple (hit, new): (N, 4) mask of snapped values and the snapped coords
+    """
+    x_hit, x_new = apply_snap_rules(coords[:, [0, 2]], x_rules)
+    y_hit, y_new = apply_snap_rules(coords[:, [1, 3]], y_rules)
+    hit = np.stack([x_hit[:, 0], y_hit[:, 0], x_hit[:, 1], y_hit[:, 1]], axis=1)
+    new = np.stack([x_new[:, 0], y_new[:, 0], x_new[:, 1], y_new[:, 1]], axis=1)
+    return hit, new
+
+
+def _line_coords(lines):
+    if not lines:
+        return np.empty((0, 4), dtype=np.int64)
+    return np.array([[l['x1'], l['y1'], l['x2'], l['y2']] for l in lines])
 
-def align_walls_globally(lines_data):
+
+def _write_snaps(lines, coords, hit, new):
+    """Copy snapped values back into the line dicts; returns the number of lines changed."""
+    changed = np.flatnonzero((hit & (new != coords)).any(axis=1))
+    if np.issubdtype(coords.dtype, np.integer):
+        for i, (x1, y1, x2, y2) in zip(changed.tolist(), new[changed].tolist()):
+            line = lines[i]
+            line['x1'], line['y1'], line['x2'], line['y2'] = x1, y1, x2, y2
+    else:
+        # Non-integer input: only snapped values become integer targets
+        keys = ('x1', 'y1', 'x2', 'y2')
+        for i, row_hit, row_new in zip(changed.tolist(), hit[changed].tolist(), new[changed].tolist()):
+            line = lines[i]
+            for k, h, v in zip(keys, row_hit, row_new):
+                if h:
+                    line[k] = int(v)
+    return len(changed)
+
+
+def align_walls_globally(lines_data, stats=None):
     """
     Align walls globally without saving to disk.
     Returns aligned lines list.
+
+    Args:
+        lines_data: List of {x1, y1, x2, y2} dicts (not modified)
+        stats: Optional dict; receives the line count, the number of skewed
+               and corrected lines and the number of x/y grid rules
     """
     if not lines_data:
         return []
     
     lines = [dict(l) for l in lines_data]  # Deep copy
+    coords = _line_coords(lines)
 
     # --- STEP 1: GENERATE MASTER GRID ---
-    v_x_coords = []
-    h_y_coords = []
-
-    skewed_lines_detected = 0
-
-    for line in lines:
-        x1, y1, x2, y2 = line['x1'], line['y1'], line['x2'], line['y2']
-        
-        # Check Vertical (Relaxed Tolerance)
-        if abs(x1 - x2) < SKEW_TOLERANCE: 
-            v_x_coords.extend([x1, x2])
-            h_y_coords.extend([y1, y2])
-            
-            if abs(x1 - x2) > 0: skewed_lines_detected += 1
-            
-        # Check Horizontal (Relaxed Tolerance)
-        elif abs(y1 - y2) < SKEW_TOLERANCE: 
-            h_y_coords.extend([y1, y2])
-            v_x_coords.extend([x1, x2])
-            
-            if abs(y1 - y2) > 0: skewed_lines_detected += 1
+    v_x_coords, h_y_coords, skewed_lines_detected = grid_coordinates(coords)
 
     # --- STEP 2: CLUSTER COORDINATES INTO GRID LINES ---
-    def get_snap_rules(coords, threshold):
-        if not coords: return []
-        unique_coords = sorted(list(set(coords)))
-        
-        clusters = []
-        if not unique_coords: return []
-        
-        current_cluster = [unique_coords[0]]
-        
-        for i in range(1, len(unique_coords)):
-            val = unique_coords[i]
-            if val - current_cluster[-1] <= threshold:
-                current_cluster.append(val)
-            else:
-                clusters.append(current_cluster)
-                current_cluster = [val]
-        clusters.append(current_cluster)
-        
-        rules = []
-        for clust in clusters:
-            avg_val = int(round(sum(clust) / len(clust)))
-            
-            rules.append({
-                'min': min(clust) - 2, 
-                'max': max(clust) + 2,
-                'target': avg_val
-            })
-        return rules
-
     x_rules = get_snap_rules(v_x_coords, GLOBAL_ALIGN_THRESHOLD)
     y_rules = get_snap_rules(h_y_coords, GLOBAL_ALIGN_THRESHOLD)
 
     # --- STEP 3: APPLY GRID SNAPS TO ALL LINES ---
-    corrected_count = 0
-    
-    for line in lines:
-        orig_x1, orig_y1 = line['x1'], line['y1']
-        orig_x2, orig_y2 = line['x2'], line['y2']
-        
-        new_x1, new_y1 = orig_x1, orig_y1
-        new_x2, new_y2 = orig_x2, orig_y2
-        
-        # Apply X Snaps
-        for r in x_rules:
-            if r['min'] <= orig_x1 <= r['max']: new_x1 = r['target']
-            if r['min'] <= orig_x2 <= r['max']: new_x2 = r['target']
-            
-        # Apply Y Snaps
-        for r in y_rules:
-            if r['min'] <= orig_y1 <= r['max']: new_y1 = r['target']
-            if r['min'] <= orig_y2 <= r['max']: new_y2 = r['target']
-            
-        # Update line if changed
-        if (new_x1 != orig_x1) or (new_y1 != orig_y1) or \
-           (new_x2 != orig_x2) or (new_y2 != orig_y2):
-            line['x1'], line['y1'] = new_x1, new_y1
-            line['x2'], line['y2'] = new_x2, new_y2
-            corrected_count += 1
+    hit, new = snap_coordinates(coords, x_rules, y_rules)
+    corrected_count = _write_snaps(lines, coords, hit, new)
+
+    if stats is not None:
+        stats['lines'] = len(lines)
+        stats['skewed_lines'] = skewed_lines_detected
+        stats['corrected_lines'] = corrected_count
+        stats['x_rules'] = len(x_rules[0])
+        stats['y_rules'] = len(y_rules[0])
 
     return lines
+
+
+def merge_floor_rules(floor_rules, max_dist=FLOOR_MERGE_DIST):
+    """
+    Merge the grid lines of several floors into shared grid lines.
+
+    Rule targets of all floors are visited in sorted order. The first
+    unassigned target seeds a shared line and takes every later target
+    closer than max_dist to the seed, at most one per floor. So a shared
+    line is less than max_dist wide, however the floors' lines chain, and
+    two grid lines of one floor never merge. Each member's target becomes
+    the rounded mean of the shared line.
+
+    Args:
+        floor_rules: List of (mins, maxs, targets) from get_snap_rules, one
+                     per floor
+        max_dist: Largest distance (exclusive) from a member to the seed
+
+    Returns:
+        Tuple (rules, shared): the per-floor rules with merged targets and
+        the number of shared grid lines
+    """
+    targets = [np.asarray(t) for _, _, t in floor_rules]
+    values = np.concatenate(targets) if targets else np.empty(0, dtype=np.int64)
+    floor_of = np.repeat(np.arange(len(targets)), [len(t) for t in targets])
+    order = np.lexsort((floor_of, values)).tolist()
+    values, floor_of = values.tolist(), floor_of.tolist()
+
+    merged = list(values)
+    assigned = [False] * len(values)
+    shared = 0
+    for pos, seed in enumerate(order):
+        if assigned[seed]:
+            continue
+        members, floors = [seed], {floor_of[seed]}
+        assigned[seed] = True
+        for k in order[pos + 1:]:
+            if values[k] - values[seed] >= max_dist:
+                break
+            if assigned[k] or floor_of[k] in floors:
+                continue
+            members.append(k)
+            floors.add(floor_of[k])
+            assigned[k] = True
+        target = int(round(sum(values[k] for k in members) / len(members)))
+        for k in members:
+            merged[k] = target
+        shared += 1
+
+    rules, start = [], 0
+    for mins, maxs, t in floor_rules:
+        rules.append((mins, maxs, np.array(merged[start:start + len(t)], dtype=np.int64)))
+        start += len(t)
+    return rules, shared
+
+
+def align_floors_globally(floors_data, stats=None, merge_dist=FLOOR_MERGE_DIST):
+    """
+    Align the walls of several floors to one shared grid.
+
+    Each floor is clustered into grid lines on its own, exactly as in
+    align_walls_globally; merge_floor_rules then pulls lines of different
+    floors that lie within merge_dist onto one shared position. A column or
+    core that runs through the building snaps to the same x/y on each floor,
+    while unregistered floors cannot chain into wide clusters: an endpoint
+    moves at most merge_dist further than in a single-floor run.
+
+    Args:
+        floors_data: Dict of floor -> list of {x1, y1, x2, y2} dicts or a
+                     SegmentArray (not modified)
+        stats: Optional dict; receives the building-wide line, skewed-line and
+               shared grid line counts plus a 'floors' dict of per-floor line
+               and corrected-line counts
+        merge_dist: Largest distance between per-floor grid lines that merge
+
+    Returns:
+        Dict of floor -> aligned lines, of the same kind as the input
+    """
+    floors = list(floors_data)
+    aligned, coords = {}, []
+    for floor in floors:
+        data = floors_data[floor]
+        if isinstance(data, SegmentArray):
+            aligned[floor] = data.copy()
+            coords.append(aligned[floor].coords)
+        else:
+            aligned[floor] = [dict(l) for l in data]  # Deep copy
+            coords.append(_line_coords(aligned[floor]))
+    if not floors:
+        return aligned
+
+    skewed, x_rules, y_rules = 0, [], []
+    for floor_coords in coords:
+        v_x_coords, h_y_coords, floor_skewed = grid_coordinates(floor_coords)
+        skewed += floor_skewed
+        x_rules.append(get_snap_rules(v_x_coords, GLOBAL_ALIGN_THRESHOLD))
+        y_rules.append(get_snap_rules(h_y_coords, GLOBAL_ALIGN_THRESHOLD))
+    x_rules, x_shared = merge_floor_rules(x_rules, merge_dist)
+    y_rules, y_shared = merge_floor_rules(y_rules, merge_dist)
+
+    floor_stats = {}
+    for floor, floor_coords, floor_x, floor_y in zip(floors, coords, x_rules, y_rules):
+        hit, new = snap_coordinates(floor_coords, floor_x, floor_y)
+        floor_new = new.astype(floor_coords.dtype, copy=False)
+        if isinstance(aligned[floor], SegmentArray):
+            corrected = int(np.count_nonzero((hit & (floor_new != floor_coords)).any(axis=1)))
+            floor_coords[...] = floor_new
+        else:
+            corrected = _write_snaps(aligned[floor], floor_coords, hit, floor_new)
+        floor_stats[floor] = {'lines': len(floor_coords), 'corrected_lines': corrected}
+
+    if stats is not None:
+        stats['lines'] = sum(len(c) for c in coords)
+        stats['skewed_lines'] = skewed
+        stats['corrected_lines'] = sum(f['corrected_lines'] for f in floor_stats.values())
+        stats['x_rules'] = x_shared
+        stats['y_rules'] = y_shared
+        stats['floors'] = floor_stats
+
+    return aligned
@@ -8,6 +8,21 @@ import json
 import math
 from collections import defaultdict
 
+import numpy as np
+
+from geometry import PointIndex, cKDTree
+
+# --- TUNING ---
+REFERENCE_CELL_SIZE = 50.0     # Grid cell of the point index when scipy is missing (~ the usual threshold)
+REGISTER_SEGMENTS = 40         # Longest segments per floor that seed registration hypotheses
+REGISTER_HYPOTHESES = 1000     # Max hypotheses scored (sampled at random beyond that)
+REGISTER_SAMPLE = 256          # Target endpoints used to score a hypothesis
+REGISTER_INLIER_DIST = 8.0     # px, a transformed endpoint this close to a reference endpoint is an inlier
+REGISTER_MAX_ROTATION = 15.0   # degrees, floors are drawn roughly upright
+REGISTER_SCALE_RANGE = (0.75, 1.33)
+REGISTER_ICP_ITERATIONS = 30
+REGISTER_SEED = 0
+
 
 def load_json(filepath):
     """Load JSON data from file."""
@@ -74,6 +89,157 @@ def is_horizontal_line(x1, y1, x2, y2, tolerance=1.0):
     return abs(y2 - y1) <= tolerance
 
 
+class AxisIndex:
+    """
+    Sorted, de-duplicated coordinate values of one axis for nearest lookups.
+
+    Each distinct value keeps the object and position of its first occurrence,
+    so nearest() picks the same value as a linear scan with a strict '<'
+    comparison: the closest value, ties going to the one seen first.
+    """
+
+    def __init__(self, values):
+        values = list(values)
+        first = {}
+        for rank, value in enumerate(values):
+            first.setdefault(value, rank)
+        order = sorted(first, key=float)
+        self.values = np.array([float(v) for v in order], dtype=np.float64)
+        self.originals = order
+        self.ranks = np.array([first[v] for v in order], dtype=np.intp)
+
+    def __len__(self):
+        return len(self.values)
+
+    def nearest(self, targets, threshold):
+        """
+        Closest value strictly within threshold of each target.
+
+        Args:
+            targets: Sequence of coordinates
+            threshold: Maximum distance (exclusive)
+
+        Returns:
+            Dict {target: value} for the targets that have a match
+        """
+        targets = list(targets)
+        if not targets or not len(self.values):
+            return {}
+        t = np.array([float(v) for v in targets], dtype=np.float64)
+        right = np.searchsorted(self.values, t).clip(max=len(self.values) - 1)
+        left = (right - 1).clip(min=0)
+        d_left = np.abs(self.values[left] - t)
+        d_right = np.abs(self.values[right] - t)
+        take_left = (d_left < d_right) | ((d_left == d_right) & (self.ranks[left] < self.ranks[right]))
+        best = np.where(take_left, left, right)
+        hit = np.minimum(d_left, d_right) < threshold
+        return {target: self.originals[i]
+                for target, i, ok in zip(targets, best.tolist(), hit.tolist()) if ok}
+
+
+def _grid_nearest(ref, points, max_dist):
+    """
+    nearest_many without scipy: reference points are hashed into cells of
+    size max_dist, so only the 3x3 block of cells around a point can hold
+    a match. Ties go to the lower reference index, like cKDTree.
+    """
+    n_ref = len(ref)
+    dist = np.full(len(points), np.inf)
+    idx = np.full(len(points), n_ref, dtype=np.intp)
+    if max_dist <= 0 or not math.isfinite(max_dist):
+        max_dist = max(float(np.ptp(ref, axis=0).max()), 1.0) + 1.0
+    origin = np.minimum(ref.min(axis=0), points.min(axis=0)) - max_dist
+    ref_cells = np.floor((ref - origin) / max_dist).astype(np.int64)
+    pt_cells = np.floor((points - origin) / max_dist).astype(np.int64)
+    width = int(max(ref_cells[:, 0].max(), pt_cells[:, 0].max())) + 2
+    keys = ref_cells[:, 1] * width + ref_cells[:, 0]
+    order = np.argsort(keys, kind='stable')
+    sorted_keys = keys[order]
+    pt_keys = pt_cells[:, 1] * width + pt_cells[:, 0]
+
+    for dy in (-1, 0, 1):
+        for dx in (-1, 0, 1):
+            target = pt_keys + dy * width + dx
+            lo = np.searchsorted(sorted_keys, target, side='left')
+            counts = np.searchsorted(sorted_keys, target, side='right') - lo
+            if not counts.any():
+                continue
+            q = np.repeat(np.arange(len(points)), counts)
+            offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+            r = order[np.repeat(lo, counts) + offsets]
+            d = np.hypot(points[q, 0] - ref[r, 0], points[q, 1] - ref[r, 1])
+            # Sort by query, distance, reference index so the first entry per query wins
+            sel = np.lexsort((r, d, q))
+            q, r, d = q[sel], r[sel], d[sel]
+            first = np.ones(len(q), dtype=bool)
+            first[1:] = q[1:] != q[:-1]
+            q, r, d = q[first], r[first], d[first]
+            better = (d < dist[q]) | ((d == dist[q]) & (r < idx[q]))
+            dist[q[better]], idx[q[better]] = d[better], r[better]
+
+    missing = dist > max_dist
+    dist[missing], idx[missing] = np.inf, n_ref
+    return dist, idx
+
+
+class ReferenceIndex:
+    """
+    Reference points prepared for repeated snapping: an AxisIndex per axis
+    for line snaps and a point index (a KD-tree when scipy is installed) for
+    point snaps. Build it once per reference floor and pass it to
+    match_coordinates / find_snap_point for every target floor.
+    """
+
+    def __init__(self, reference_points, cell_size=REFERENCE_CELL_SIZE):
+        self.points = list(reference_points)
+        self.x_axis = AxisIndex(p[0] for p in self.points)
+        self.y_axis = AxisIndex(p[1] for p in self.points)
+        self.cell_size = cell_size
+        self._point_index = None       # Built on the first point snap
+        self._array = None
+        self._tree = None
+
+    @classmethod
+    def from_segments(cls, reference_segments, cell_size=REFERENCE_CELL_SIZE):
+        return cls(extract_unique_points(reference_segments).values(), cell_size)
+
+    def __len__(self):
+        return len(self.points)
+
+    def nearest_many(self, points, max_dist):
+        """
+        Nearest reference point for each of many points.
+
+        Args:
+            points: (N, 2) array of x, y
+            max_dist: Matches farther than this are reported as missing
+
+        Returns:
+            Tuple (dist, idx): distances (inf where missing) and indices into
+            self.points (len(self) where missing)
+        """
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+        n_ref = len(self.points)
+        if not n_ref or not len(points):
+            return np.full(len(points), np.inf), np.full(len(points), n_ref, dtype=np.intp)
+        if self._array is None:
+            self._array = np.array(self.points, dtype=np.float64).reshape(-1, 2)
+        if cKDTree is not None:
+            if self._tree is None:
+                self._tree = cKDTree(self._array)
+            dist, idx = self._tree.query(points, distance_upper_bound=max_dist)
+            return dist, idx.astype(np.intp)
+        return _grid_nearest(self._array, points, max_dist)
+
+    def points_near(self, target_point, radius):
+        """Reference points within radius of target_point, in reference order."""
+        if self._point_index is None:
+            self._point_index = PointIndex(self.points, cell_size=self.cell_size, use_kdtree=True)
+        # Slightly widened so the caller's own distance test has the last word
+        found = self._point_index.query_radius(target_point, radius * (1 + 1e-9) + 1e-9)
+        return [self.points[i] for i in found]
+
+
 def find_snap_point(target_point, reference_points, threshold, target_segments, segment_idx, point_type):
     """
     Find best snap point for a target point.
@@ -81,7 +247,8 @@ def find_snap_point(target_point, reference_points, threshold, target_segments,
     
     Args:
         target_point: (x, y) to snap
-        reference_points: [(x, y), ...] available reference points
+        reference_points: [(x, y), ...] available reference points (scanned
+                          linearly), or a ReferenceIndex built from them
         threshold: Maximum snapping distance
         target_segments: All segments in target file
         segment_idx: Index of segment containing target_point
@@ -105,11 +272,19 @@ def find_snap_point(target_point, reference_points, threshold, target_segments,
     is_vert = is_vertical_line(target_x, target_y, other_x, other_y)
     is_horiz = is_horizontal_line(target_x, target_y, other_x, other_y)
     
+    # With an index only the points it finds near the target can pass the
+    # threshold; a plain list is scanned as is (building an index for one
+    # query would cost more than the scan)
+    if isinstance(reference_points, ReferenceIndex):
+        candidates = reference_points.points_near(target_point, threshold)
+    else:
+        candidates = reference_points
+    
     best_point = None
     best_distance = threshold
     best_is_aligned = False
     
-    for ref_point in reference_points:
+    for ref_point in candidates:
         ref_x, ref_y = ref_point
         
         # Calculate distance
@@ -156,7 +331,189 @@ def find_snap_point(target_point, reference_points, threshold, target_segments,
     return best_point
 
 
-def match_coordinates(reference_segments, target_segments, threshold=50.0):
+def _segment_array(segments):
+    """(N, 4) float array of x1, y1, x2, y2 of the segment dicts, with the usual x2/y2 defaults."""
+    rows = [(seg['x1'], seg['y1'], seg.get('x2', seg['x1']), seg.get('y2', seg['y1']))
+            for seg in segments if isinstance(seg, dict) and 'x1' in seg and 'y1' in seg]
+    return np.array(rows, dtype=np.float64).reshape(-1, 4)
+
+
+def _longest(segs, count):
+    lengths = np.hypot(segs[:, 2] - segs[:, 0], segs[:, 3] - segs[:, 1])
+    order = np.argsort(-lengths, kind='stable')[:count]
+    order = order[lengths[order] > 0]
+    return segs[order], lengths[order]
+
+
+def _similarity_from_pairs(src, dst):
+    """
+    Least-squares similarity (Umeyama, no reflection) mapping src onto dst.
+
+    Returns:
+        Tuple (scale, rotation_matrix, translation)
+    """
+    mu_s, mu_d = src.mean(axis=0), dst.mean(axis=0)
+    src_c, dst_c = src - mu_s, dst - mu_d
+    var_s = (src_c ** 2).sum() / len(src)
+    if var_s == 0:
+        return 1.0, np.eye(2), mu_d - mu_s
+    u, sig, vt = np.linalg.svd(dst_c.T @ src_c / len(src))
+    d = np.array([1.0, np.sign(np.linalg.det(u @ vt)) or 1.0])
+    rot = u @ np.diag(d) @ vt
+    scale = float((sig * d).sum() / var_s)
+    return scale, rot, mu_d - scale * rot @ mu_s
+
+
+def _transform_points(points, scale, rot, shift):
+    return points @ (scale * rot).T + shift
+
+
+def register_floors(reference_segments, target_segments, reference_index=None,
+                    inlier_dist=REGISTER_INLIER_DIST, max_rotation=REGISTER_MAX_ROTATION,
+                    scale_range=REGISTER_SCALE_RANGE, seed=REGISTER_SEED):
+    """
+    Estimate the similarity transform (scale, rotation, translation) that
+    lays the target floor over the reference floor.
+
+    Hypotheses come from matching one of the longest target segments to one
+    of the longest reference segments (both ways round): two point pairs fix
+    a similarity. Hypotheses outside max_rotation / scale_range are dropped,
+    the rest (a random sample if there are too many) are scored by how many
+    target endpoints land within inlier_dist of a reference endpoint. The
+    identity is always a candidate, so registered floors stay put. The best
+    hypothesis is then refined by ICP against the nearest reference
+    endpoints.
+
+    Args:
+        reference_segments: List of reference segment dicts
+        target_segments: List of target segment dicts
+        reference_index: Optional ReferenceIndex of reference_segments
+        inlier_dist: Inlier distance in px
+        max_rotation: Largest rotation considered, in degrees
+        scale_range: (min, max) scale considered
+        seed: Seed of the hypothesis sampling
+
+    Returns:
+        Dict with scale, rotation (degrees), tx, ty, matrix (2x3, applied as
+        matrix @ [x, y, 1]), inliers (fraction of target endpoints within
+        inlier_dist after registration) and rms (px, over the inliers)
+    """
+    if reference_index is None:
+        reference_index = ReferenceIndex.from_segments(reference_segments)
+    ref_segs = _segment_array(reference_segments)
+    tgt_segs = _segment_array(target_segments)
+    target_points = np.unique(tgt_segs.reshape(-1, 2), axis=0)
+
+    result = {'scale': 1.0, 'rotation': 0.0, 'tx': 0.0, 'ty': 0.0,
+              'matrix': [[1.0, 0.0, 0.0], [0.0, 1.0, 0.0]], 'inliers': 0.0, 'rms': 0.0}
+    if not len(reference_index) or not len(target_points):
+        return result
+
+    rng = np.random.default_rng(seed)
+    sample = target_points
+    if len(sample) > REGISTER_SAMPLE:
+        sample = sample[rng.choice(len(sample), REGISTER_SAMPLE, replace=False)]
+
+    # --- Hypotheses: long target segment -> long reference segment ---
+    tgt_long, tgt_len = _longest(tgt_segs, REGISTER_SEGMENTS)
+    ref_long, ref_len = _longest(ref_segs, REGISTER_SEGMENTS)
+    ti, ri = np.meshgrid(np.arange(len(tgt_long)), np.arange(len(ref_long)), indexing='ij')
+    ti, ri = ti.ravel(), ri.ravel()
+    scales = ref_len[ri] / tgt_len[ti] if len(ti) else np.empty(0)
+    keep = (scales >= scale_range[0]) & (scales <= scale_range[1])
+    ti, ri, scales = ti[keep], ri[keep], scales[keep]
+
+    hypotheses = [(1.0, 0.0, np.zeros(2))]
+    for flip in (False, True):
+        src_a, src_b = tgt_long[ti, :2], tgt_long[ti, 2:]
+        dst_a, dst_b = (ref_long[ri, 2:], ref_long[ri, :2]) if flip else (ref_long[ri, :2], ref_long[ri, 2:])
+        angles = (np.arctan2(dst_b[:, 1] - dst_a[:, 1], dst_b[:, 0] - dst_a[:, 0]) -
+                  np.arctan2(src_b[:, 1] - src_a[:, 1], src_b[:, 0] - src_a[:, 0]))
+        angles = (angles + np.pi) % (2 * np.pi) - np.pi
+        ok = np.abs(np.degrees(angles)) <= max_rotation
+        for k in np.nonzero(ok)[0]:
+            theta = angles[k]
+            rot = np.array([[math.cos(theta), -math.sin(theta)], [math.sin(theta), math.cos(theta)]])
+            shift = (dst_a[k] + dst_b[k]) / 2 - scales[k] * rot @ ((src_a[k] + src_b[k]) / 2)
+            hypotheses.append((float(scales[k]), float(theta), shift))
+    if len(hypotheses) > REGISTER_HYPOTHESES:
+        picked = rng.choice(np.arange(1, len(hypotheses)), REGISTER_HYPOTHESES - 1, replace=False)
+        hypotheses = [hypotheses[0]] + [hypotheses[k] for k in np.sort(picked)]
+
+    # --- Score all hypotheses in one batched nearest-neighbour query ---
+    scale_arr = np.array([h[0] for h in hypotheses])
+    cos_arr = np.cos([h[1] for h in hypotheses])
+    sin_arr = np.sin([h[1] for h in hypotheses])
+    shift_arr = np.array([h[2] for h in hypotheses])
+    xs = scale_arr[:, None] * (cos_arr[:, None] * sample[None, :, 0] - sin_arr[:, None] * sample[None, :, 1])
+    ys = scale_arr[:, None] * (sin_arr[:, None] * sample[None, :, 0] + cos_arr[:, None] * sample[None, :, 1])
+    moved = np.stack([xs + shift_arr[:, :1], ys + shift_arr[:, 1:]], axis=2)
+    dist, _ = reference_index.nearest_many(moved.reshape(-1, 2), inlier_dist)
+    scores = (dist.reshape(len(hypotheses), -1) <= inlier_dist).sum(axis=1)
+    best = int(np.argmax(scores))          # First best, so the identity wins ties
+    scale, theta, shift = hypotheses[best]
+    rot = np.array([[math.cos(theta), -math.sin(theta)], [math.sin(theta), math.cos(theta)]])
+
+    # --- ICP refinement on all target endpoints ---
+    ref_array = np.array(reference_index.points, dtype=np.float64).reshape(-1, 2)
+    prev_rms = None
+    for _ in range(REGISTER_ICP_ITERATIONS):
+        dist, idx = reference_index.nearest_many(_transform_points(target_points, scale, rot, shift), inlier_dist)
+        matched = idx < len(ref_array)
+        if matched.sum() < 3:
+            break
+        scale, rot, shift = _similarity_from_pairs(target_points[matched], ref_array[idx[matched]])
+        rms = float(np.sqrt((dist[matched] ** 2).mean()))
+        if prev_rms is not None and abs(prev_rms - rms) < 1e-3:
+            break
+        prev_rms = rms
+
+    dist, _ = reference_index.nearest_many(_transform_points(target_points, scale, rot, shift), inlier_dist)
+    inliers = dist <= inlier_dist
+    matrix = np.hstack([scale * rot, shift[:, None]])
+    result.update({
+        'scale': float(scale),
+        'rotation': float(math.degrees(math.atan2(rot[1, 0], rot[0, 0]))),
+        'tx': float(shift[0]),
+        'ty': float(shift[1]),
+        'matrix': matrix.tolist(),
+        'inliers': float(inliers.mean()),
+        'rms': float(np.sqrt((dist[inliers] ** 2).mean())) if inliers.any() else 0.0,
+    })
+    return result
+
+
+def apply_transform(segments, transform):
+    """
+    Apply a register_floors transform to segment dicts (and point dicts
+    with x, y). Integer coordinates stay integers (rounded).
+
+    Returns:
+        New list of segments; other keys are copied unchanged
+    """
+    (a, b, tx), (c, d, ty) = transform['matrix']
+
+    def move(x, y):
+        nx, ny = a * x + b * y + tx, c * x + d * y + ty
+        if isinstance(x, int) and isinstance(y, int):
+            return int(round(nx)), int(round(ny))
+        return nx, ny
+
+    moved = []
+    for seg in segments:
+        if not isinstance(seg, dict):
+            moved.append(seg)
+            continue
+        new_seg = seg.copy()
+        for kx, ky in (('x1', 'y1'), ('x2', 'y2'), ('x', 'y')):
+            if kx in seg and ky in seg:
+                new_seg[kx], new_seg[ky] = move(seg[kx], seg[ky])
+        moved.append(new_seg)
+    return moved
+
+
+def match_coordinates(reference_segments, target_segments, threshold=50.0, reference_index=None,
+                      register=False):
     """
     Snap coordinates in target to nearby points in reference while preserving geometry.
     Groups points that share X or Y coordinates (building walls on same line) and snaps them together.
@@ -165,12 +522,22 @@ def match_coordinates(reference_segments, target_segments, threshold=50.0):
         reference_segments: List of reference segment dicts
         target_segments: List of target segment dicts (will be modified)
         threshold: Maximum snapping distance
+        reference_index: Optional ReferenceIndex of reference_segments, to
+                         reuse when matching several targets to one reference
+        register: First move the target onto the reference with
+                  register_floors (for floors that are not already aligned)
     
     Returns:
-        Tuple: (modified_target_segments, snap_stats)
+        Tuple: (modified_target_segments, snap_stats); with register=True
+        snap_stats['registration'] holds the register_floors result
     """
-    # Extract reference points
-    reference_points = list(extract_unique_points(reference_segments).values())
+    if reference_index is None:
+        reference_index = ReferenceIndex.from_segments(reference_segments)
+    
+    registration = None
+    if register:
+        registration = register_floors(reference_segments, target_segments, reference_index)
+        target_segments = apply_transform(target_segments, registration)
     
     # Extract target points with their positions
     target_points = extract_unique_points(target_segments)
@@ -185,47 +552,10 @@ def match_coordinates(reference_segments, target_segments, threshold=50.0):
         x_groups[x].append(y)
         y_groups[y].append(x)
     
-    # For each group, find the best snap value
-    x_snap_mapping = {}  # old_x -> new_x
-    y_snap_mapping = {}  # old_y -> new_y
-    
-    # Process vertical lines (groups sharing same X)
-    for target_x in x_groups:
-        y_values = x_groups[target_x]
-        
-        # Find best X snap by checking reference points
-        best_snap_x = None
-        best_distance = threshold
-        
-        for ref_point in reference_points:
-            ref_x, _ = ref_point
-            distance = abs(ref_x - target_x)
-            
-            if distance < best_distance:
-                best_distance = distance
-                best_snap_x = ref_x
-        
-        if best_snap_x is not None:
-            x_snap_mapping[target_x] = best_snap_x
-    
-    # Process horizontal lines (groups sharing same Y)
-    for target_y in y_groups:
-        x_values = y_groups[target_y]
-        
-        # Find best Y snap by checking reference points
-        best_snap_y = None
-        best_distance = threshold
-        
-        for ref_point in reference_points:
-            _, ref_y = ref_point
-            distance = abs(ref_y - target_y)
-            
-            if distance < best_distance:
-                best_distance = distance
-                best_snap_y = ref_y
-        
-        if best_snap_y is not None:
-            y_snap_mapping[target_y] = best_snap_y
+    # Snap each group to the nearest reference value on its axis:
+    # vertical lines (groups sharing same X) and horizontal lines (same Y)
+    x_snap_mapping = reference_index.x_axis.nearest(x_groups, threshold)  # old_x -> new_x
+    y_snap_mapping = reference_index.y_axis.nearest(y_groups, threshold)  # old_y -> new_y
     
     # Apply snaps to all segments
     modified_segments = []
@@ -262,12 +592,14 @@ def match_coordinates(reference_segments, target_segments, threshold=50.0):
     total_lines = len(x_groups) + len(y_groups)
     
     stats = {
-        'total_reference_points': len(reference_points),
+        'total_reference_points': len(reference_index),
         'total_target_points': len(target_points),
         'vertical_lines_snapped': snapped_x,
         'horizontal_lines_snapped': snapped_y,
         'total_lines': total_lines,
         'snap_percentage': ((snapped_x + snapped_y) / total_lines * 100) if total_lines else 0
     }
+    if registration is not None:
+        stats['registration'] = registration
     
     return modified_segments, stats
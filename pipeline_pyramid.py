@@ -0,0 +1,148 @@
+import cv2
+import numpy as np
+
+from pipeline_skeleton import DEFAULT_SKELETON_METHOD, BLUR_KSIZE, skeletonize, get_skeleton
+from pipeline_vectorize import process_skeleton
+
+# --- TUNING ---
+PYRAMID_FACTOR = 2         # Downsampling factor for the coarse pass (2 = quarter of the pixels)
+REFINE_WINDOW = 24         # px, half-size of the full-resolution window around each vertex
+REFINE_SEARCH = 3          # Max vertex move during refinement, in coarse pixels
+
+
+def _ridge_points(window, thresh_val):
+    """
+    Centre-line pixels of the strokes in a small greyscale window: local maxima
+    of the distance transform of the binarized window.
+
+    Returns:
+        (ys, xs) arrays of ridge pixel coordinates inside the window
+    """
+    blurred = cv2.GaussianBlur(window, (BLUR_KSIZE, BLUR_KSIZE), 0)
+    _, mask = cv2.threshold(blurred, thresh_val, 255, cv2.THRESH_BINARY_INV)
+    if not mask.any():
+        return np.empty(0, np.intp), np.empty(0, np.intp)
+    dist = cv2.distanceTransform(mask, cv2.DIST_L2, 3)
+    peaks = (dist > 0) & (dist >= cv2.dilate(dist, np.ones((3, 3), np.uint8)))
+    return np.nonzero(peaks)
+
+
+def refine_vertices(img, lines, thresh_val, max_move, window=REFINE_WINDOW):
+    """
+    Move each line endpoint onto the nearest stroke centre-line pixel of the
+    full-resolution image, looking only at a small window around it.
+
+    Endpoints shared by several lines are refined once so the topology is kept,
+    and lines that were horizontal or vertical stay that way: their common
+    coordinate becomes the mean of their refined endpoints.
+
+    Args:
+        img: Full-resolution greyscale image
+        lines: [x1, y1, x2, y2] lists in img coordinates (modified in place)
+        thresh_val: Binarization threshold used for the full image
+        max_move: Endpoints farther than this (px) from any ridge stay put
+        window: Half-size of the search window (px)
+
+    Returns:
+        The refined lines
+    """
+    h, w = img.shape[:2]
+    refined = {}
+    for line in lines:
+        for i in (0, 2):
+            pt = (line[i], line[i + 1])
+            if pt in refined:
+                continue
+            px, py = pt
+            x0, y0 = max(px - window, 0), max(py - window, 0)
+            x1, y1 = min(px + window + 1, w), min(py + window + 1, h)
+            refined[pt] = pt
+            if x0 >= x1 or y0 >= y1:
+                continue
+            ys, xs = _ridge_points(img[y0:y1, x0:x1], thresh_val)
+            if len(xs) == 0:
+                continue
+            d2 = (xs + x0 - px) ** 2 + (ys + y0 - py) ** 2
+            k = int(np.argmin(d2))
+            if d2[k] <= max_move * max_move:
+                refined[pt] = (int(xs[k] + x0), int(ys[k] + y0))
+
+    # Keep axis-aligned lines axis-aligned
+    xs_at, ys_at = {}, {}
+    for line in lines:
+        a, b = (line[0], line[1]), (line[2], line[3])
+        if a[0] == b[0]:
+            x = int(round((refined[a][0] + refined[b][0]) / 2))
+            xs_at.setdefault(a, []).append(x)
+            xs_at.setdefault(b, []).append(x)
+        elif a[1] == b[1]:
+            y = int(round((refined[a][1] + refined[b][1]) / 2))
+            ys_at.setdefault(a, []).append(y)
+            ys_at.setdefault(b, []).append(y)
+    for pt, (rx, ry) in refined.items():
+        if pt in xs_at:
+            rx = int(round(sum(xs_at[pt]) / len(xs_at[pt])))
+        if pt in ys_at:
+            ry = int(round(sum(ys_at[pt]) / len(ys_at[pt])))
+        refined[pt] = (rx, ry)
+
+    for line in lines:
+        line[0], line[1] = refined[(line[0], line[1])]
+        line[2], line[3] = refined[(line[2], line[3])]
+    return lines
+
+
+def vectorize_pyramid(img_path, factor=PYRAMID_FACTOR, method=DEFAULT_SKELETON_METHOD):
+    """
+    Coarse-to-fine vectorization: skeletonize and vectorize a downsampled copy
+    of the drawing with tolerances scaled to match, then refine the endpoints
+    in small full-resolution windows. Thinning and Hough, the expensive
+    stages, only ever see 1/factor^2 of the pixels.
+
+    Args:
+        img_path: Path to the floor plan image
+        factor: Downsampling factor; 1 runs the normal full-resolution pipeline
+                (get_skeleton + process_skeleton, same walls)
+        method: Skeletonization backend
+
+    Returns:
+        Tuple (img, wall_data) where wall_data matches process_skeleton's output
+        in full-resolution image coordinates
+    """
+    if factor <= 1:
+        img, skeleton = get_skeleton(img_path, method)
+        if skeleton is None:
+            return None, None
+        return img, process_skeleton(skeleton)
+
+    img = cv2.imread(img_path, 0)
+    if img is None:
+        print("Error: Image not found.")
+        return None, None
+
+    blurred = cv2.GaussianBlur(img, (BLUR_KSIZE, BLUR_KSIZE), 0)
+    thresh_val, _ = cv2.threshold(blurred, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
+    del blurred
+
+    small = cv2.resize(img, (max(1, img.shape[1] // factor), max(1, img.shape[0] // factor)),
+                       interpolation=cv2.INTER_AREA)
+    coarse = process_skeleton(skeletonize(small, method, scale=1.0 / factor), scale=1.0 / factor)
+
+    # Coarse pixel i covers full-resolution pixels [i*factor, (i+1)*factor)
+    half = (factor - 1) / 2
+    others = {id(l) for l in coarse['others']}
+    walls, final_o = [], []
+    for line in coarse['walls']:
+        full = [int(round(line[0] * factor + half)), int(round(line[1] * factor + half)),
+                int(round(line[2] * factor + half)), int(round(line[3] * factor + half))]
+        walls.append(full)
+        if id(line) in others:
+            final_o.append(full)
+
+    refine_vertices(img, walls, thresh_val, REFINE_SEARCH * factor)
+
+    return img, {
+        "walls": walls,
+        "stairs": [],
+        "others": final_o
+    }
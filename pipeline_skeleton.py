@@ -1,53 +1,509 @@
+import tempfile
 import cv2
 import numpy as np
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
 
-def get_skeleton(img_path):
+# --- TUNING ---
+BLUR_KSIZE = 5
+CLOSE_ITERATIONS = 4
+TILE_SIZE = 2048           # px, interior of each tile in tiled mode
+TILE_THIN_DEPTH = 48       # px, starting thinning allowance of the halo; tiles with thicker strokes grow it
+
+# --- SKELETONIZATION BACKENDS ---
+# 'morph' is the original erosion-loop skeleton, restricted each round to the
+# bounding box of what is left (same output, a fraction of the work). It stays
+# the default because the thinning backends give a different, thinner
+# skeleton. 'zhangsuen' is a NumPy lookup-table port of cv2.ximgproc's
+# Zhang-Suen thinning (pixel-identical to it) that only revisits pixels whose
+# neighbourhood changed; it and the ximgproc backends are opt-in.
+DEFAULT_SKELETON_METHOD = 'morph'
+
+# Neighbour offsets (dy, dx) in the classic P2..P9 order:
+# N, NE, E, SE, S, SW, W, NW. Bit k of a neighbourhood code is P(k+2).
+_NEIGHBOURS = [(-1, 0), (-1, 1), (0, 1), (1, 1), (1, 0), (1, -1), (0, -1), (-1, -1)]
+
+
+def _build_zhang_suen_luts():
+    """Deletion tables for the two Zhang-Suen sub-iterations, indexed by neighbourhood code."""
+    lut_a = np.zeros(256, dtype=bool)
+    lut_b = np.zeros(256, dtype=bool)
+    for code in range(256):
+        p = [(code >> k) & 1 for k in range(8)]
+        p2, p3, p4, p5, p6, p7, p8, p9 = p
+        B = sum(p)
+        A = sum(1 for k in range(8) if p[k] == 0 and p[(k + 1) % 8] == 1)
+        if A != 1 or not (2 <= B <= 6):
+            continue
+        lut_a[code] = (p2 * p4 * p6 == 0) and (p4 * p6 * p8 == 0)
+        lut_b[code] = (p2 * p4 * p8 == 0) and (p2 * p6 * p8 == 0)
+    return lut_a, lut_b
+
+
+def _build_guo_hall_luts():
+    """Deletion tables for the two Guo-Hall sub-iterations, indexed by neighbourhood code."""
+    lut_a = np.zeros(256, dtype=bool)
+    lut_b = np.zeros(256, dtype=bool)
+    for code in range(256):
+        p2, p3, p4, p5, p6, p7, p8, p9 = [(code >> k) & 1 for k in range(8)]
+        C = ((not p2) and (p3 or p4)) + ((not p4) and (p5 or p6)) + \
+            ((not p6) and (p7 or p8)) + ((not p8) and (p9 or p2))
+        N1 = (p9 or p2) + (p3 or p4) + (p5 or p6) + (p7 or p8)
+        N2 = (p2 or p3) + (p4 or p5) + (p6 or p7) + (p8 or p9)
+        N = min(N1, N2)
+        if C != 1 or not (2 <= N <= 3):
+            continue
+        lut_a[code] = not ((p6 or p7 or not p9) and p8)
+        lut_b[code] = not ((p2 or p3 or not p5) and p4)
+    return lut_a, lut_b
+
+
+_ZHANG_SUEN_LUTS = _build_zhang_suen_luts()
+_GUO_HALL_LUTS = _build_guo_hall_luts()
+
+
+def _thinning_lut(img_input, luts):
     """
-    Generate skeleton from image without saving intermediate files.
-    Returns the skeleton image as numpy array.
+    Parallel two-subiteration thinning driven by 256-entry lookup tables.
+    Each sub-iteration only re-evaluates pixels whose neighbourhood changed
+    since that sub-iteration last looked at them, so the total work is
+    proportional to the foreground area rather than frame size times
+    stroke thickness.
     """
-    # 1. Load image
-    img = cv2.imread(img_path, 0)
-    if img is None:
-        print("Error: Image not found.")
-        return None, None
+    h, w = img_input.shape
+    stride = w + 2
+    padded = np.zeros((h + 2, w + 2), np.uint8)
+    padded[1:-1, 1:-1] = img_input > 0
+    flat = padded.ravel()
+    offsets = np.array([dy * stride + dx for dy, dx in _NEIGHBOURS])
+
+    # Image border pixels are never deleted (same as cv2.ximgproc.thinning)
+    frame = np.ones((h + 2, w + 2), bool)
+    frame[2:-2, 2:-2] = False
+    contour = padded & ~cv2.erode(padded, np.ones((3, 3), np.uint8), borderType=cv2.BORDER_CONSTANT, borderValue=0)
+    contour[frame] = 0
+    idx = np.flatnonzero(contour)
+
+    # One pending list per sub-iteration; 'queued' masks keep them duplicate-free
+    # and permanently exclude the frame.
+    pending = [idx, idx.copy()]
+    queued = [frame.ravel().copy(), frame.ravel().copy()]
+    for q in queued:
+        q[idx] = True
+    slot = np.zeros(flat.shape[0], np.int64)
+
+    k = 0
+    while pending[0].size or pending[1].size:
+        cand = pending[k]
+        queued[k][cand] = False
+        pending[k] = cand[:0]
+        cand = cand[flat[cand] == 1]
+
+        code = np.zeros(cand.shape[0], np.uint8)
+        for bit, off in enumerate(offsets):
+            code |= flat[cand + off] << bit
+        removed = cand[luts[k][code]]
+
+        if removed.size:
+            flat[removed] = 0
+            exposed = (removed[:, None] + offsets).ravel()
+            exposed = exposed[flat[exposed] == 1]
+            # De-duplicate without sorting: keep the last write per pixel
+            order = np.arange(exposed.shape[0])
+            slot[exposed] = order
+            exposed = exposed[slot[exposed] == order]
+            for j in (0, 1):
+                fresh = exposed[~queued[j][exposed]]
+                queued[j][fresh] = True
+                pending[j] = np.concatenate([pending[j], fresh])
+        k ^= 1
+
+    return padded[1:-1, 1:-1] * np.uint8(255)
+
+
+def _thinning_zhang_suen(img_input):
+    return _thinning_lut(img_input, _ZHANG_SUEN_LUTS)
+
+
+def _thinning_guo_hall(img_input):
+    return _thinning_lut(img_input, _GUO_HALL_LUTS)
+
+
+def _thinning_ximgproc(img_input):
+    return cv2.ximgproc.thinning(img_input, thinningType=cv2.ximgproc.THINNING_ZHANGSUEN)
+
+
+def _thinning_ximgproc_guo_hall(img_input):
+    return cv2.ximgproc.thinning(img_input, thinningType=cv2.ximgproc.THINNING_GUOHALL)
 
-    # 2. Gaussian Blur 
-    img_blurred = cv2.GaussianBlur(img, (5, 5), 0)
 
-    # 3. Binary Thresholding (Otsu)
+def _thinning_morph(img_input):
+    """
+    Original erosion-loop morphological skeleton.
+    Each round only touches the bounding box of the pixels still left (plus
+    the 2 px the opening can reach), which gives the same skeleton as running
+    every round on the full frame.
+    """
+    h, w = img_input.shape
+    skel = np.zeros(img_input.shape, np.uint8)
+    element = cv2.getStructuringElement(cv2.MORPH_CROSS, (3,3))
+
+    eroded = img_input.copy()
+    y0, y1, x0, x1 = 0, h, 0, w
+    while True:
+        sub = eroded[y0:y1, x0:x1]
+        open_op = cv2.morphologyEx(sub, cv2.MORPH_OPEN, element)
+        temp = cv2.subtract(sub, open_op)
+        shrunk = cv2.erode(sub, element)
+        skel_sub = skel[y0:y1, x0:x1]
+        cv2.bitwise_or(skel_sub, temp, dst=skel_sub)
+        eroded[y0:y1, x0:x1] = shrunk
+        if cv2.countNonZero(shrunk) == 0:
+            return skel
+        bx, by, bw, bh = cv2.boundingRect(shrunk)
+        y0, y1 = max(y0 + by - 2, 0), min(y0 + by + bh + 2, h)
+        x0, x1 = max(x0 + bx - 2, 0), min(x0 + bx + bw + 2, w)
+
+
+SKELETON_METHODS = {
+    'zhangsuen': _thinning_zhang_suen,
+    'guohall': _thinning_guo_hall,
+    'ximgproc': _thinning_ximgproc,
+    'ximgproc_guohall': _thinning_ximgproc_guo_hall,
+    'morph': _thinning_morph,
+}
+
+
+def get_thinning(method=DEFAULT_SKELETON_METHOD):
+    """
+    Resolve a skeletonization backend by name.
+
+    Args:
+        method: One of SKELETON_METHODS
+
+    Returns:
+        Callable taking a 0/255 binary image and returning a 0/255 skeleton
+    """
+    if method.startswith('ximgproc') and not hasattr(cv2, 'ximgproc'):
+        raise ValueError(f"Skeleton method '{method}' needs opencv-contrib (cv2.ximgproc)")
+    if method not in SKELETON_METHODS:
+        raise ValueError(f"Unknown skeleton method '{method}'. Choose from: {', '.join(SKELETON_METHODS)}")
+    return SKELETON_METHODS[method]
+
+
+def otsu_threshold(hist):
+    """
+    Otsu threshold from a 256-bin grey-level histogram.
+    Mirrors cv2.threshold(..., THRESH_OTSU) so tiled runs can accumulate the
+    histogram piecewise and still get the same global threshold.
+    """
+    hist = np.asarray(hist, dtype=np.float64).ravel()
+    total = hist.sum()
+    if total == 0:
+        return 0.0
+    levels = np.arange(256, dtype=np.float64)
+    mu = float((levels * hist).sum()) / total
+
+    q1, mu1 = 0.0, 0.0
+    max_sigma, max_val = 0.0, 0.0
+    for i in range(256):
+        p_i = hist[i] / total
+        mu1 *= q1
+        q1 += p_i
+        q2 = 1.0 - q1
+        if min(q1, q2) < 1.1920928955078125e-07 or max(q1, q2) > 1.0 - 1.1920928955078125e-07:
+            continue
+        mu1 = (mu1 + i * p_i) / q1
+        mu2 = (mu - q1 * mu1) / q2
+        sigma = q1 * q2 * (mu1 - mu2) * (mu1 - mu2)
+        if sigma > max_sigma:
+            max_sigma = sigma
+            max_val = i
+    return float(max_val)
+
+
+def binarize(img, thresh_val=None, scale=1.0):
+    """
+    Blur, threshold and close a greyscale array: the mask that gets thinned.
+
+    Args:
+        img: Greyscale image (uint8)
+        thresh_val: Fixed binarization threshold; Otsu on img when None
+        scale: Resolution of img relative to the full image; the blur kernel
+               and closing iterations shrink with it
+
+    Returns:
+        Closed binary mask (0/255 uint8, same shape as img)
+    """
+    ksize = max(3, int(round(BLUR_KSIZE * scale)) | 1)
+    close_iterations = max(1, int(round(CLOSE_ITERATIONS * scale)))
+
+    # 1. Gaussian Blur
+    img_blurred = cv2.GaussianBlur(img, (ksize, ksize), 0)
+
+    # 2. Binary Thresholding (Otsu)
     # Invert: Lines = White, Background = Black
-    ret, thresh = cv2.threshold(img_blurred, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
+    if thresh_val is None:
+        ret, thresh = cv2.threshold(img_blurred, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
+    else:
+        ret, thresh = cv2.threshold(img_blurred, thresh_val, 255, cv2.THRESH_BINARY_INV)
+    del img_blurred
 
-    # 4. Aggressive Morphological Closing
+    # 3. Aggressive Morphological Closing
     kernel = np.ones((3,3), np.uint8)
-    closing = cv2.morphologyEx(thresh, cv2.MORPH_CLOSE, kernel, iterations=4)
-
-    # 5. Robust Thinning Function
-    def thinning(img_input):
-        size = np.size(img_input)
-        skel = np.zeros(img_input.shape, np.uint8)
-        element = cv2.getStructuringElement(cv2.MORPH_CROSS, (3,3))
-        done = False
-        
-        eroded = img_input.copy()
-        while not done:
-            open_op = cv2.morphologyEx(eroded, cv2.MORPH_OPEN, element)
-            temp = cv2.subtract(eroded, open_op)
-            eroded = cv2.erode(eroded, element)
-            skel = cv2.bitwise_or(skel, temp)
-            if cv2.countNonZero(eroded) == 0:
-                done = True
-        return skel
-
-    # Run Thinning First Pass
+    return cv2.morphologyEx(thresh, cv2.MORPH_CLOSE, kernel, iterations=close_iterations)
+
+
+def thin_and_bridge(closing, thinning):
+    """Thin a closed mask, bridge micro-gaps and thin again (0/255 uint8 skeleton)."""
+    # 4. Run Thinning First Pass
     skeleton = thinning(closing)
 
-    # 6. Bridge Micro-Gaps
+    # 5. Bridge Micro-Gaps
     kernel_bridge = np.ones((3,3), np.uint8)
     bridged = cv2.dilate(skeleton, kernel_bridge, iterations=1)
-    
+    del skeleton
+
     # Thin again to return to 1-pixel width
-    final_skeleton = thinning(bridged)
+    return thinning(bridged)
+
+
+def skeletonize(img, method=DEFAULT_SKELETON_METHOD, thresh_val=None, scale=1.0):
+    """
+    Run blur, threshold, closing and the two thinning passes on a greyscale array.
+
+    Args:
+        img: Greyscale image (uint8)
+        method: Skeletonization backend name
+        thresh_val: Fixed binarization threshold; Otsu on img when None
+        scale: Resolution of img relative to the full image; the blur kernel
+               and closing iterations shrink with it
+
+    Returns:
+        Skeleton image (0/255 uint8, same shape as img)
+    """
+    thinning = get_thinning(method)
+    return thin_and_bridge(binarize(img, thresh_val, scale), thinning)
+
+
+def read_greyscale_mapped(img_path):
+    """
+    Decode an image to greyscale and move it into a disk-backed memmap, so
+    the full-resolution pixels are not kept in RAM while tiles are processed
+    (OpenCV can only decode whole images, so one greyscale frame is still
+    alive while decoding).
+
+    Returns:
+        np.memmap (uint8, h x w), or None if the image cannot be read
+    """
+    img = cv2.imread(img_path, 0)
+    if img is None:
+        return None
+    mapped = np.memmap(tempfile.TemporaryFile(), dtype=np.uint8, mode='w+', shape=img.shape)
+    mapped[:] = img
+    del img
+    return mapped
+
+
+def _mask_depth(mask):
+    """
+    Largest number of cross-shaped erosions any pixel of mask survives
+    (L1 distance to the nearest background pixel), with the array border
+    counted as foreground like cv2.erode does.
+    """
+    padded = cv2.copyMakeBorder(mask, 1, 1, 1, 1, cv2.BORDER_CONSTANT, value=255)
+    if cv2.countNonZero(padded) == padded.size:
+        return max(mask.shape)
+    dist = cv2.distanceTransform(padded, cv2.DIST_L1, 3)
+    return int(np.ceil(dist.max()))
+
+
+def tile_halo(thin_depth=TILE_THIN_DEPTH, bridge_depth=2):
+    """
+    Halo (px) a tile needs so its interior matches an untiled run, given how
+    many erosions the deepest pixel of the closed mask (thin_depth) and of
+    the bridged skeleton (bridge_depth) survives.
+    """
+    blur = BLUR_KSIZE // 2
+    close = 2 * CLOSE_ITERATIONS
+    bridge = 1
+    # A thinning pass at a pixel reads the mask within depth + 2 of it (the
+    # opening reaches 2 px); the closing near the cut edge is also unreliable,
+    # so the first pass gets that band once more as slack.
+    return 2 * (blur + close) + (thin_depth + 2) + bridge + (bridge_depth + 2)
+
+
+def iter_tiles(shape, tile_size, halo):
+    """
+    Yield (outer, inner) slice pairs covering an image of the given shape.
+    outer is the tile plus halo clipped to the image, inner is the part of
+    the tile (in tile coordinates) that is kept when stitching.
+    """
+    h, w = shape[:2]
+    for y0 in range(0, h, tile_size):
+        for x0 in range(0, w, tile_size):
+            y1, x1 = min(y0 + tile_size, h), min(x0 + tile_size, w)
+            yield _tile_slices(shape, (y0, y1, x0, x1), halo)
+
+
+def _tile_slices(shape, box, halo):
+    h, w = shape[:2]
+    y0, y1, x0, x1 = box
+    oy0, ox0 = max(y0 - halo, 0), max(x0 - halo, 0)
+    oy1, ox1 = min(y1 + halo, h), min(x1 + halo, w)
+    outer = (slice(oy0, oy1), slice(ox0, ox1))
+    inner = (slice(y0 - oy0, y1 - oy0), slice(x0 - ox0, x1 - ox0))
+    return outer, inner
+
+
+def _blurred_histogram(img, tile_size):
+    """Histogram of the blurred image, accumulated tile by tile."""
+    hist = np.zeros((256, 1), np.float64)
+    for outer, inner in iter_tiles(img.shape, tile_size, BLUR_KSIZE // 2):
+        blurred = cv2.GaussianBlur(img[outer], (BLUR_KSIZE, BLUR_KSIZE), 0)[inner]
+        hist += cv2.calcHist([np.ascontiguousarray(blurred)], [0], None, [256], [0, 256])
+    return hist
+
+
+def _skeletonize_tile(tile, inner, method, thresh_val, halo, whole):
+    """
+    Worker entry point: skeletonize one haloed tile and return its interior.
+
+    How far thinning reaches depends on the strokes, so the halo is checked
+    against the depth of the tile's closed mask and bridged skeleton. If it
+    is too small the tile is abandoned and the halo it needs is returned
+    instead, so the caller can retry with a bigger window.
+
+    Args:
+        tile: Greyscale tile including its halo
+        inner: Slices of the interior within tile
+        method: Skeletonization backend name
+        thresh_val: Global binarization threshold
+        halo: Halo the tile was cut with
+        whole: True if the tile is the whole image (no halo check needed)
+
+    Returns:
+        Tuple (interior or None, halo the tile needs)
+    """
+    thinning = get_thinning(method)
+    closing = binarize(tile, thresh_val)
+    thin_depth = _mask_depth(closing)
+    if tile_halo(thin_depth, 0) > halo and not whole:
+        return None, tile_halo(thin_depth, 0)
+
+    skeleton = thinning(closing)
+    del closing
+    bridged = cv2.dilate(skeleton, np.ones((3,3), np.uint8), iterations=1)
+    del skeleton
+    needed = tile_halo(thin_depth, _mask_depth(bridged))
+    if needed > halo and not whole:
+        return None, needed
+    return np.ascontiguousarray(thinning(bridged)[inner]), needed
+
+
+def skeletonize_tiled(img, method=DEFAULT_SKELETON_METHOD, tile_size=TILE_SIZE,
+                      halo=None, workers=None, thresh_val=None):
+    """
+    Skeletonize a large image in overlapping tiles and stitch the interiors.
+
+    Each tile starts with the given halo; a tile whose strokes are too thick
+    for it (see _skeletonize_tile) is redone with the halo it reports, so the
+    stitched skeleton always matches an untiled run. Only the output and a
+    handful of tile-sized buffers per worker are alive at once, so peak
+    memory is bounded by tile size plus the halo the thickest stroke needs.
+    Pass a memmap (read_greyscale_mapped) to keep the input out of RAM too;
+    the output is then a memmap as well.
+
+    Args:
+        img: Greyscale image (uint8)
+        method: Skeletonization backend name
+        tile_size: Edge length of the stitched tile interiors (px)
+        halo: Starting overlap on each side (px); defaults to tile_halo()
+        workers: Number of processes; runs in-process when None or 1
+        thresh_val: Fixed binarization threshold; global Otsu when None
+
+    Returns:
+        Skeleton image (0/255 uint8, same shape as img)
+    """
+    get_thinning(method)  # Fail fast on a bad method name
+    if halo is None:
+        halo = tile_halo()
+
+    # Otsu needs the global histogram; accumulate it so tiles share one threshold
+    if thresh_val is None:
+        thresh_val = otsu_threshold(_blurred_histogram(img, tile_size))
+
+    if isinstance(img, np.memmap):
+        skeleton = np.memmap(tempfile.TemporaryFile(), dtype=np.uint8, mode='w+', shape=img.shape[:2])
+    else:
+        skeleton = np.zeros(img.shape[:2], np.uint8)
+    h, w = img.shape[:2]
+
+    def job(box, tile_halo_px):
+        outer, inner = _tile_slices(img.shape, box, tile_halo_px)
+        whole = outer[0].stop - outer[0].start == h and outer[1].stop - outer[1].start == w
+        return (np.ascontiguousarray(img[outer]), inner, method, thresh_val, tile_halo_px, whole)
+
+    def place(box, result):
+        y0, y1, x0, x1 = box
+        skeleton[y0:y1, x0:x1] = result
+
+    boxes = [(y0, min(y0 + tile_size, h), x0, min(x0 + tile_size, w))
+             for y0 in range(0, h, tile_size) for x0 in range(0, w, tile_size)]
+    pending = [(box, halo) for box in boxes]
+
+    if not workers or workers <= 1:
+        while pending:
+            box, tile_halo_px = pending.pop()
+            result, needed = _skeletonize_tile(*job(box, tile_halo_px))
+            if result is None:
+                pending.append((box, needed))
+            else:
+                place(box, result)
+        return skeleton
+
+    # Keep at most 2 tiles per worker in flight so memory stays bounded
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        in_flight = {}
+        while pending or in_flight:
+            while pending and len(in_flight) < 2 * workers:
+                box, tile_halo_px = pending.pop()
+                in_flight[pool.submit(_skeletonize_tile, *job(box, tile_halo_px))] = box
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                box = in_flight.pop(future)
+                result, needed = future.result()
+                if result is None:
+                    pending.append((box, needed))
+                else:
+                    place(box, result)
+    return skeleton
+
+
+def get_skeleton(img_path, method=DEFAULT_SKELETON_METHOD, tile_size=None, workers=None):
+    """
+    Generate skeleton from image without saving intermediate files.
+    Returns the skeleton image as numpy array.
+
+    Args:
+        img_path: Path to the floor plan image
+        method: Skeletonization backend ('morph', the original erosion
+                loop, or the thinning backends 'zhangsuen', 'guohall',
+                'ximgproc', 'ximgproc_guohall')
+        tile_size: Process in overlapping tiles of this size (px) to bound
+                   memory on very large scans; whole image at once when None.
+                   In tiled mode the image and skeleton are disk-backed
+                   memmaps
+        workers: Process pool size for tiled mode
+    """
+    # 1. Load image
+    img = read_greyscale_mapped(img_path) if tile_size else cv2.imread(img_path, 0)
+    if img is None:
+        print("Error: Image not found.")
+        return None, None
+
+    if tile_size:
+        final_skeleton = skeletonize_tiled(img, method, tile_size=tile_size, workers=workers)
+    else:
+        final_skeleton = skeletonize(img, method)
 
     return img, final_skeleton
@@ -1,6 +1,11 @@
 import math
 from typing import List, Dict, Tuple
 
+from geometry import PointIndex, SegmentGrid, VertexWelder
+
+# --- TUNING ---
+SNAP_MAX_RADIUS = 100.0     # px, widest snap threshold a SnapSession answers without rebuilding
+
 def distance_point_to_point(p1: Tuple, p2: Tuple) -> float:
     """Calculate Euclidean distance between two points."""
     return math.sqrt((p1[0] - p2[0])**2 + (p1[1] - p2[1])**2)
@@ -108,8 +113,8 @@ def merge_duplicate_vertices(segments: List[Dict], tolerance: int = 2) -> List[D
     Returns:
         List of segments with merged vertices
     """
-    # Collect all unique vertices
-    vertices = {}
+    # Collect all unique vertices; each maps to the first kept vertex within tolerance
+    vertices = VertexWelder(tolerance)
     vertex_map = {}  # Maps original vertex to merged vertex
     
     for seg_idx, seg in enumerate(segments):
@@ -122,17 +127,7 @@ def merge_duplicate_vertices(segments: List[Dict], tolerance: int = 2) -> List[D
             if v in vertex_map:
                 continue
             
-            # Find if this vertex is close to any existing vertex
-            found_merge = False
-            for existing_v in vertices.keys():
-                if distance_point_to_point(v, existing_v) <= tolerance:
-                    vertex_map[v] = existing_v
-                    found_merge = True
-                    break
-            
-            if not found_merge:
-                vertices[v] = True
-                vertex_map[v] = v
+            vertex_map[v] = vertices.weld(v)
     
     # Merge vertices and update segments
     merged_segments = []
@@ -158,24 +153,37 @@ def merge_duplicate_vertices(segments: List[Dict], tolerance: int = 2) -> List[D
     
     return merged_segments
 
-def merge_stairs_to_walls(stairs: List[Dict], walls: List[Dict], tolerance: int = 5) -> List[Dict]:
+def wall_vertex_welder(walls: List[Dict], tolerance: int = 5) -> VertexWelder:
+    """VertexWelder over the distinct wall endpoints, in wall order."""
+    wall_vertices = VertexWelder(tolerance)
+    seen = set()
+    for wall in walls:
+        for wv in ((wall['x1'], wall['y1']), (wall['x2'], wall['y2'])):
+            if wv not in seen:
+                seen.add(wv)
+                wall_vertices.add(wv)
+    return wall_vertices
+
+def merge_stairs_to_walls(stairs: List[Dict], walls: List[Dict], tolerance: int = 5,
+                          wall_vertices: VertexWelder = None) -> List[Dict]:
     """
     Merge stair vertices with nearby wall vertices.
     If a stair endpoint is very close to a wall endpoint, snap it to that wall endpoint.
+    With several wall endpoints in range the closest wins, ties going to the
+    wall listed first.
     
     Args:
         stairs: List of stair segments
         walls: List of wall segments
         tolerance: Maximum distance to snap to wall endpoints
+        wall_vertices: Optional prebuilt wall_vertex_welder(walls, tolerance)
     
     Returns:
         List of stairs with merged endpoints
     """
     # Extract all wall vertices
-    wall_vertices = set()
-    for wall in walls:
-        wall_vertices.add((wall['x1'], wall['y1']))
-        wall_vertices.add((wall['x2'], wall['y2']))
+    if wall_vertices is None:
+        wall_vertices = wall_vertex_welder(walls, tolerance)
     
     merged_stairs = []
     merges_applied = 0
@@ -187,19 +195,17 @@ def merge_stairs_to_walls(stairs: List[Dict], walls: List[Dict], tolerance: int
         merged_v1 = v1
         merged_v2 = v2
         
-        # Check if v1 is close to any wall vertex
-        for wv in wall_vertices:
-            if distance_point_to_point(v1, wv) <= tolerance:
-                merged_v1 = wv
-                merges_applied += 1
-                break
+        # Check if v1 is close to any wall vertex (the closest one wins)
+        wv = wall_vertices.closest(v1)
+        if wv is not None:
+            merged_v1 = wv
+            merges_applied += 1
         
         # Check if v2 is close to any wall vertex
-        for wv in wall_vertices:
-            if distance_point_to_point(v2, wv) <= tolerance:
-                merged_v2 = wv
-                merges_applied += 1
-                break
+        wv = wall_vertices.closest(v2)
+        if wv is not None:
+            merged_v2 = wv
+            merges_applied += 1
         
         merged_stair = stair.copy()
         merged_stair['x1'] = int(merged_v1[0])
@@ -239,6 +245,103 @@ def fix_wall_endpoints(walls_data: List[Dict]) -> List[Dict]:
     
     return walls
 
+class SnapSession:
+    """
+    Snap candidates for every stair endpoint, computed once per walls/stairs pair.
+
+    For each stair endpoint the wall endpoints and wall segments closer than
+    max_radius are stored sorted by distance, so snap() for any thresholds up
+    to max_radius only has to walk the front of each list. The UI keeps one
+    session per file pair, which makes the threshold sliders cheap.
+    """
+
+    def __init__(self, stairs_data: List[Dict], walls_data: List[Dict],
+                 max_radius: float = SNAP_MAX_RADIUS):
+        self.stairs_data = stairs_data
+        self.walls_data = walls_data
+        self.max_radius = max_radius
+
+        # Collect all wall endpoints (first occurrence order breaks distance ties)
+        self.wall_vertices = wall_vertex_welder(walls_data, tolerance=5)
+        wall_endpoints = PointIndex(self.wall_vertices.points, cell_size=max_radius)
+
+        wall_lines = SegmentGrid(cell_size=max_radius)
+        for wall_idx, wall in enumerate(walls_data):
+            wall_lines.add(wall_idx, (wall['x1'], wall['y1'], wall['x2'], wall['y2']))
+
+        # Per stair: (start candidates, end candidates), each a pair of
+        # distance-sorted lists of (dist, endpoint) and (dist, closest point)
+        self.candidates = []
+        for stair in stairs_data:
+            self.candidates.append(tuple(
+                self._point_candidates(pt, wall_endpoints, wall_lines)
+                for pt in ((stair['x1'], stair['y1']), (stair['x2'], stair['y2']))))
+
+    def _point_candidates(self, pt, wall_endpoints, wall_lines):
+        r = self.max_radius
+        endpoints = []
+        for i in wall_endpoints.query_radius(pt, r + 1e-9):
+            ep = wall_endpoints.points[i]
+            dist = distance_point_to_point(pt, ep)
+            if dist < r:
+                endpoints.append((dist, ep))
+        endpoints.sort(key=lambda c: c[0])
+
+        lines = []
+        px, py = pt
+        for wall_idx in wall_lines.query_box(px - r, py - r, px + r, py + r):
+            wall = self.walls_data[wall_idx]
+            seg_start, seg_end = (wall['x1'], wall['y1']), (wall['x2'], wall['y2'])
+            dist = distance_point_to_segment(pt, seg_start, seg_end)
+            if dist < r:
+                lines.append((dist, project_point_on_segment(pt, seg_start, seg_end)))
+        lines.sort(key=lambda c: c[0])
+        return endpoints, lines
+
+    def snap(self, endpoint_threshold: float = 50.0, line_threshold: float = 30.0) -> List[Dict]:
+        """
+        Snap the stairs for the given thresholds; see snap_stairs_to_walls.
+        Thresholds above max_radius fall back to a new, wider session.
+        """
+        if not self.stairs_data or not self.walls_data:
+            return self.stairs_data
+        if max(endpoint_threshold, line_threshold) > self.max_radius:
+            wider = SnapSession(self.stairs_data, self.walls_data,
+                                max(endpoint_threshold, line_threshold))
+            return wider.snap(endpoint_threshold, line_threshold)
+
+        stairs = [dict(s) for s in self.stairs_data]  # Deep copy
+
+        # Process each stair line's endpoints
+        for stair, point_candidates in zip(stairs, self.candidates):
+            for keys, (endpoints, lines) in zip((('x1', 'y1'), ('x2', 'y2')), point_candidates):
+                best_snap = None
+
+                # Try to snap to the nearest wall endpoint
+                if endpoints and endpoints[0][0] < endpoint_threshold:
+                    best_snap = endpoints[0][1]
+
+                # If no endpoint found, try to snap to the nearest wall line
+                elif lines and lines[0][0] < line_threshold:
+                    best_snap = lines[0][1]
+
+                if best_snap is not None:
+                    stair[keys[0]] = int(best_snap[0])
+                    stair[keys[1]] = int(best_snap[1])
+
+        # Post-processing: Straighten stair lines that should be perpendicular or horizontal
+        stairs = straighten_stair_lines(stairs, tolerance=10)
+
+        # Merge duplicate/near-duplicate vertices within stairs
+        stairs = merge_duplicate_vertices(stairs, tolerance=2)
+
+        # Merge stair vertices with wall vertices
+        stairs = merge_stairs_to_walls(stairs, self.walls_data, tolerance=5,
+                                       wall_vertices=self.wall_vertices)
+
+        return stairs
+
+
 def snap_stairs_to_walls(stairs_data: List[Dict], walls_data: List[Dict], 
                         endpoint_threshold: float = 50.0, 
                         line_threshold: float = 30.0) -> List[Dict]:
@@ -249,6 +352,8 @@ def snap_stairs_to_walls(stairs_data: List[Dict], walls_data: List[Dict],
     1. Priority 1: Snap to nearest wall endpoint within endpoint_threshold
     2. Priority 2: If no endpoint found, snap to nearest wall line within line_threshold
     
+    Distance ties go to the wall listed first.
+    
     Post-processing:
     - Straighten near-vertical/horizontal stair lines
     - Merge duplicate/near-duplicate vertices
@@ -266,89 +371,5 @@ def snap_stairs_to_walls(stairs_data: List[Dict], walls_data: List[Dict],
     if not stairs_data or not walls_data:
         return stairs_data
     
-    stairs = [dict(s) for s in stairs_data]  # Deep copy
-    
-    # Collect all wall endpoints
-    wall_endpoints = set()
-    for wall in walls_data:
-        wall_endpoints.add((wall['x1'], wall['y1']))
-        wall_endpoints.add((wall['x2'], wall['y2']))
-    
-    # Process each stair line's endpoints
-    for stair in stairs:
-        # Process start point (x1, y1)
-        px, py = stair['x1'], stair['y1']
-        
-        best_snap = None
-        best_dist = endpoint_threshold
-        snap_type = None
-        
-        # Try to snap to wall endpoints
-        for ex, ey in wall_endpoints:
-            dist = distance_point_to_point((px, py), (ex, ey))
-            if dist < best_dist:
-                best_dist = dist
-                best_snap = (ex, ey)
-                snap_type = "endpoint"
-        
-        # If no endpoint found, try to snap to wall lines
-        if snap_type != "endpoint":
-            best_dist = line_threshold
-            for wall in walls_data:
-                dist = distance_point_to_segment((px, py), (wall['x1'], wall['y1']), (wall['x2'], wall['y2']))
-                
-                if dist < best_dist:
-                    # Get closest point on the line
-                    closest = project_point_on_segment((px, py), (wall['x1'], wall['y1']), (wall['x2'], wall['y2']))
-                    best_snap = closest
-                    best_dist = dist
-                    snap_type = "line"
-        
-        # Apply snap to start point
-        if best_snap is not None:
-            stair['x1'] = int(best_snap[0])
-            stair['y1'] = int(best_snap[1])
-        
-        # Process end point (x2, y2)
-        px, py = stair['x2'], stair['y2']
-        
-        best_snap = None
-        best_dist = endpoint_threshold
-        snap_type = None
-        
-        # Try to snap to wall endpoints
-        for ex, ey in wall_endpoints:
-            dist = distance_point_to_point((px, py), (ex, ey))
-            if dist < best_dist:
-                best_dist = dist
-                best_snap = (ex, ey)
-                snap_type = "endpoint"
-        
-        # If no endpoint found, try to snap to wall lines
-        if snap_type != "endpoint":
-            best_dist = line_threshold
-            for wall in walls_data:
-                dist = distance_point_to_segment((px, py), (wall['x1'], wall['y1']), (wall['x2'], wall['y2']))
-                
-                if dist < best_dist:
-                    # Get closest point on the line
-                    closest = project_point_on_segment((px, py), (wall['x1'], wall['y1']), (wall['x2'], wall['y2']))
-                    best_snap = closest
-                    best_dist = dist
-                    snap_type = "line"
-        
-        # Apply snap to end point
-        if best_snap is not None:
-            stair['x2'] = int(best_snap[0])
-            stair['y2'] = int(best_snap[1])
-    
-    # Post-processing: Straighten stair lines that should be perpendicular or horizontal
-    stairs = straighten_stair_lines(stairs, tolerance=10)
-    
-    # Merge duplicate/near-duplicate vertices within stairs
-    stairs = merge_duplicate_vertices(stairs, tolerance=2)
-    
-    # Merge stair vertices with wall vertices
-    stairs = merge_stairs_to_walls(stairs, walls_data, tolerance=5)
-    
-    return stairs
+    session = SnapSession(stairs_data, walls_data, max(endpoint_threshold, line_threshold))
+    return session.snap(endpoint_threshold, line_threshold)
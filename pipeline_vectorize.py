@@ -1,7 +1,12 @@
 import cv2
 import numpy as np
 import math
+import bisect
 import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from geometry import cluster_points, PointIndex
 
 # --- TUNING ---
 MERGE_ALIGN_TOL = 20
@@ -13,6 +18,20 @@ PATH_GAP_TOL = 100.0
 CORNER_SNAP_DIST = 45
 DIAG_SNAP_DIST = 60
 FUSE_DIST = 30
+MAX_WOBBLE_ROUNDS = 25       # Upper bound on merge_diagonals_wobble rounds
+SNAP_CHUNK = 512             # Line ends per NumPy batch in snap_free_vh_to_diagonal
+HOUGH_THRESHOLD = 8
+HOUGH_MIN_LENGTH = 10
+HOUGH_MAX_GAP = 20
+MIN_COMPONENT_SIZE = 15    # px, skeleton components smaller than this are dropped in per-component mode
+CHAIN_EPSILON = 2.0        # px, max deviation when simplifying traced skeleton paths
+
+# --- LINE DETECTORS ---
+# 'hough' is the original whole-image HoughLinesP. The others trade its many
+# short overlapping fragments for fewer, longer segments: 'chain' walks the
+# skeleton graph and simplifies each path, 'lsd' is OpenCV's line segment
+# detector and 'edlines' is ximgproc's EdgeDrawing (needs opencv-contrib).
+DEFAULT_LINE_DETECTOR = 'hough'
 
 # --- HELPER MATH ---
 def get_dist_point_to_line(px, py, x1, y1, x2, y2):
@@ -36,55 +55,152 @@ def get_intersection(l1, l2):
     return (x1 + ua * (x2 - x1), y1 + ua * (y2 - y1))
 
 # --- 1. V/H PROCESSING ---
-def merge_parallel_lines(lines, orientation='horizontal'):
+class _IntervalTree:
+    """
+    Segment tree over a fixed sequence of intervals supporting removal and
+    "first live interval at or after position l, before r, overlapping [lo, hi]".
+    Each node keeps the min start and max end of its live leaves.
+    """
+    def __init__(self, starts, ends):
+        size = 1
+        while size < max(1, len(starts)):
+            size *= 2
+        self.size = size
+        self.mn = [math.inf] * (2 * size)
+        self.mx = [-math.inf] * (2 * size)
+        self.mn[size:size + len(starts)] = starts
+        self.mx[size:size + len(ends)] = ends
+        for node in range(size - 1, 0, -1):
+            self.mn[node] = min(self.mn[2 * node], self.mn[2 * node + 1])
+            self.mx[node] = max(self.mx[2 * node], self.mx[2 * node + 1])
+
+    def remove(self, pos):
+        node = pos + self.size
+        self.mn[node], self.mx[node] = math.inf, -math.inf
+        node //= 2
+        while node:
+            self.mn[node] = min(self.mn[2 * node], self.mn[2 * node + 1])
+            self.mx[node] = max(self.mx[2 * node], self.mx[2 * node + 1])
+            node //= 2
+
+    def first_overlap(self, l, r, lo, hi):
+        """Smallest live position in [l, r) whose interval meets [lo, hi], or -1."""
+        mn, mx, size = self.mn, self.mx, self.size
+        stack = [(1, 0, size)]
+        while stack:
+            node, nl, nr = stack.pop()
+            if nr <= l or nl >= r or mn[node] > hi or mx[node] < lo:
+                continue
+            if nr - nl == 1:
+                return nl
+            mid = (nl + nr) // 2
+            stack.append((2 * node + 1, mid, nr))
+            stack.append((2 * node, nl, mid))
+        return -1
+
+def merge_parallel_lines(lines, orientation='horizontal', align_tol=MERGE_ALIGN_TOL, gap_tol=MERGE_GAP_TOL):
+    """
+    Greedily merge parallel, overlapping (or nearly touching) lines.
+
+    Lines are swept in (align, start) order. Each surviving line absorbs, in
+    that order, every later line within align_tol of its running average
+    position whose span comes within gap_tol of its own, then is emitted.
+    Later lines never sit below the current one, so the sweep stops at the
+    first line beyond align_tol, and an interval tree finds the next mergeable
+    line without rescanning the ones that were skipped: O(n log n) on
+    typical input instead of the old pop(0)/rescan loop.
+    """
     if not lines: return []
     norm_lines = [[*l] for l in lines]
     idx_align = 1 if orientation == 'horizontal' else 0
     idx_start = 0 if orientation == 'horizontal' else 1
     norm_lines.sort(key=lambda l: (l[idx_align], l[idx_start]))
 
+    aligns = [l[idx_align] for l in norm_lines]
+    starts = [min(l[idx_start], l[idx_start+2]) for l in norm_lines]
+    ends = [max(l[idx_start], l[idx_start+2]) for l in norm_lines]
+    tree = _IntervalTree([s - gap_tol for s in starts], [e + gap_tol for e in ends])
+    alive = [True] * len(norm_lines)
+
     merged = []
-    while norm_lines:
-        current = norm_lines.pop(0)
-        i = 0
-        while i < len(norm_lines):
-            cand = norm_lines[i]
-            pos_diff = abs(current[idx_align] - cand[idx_align])
-            if pos_diff <= MERGE_ALIGN_TOL:
-                c_start, c_end = min(current[idx_start], current[idx_start+2]), max(current[idx_start], current[idx_start+2])
-                n_start, n_end = min(cand[idx_start], cand[idx_start+2]), max(cand[idx_start], cand[idx_start+2])
-                if (c_end + MERGE_GAP_TOL >= n_start) and (n_end + MERGE_GAP_TOL >= c_start):
-                    new_start = min(c_start, n_start)
-                    new_end = max(c_end, n_end)
-                    new_pos = (current[idx_align] + cand[idx_align]) // 2
-                    if orientation == 'horizontal': current = [new_start, new_pos, new_end, new_pos]
-                    else:                           current = [new_pos, new_start, new_pos, new_end]
-                    norm_lines.pop(i)
-                    continue 
-            i += 1
+    for pos in range(len(norm_lines)):
+        if not alive[pos]: continue
+        alive[pos] = False
+        tree.remove(pos)
+        current = norm_lines[pos]
+        c_align, c_start, c_end = aligns[pos], starts[pos], ends[pos]
+        ptr = pos + 1
+        while True:
+            # Candidates are sorted by align and never below c_align
+            limit = bisect.bisect_right(aligns, c_align + align_tol, ptr)
+            # Gap test: (c_end + gap >= n_start) and (n_end + gap >= c_start)
+            nxt = tree.first_overlap(ptr, limit, c_start, c_end)
+            if nxt < 0: break
+            c_start, c_end = min(c_start, starts[nxt]), max(c_end, ends[nxt])
+            c_align = (c_align + aligns[nxt]) // 2
+            if orientation == 'horizontal': current = [c_start, c_align, c_end, c_align]
+            else:                           current = [c_align, c_start, c_align, c_end]
+            alive[nxt] = False
+            tree.remove(nxt)
+            ptr = nxt + 1
         merged.append(current)
     return merged
 
-def stitch_sequential_lines(lines, orientation='horizontal'):
-    if not lines: return []
+def build_alignment_buckets(lines, orientation='horizontal', align_tol=STITCH_ALIGN_TOL):
+    """
+    Group lines that share (roughly) the same row or column.
+
+    Lines are taken in input order; each line not yet in a bucket opens a new
+    one and claims every unclaimed line whose alignment is strictly within
+    align_tol of its own. Alignments are sorted once and claimed lines are
+    skipped with path-compressed next pointers, so every line is visited once
+    after the O(n log n) sort.
+
+    Returns:
+        List of buckets in creation order, each a list of indices into lines
+        sorted by (span start, index)
+    """
     idx_align = 1 if orientation == 'horizontal' else 0
     idx_start = 0 if orientation == 'horizontal' else 1
+    order = sorted(range(len(lines)), key=lambda i: lines[i][idx_align])
+    aligns = [lines[i][idx_align] for i in order]
+    rank = [0] * len(lines)
+    for pos, i in enumerate(order):
+        rank[i] = pos
+    nxt = list(range(len(lines) + 1))   # Next unclaimed sorted position
+
+    def find(pos):
+        root = pos
+        while nxt[root] != root:
+            root = nxt[root]
+        while nxt[pos] != root:
+            nxt[pos], pos = root, nxt[pos]
+        return root
+
     buckets = []
-    processed = [False] * len(lines)
     for i in range(len(lines)):
-        if processed[i]: continue
-        bucket = [lines[i]]
-        processed[i] = True
-        for j in range(i + 1, len(lines)):
-            if processed[j]: continue
-            if abs(lines[i][idx_align] - lines[j][idx_align]) < STITCH_ALIGN_TOL:
-                bucket.append(lines[j])
-                processed[j] = True
+        if find(rank[i]) != rank[i]: continue
+        a = lines[i][idx_align]
+        bucket = [i]
+        nxt[rank[i]] = rank[i] + 1
+        pos = find(bisect.bisect_right(aligns, a - align_tol))
+        end = bisect.bisect_left(aligns, a + align_tol)
+        while pos < end:
+            bucket.append(order[pos])
+            nxt[pos] = pos + 1
+            pos = find(pos + 1)
+        bucket.sort(key=lambda j: (min(lines[j][idx_start], lines[j][idx_start+2]), j))
         buckets.append(bucket)
+    return buckets
+
+def stitch_sequential_lines(lines, orientation='horizontal', align_tol=STITCH_ALIGN_TOL, gap_tol=STITCH_GAP_TOL):
+    if not lines: return []
+    idx_align = 1 if orientation == 'horizontal' else 0
+    idx_start = 0 if orientation == 'horizontal' else 1
+    buckets = [[lines[j] for j in bucket]
+               for bucket in build_alignment_buckets(lines, orientation, align_tol)]
     final_lines = []
     for bucket in buckets:
-        bucket.sort(key=lambda l: min(l[idx_start], l[idx_start+2]))
-        if not bucket: continue
         curr = bucket[0]
         c_min = min(curr[idx_start], curr[idx_start+2])
         c_max = max(curr[idx_start], curr[idx_start+2])
@@ -94,7 +210,7 @@ def stitch_sequential_lines(lines, orientation='horizontal'):
             next_l = bucket[k]
             n_min = min(next_l[idx_start], next_l[idx_start+2])
             n_max = max(next_l[idx_start], next_l[idx_start+2])
-            if n_min <= c_max + STITCH_GAP_TOL:
+            if n_min <= c_max + gap_tol:
                 c_max = max(c_max, n_max)
                 avg_pos += next_l[idx_align]
                 count += 1
@@ -112,79 +228,193 @@ def stitch_sequential_lines(lines, orientation='horizontal'):
     return final_lines
 
 # --- 2. DIAGONAL MERGE (WOBBLE LOGIC) ---
-def merge_diagonals_wobble(lines):
-    if not lines: return []
+def _cluster_extremes(points, base):
+    """
+    Farthest-apart pair of a cluster, taken as the two extremes of the points
+    projected onto the base line's direction. The earlier point in the list
+    comes first, matching the orientation the pairwise search produced.
+    """
+    bx1, by1, bx2, by2 = base
+    dx, dy = bx2 - bx1, by2 - by1
+    if dx == 0 and dy == 0:
+        for px, py in points:
+            if (px, py) != (bx1, by1):
+                dx, dy = px - bx1, py - by1
+                break
+    proj = [(px - bx1) * dx + (py - by1) * dy for px, py in points]
+    lo = min(range(len(points)), key=proj.__getitem__)
+    hi = max(range(len(points)), key=proj.__getitem__)
+    if hi < lo: lo, hi = hi, lo
+    return points[lo], points[hi]
+
+def merge_diagonals_wobble(lines, width_tol=PATH_WIDTH_TOL, gap_tol=PATH_GAP_TOL,
+                           max_rounds=MAX_WOBBLE_ROUNDS, stats=None):
+    """
+    Merge diagonal fragments that follow the same (possibly wobbly) path.
+
+    Each round visits lines longest first; a line absorbs every later line
+    within 15 degrees whose endpoints both lie within width_tol of it and
+    whose nearest endpoint is within gap_tol, and the cluster is replaced by
+    its two extreme points along the base direction. Candidates come from a
+    grid keyed by (angle bin, endpoint cell of size gap_tol), so a line is only
+    compared with neighbours that could pass the gap test. Rounds repeat until
+    nothing merges, at most max_rounds times.
+
+    Args:
+        lines: [x1, y1, x2, y2] lists
+        width_tol: Max distance of a candidate's endpoints from the base line
+        gap_tol: Max distance between the closest endpoints
+        max_rounds: Upper bound on merge rounds
+        stats: Optional dict, filled with 'rounds', 'lines_per_round',
+               'seconds' and 'hit_limit'
+
+    Returns:
+        Merged lines as int lists
+    """
+    t0 = time.perf_counter()
+    lines_per_round = []
+    if not lines:
+        if stats is not None:
+            stats.update(rounds=0, lines_per_round=[], seconds=0.0, hit_limit=False)
+        return []
     current_lines = [list(map(float, l)) for l in lines]
+    cell = max(gap_tol, 1.0)
+    angle_bins = 12   # 15 degree bins over [0, 180)
     changed = True
-    while changed:
+    rounds = 0
+    while changed and rounds < max_rounds:
         changed = False
+        rounds += 1
+        lines_per_round.append(len(current_lines))
         new_lines = []
         used = [False] * len(current_lines)
         current_lines.sort(key=lambda l: math.hypot(l[2]-l[0], l[3]-l[1]), reverse=True)
-        
+        angles = [get_line_params(l) for l in current_lines]
+
+        grid = {}
+        keys = []
+        for j, l in enumerate(current_lines):
+            b = int(angles[j] // 15) % angle_bins
+            k = {(b, math.floor(l[0] / cell), math.floor(l[1] / cell)),
+                 (b, math.floor(l[2] / cell), math.floor(l[3] / cell))}
+            keys.append(k)
+            for key in k:
+                grid.setdefault(key, []).append(j)
+
         for i in range(len(current_lines)):
             if used[i]: continue
             base = current_lines[i]
             used[i] = True
             bx1, by1, bx2, by2 = base
             cluster_pts = [(bx1, by1), (bx2, by2)]
-            
-            for j in range(i + 1, len(current_lines)):
-                if used[j]: continue
+
+            candidates = set()
+            for b, cx, cy in keys[i]:
+                for db in (-1, 0, 1):
+                    nb = (b + db) % angle_bins
+                    for gx in (cx - 1, cx, cx + 1):
+                        for gy in (cy - 1, cy, cy + 1):
+                            for j in grid.get((nb, gx, gy), ()):
+                                if j > i and not used[j]:
+                                    candidates.add(j)
+
+            angle_base = angles[i]
+            for j in sorted(candidates):
                 cand = current_lines[j]
                 cx1, cy1, cx2, cy2 = cand
-                angle_base = get_line_params(base)
-                angle_cand = get_line_params(cand)
-                diff = abs(angle_base - angle_cand)
+                diff = abs(angle_base - angles[j])
                 if diff > 170: diff = abs(diff - 180)
                 if diff > 15.0: continue 
                 
                 d1 = get_dist_point_to_line(cx1, cy1, bx1, by1, bx2, by2)
                 d2 = get_dist_point_to_line(cx2, cy2, bx1, by1, bx2, by2)
                 
-                if d1 < PATH_WIDTH_TOL and d2 < PATH_WIDTH_TOL:
+                if d1 < width_tol and d2 < width_tol:
                     dist_gap = min(
                         math.hypot(cx1-bx1, cy1-by1), math.hypot(cx1-bx2, cy1-by2),
                         math.hypot(cx2-bx1, cy2-by1), math.hypot(cx2-bx2, cy2-by2)
                     )
-                    if dist_gap < PATH_GAP_TOL:
+                    if dist_gap < gap_tol:
                         cluster_pts.append((cx1, cy1))
                         cluster_pts.append((cx2, cy2))
                         used[j] = True
                         changed = True
             
             if len(cluster_pts) > 2:
-                best_p1, best_p2 = cluster_pts[0], cluster_pts[0]
-                max_d = 0
-                for p1 in cluster_pts:
-                    for p2 in cluster_pts:
-                        d = (p1[0]-p2[0])**2 + (p1[1]-p2[1])**2
-                        if d > max_d:
-                            max_d = d
-                            best_p1, best_p2 = p1, p2
+                best_p1, best_p2 = _cluster_extremes(cluster_pts, base)
                 new_lines.append([best_p1[0], best_p1[1], best_p2[0], best_p2[1]])
             else:
                 new_lines.append(base)
         current_lines = new_lines
+
+    if stats is not None:
+        stats.update(rounds=rounds, lines_per_round=lines_per_round,
+                     seconds=time.perf_counter() - t0, hit_limit=changed)
     return [list(map(int, l)) for l in current_lines]
 
 # --- 3. CONNECTION LOGIC (LOCK & KEY) ---
-def connect_corners_vh_and_lock(verticals, horizontals):
+def connect_corners_vh_and_lock(verticals, horizontals, snap_dist=CORNER_SNAP_DIST, overhang=10, stats=None):
+    """
+    Snap vertical and horizontal line ends together at corners and T-joints,
+    returning the adjusted copies and the set of locked corner points.
+
+    A pair can only snap if the vertical's x lies within the horizontal's
+    span padded by snap_dist/overhang and the horizontal's y lies within the
+    vertical's padded span. Horizontals are therefore indexed in a grid by
+    their row and padded x extent (re-indexed when an end moves), and each
+    vertical visits, in index order, just the horizontals in its column of
+    cells. Every other pair fails all snap tests, so the result is the same
+    as checking all V*H pairs.
+
+    Args:
+        verticals, horizontals: [x1, y1, x2, y2] lists (not modified)
+        snap_dist: Max end-to-line distance for a snap
+        overhang: Slack when testing whether a line's position falls within
+                  the other's span
+        stats: Optional dict, filled with 'candidate_pairs' (pairs tested)
+               and 'all_pairs' (V*H)
+
+    Returns:
+        (verticals, horizontals, locked_points)
+    """
     locked_points = set()
     verts = [list(l) for l in verticals]
     horzs = [list(l) for l in horizontals]
+
+    pad = max(snap_dist, overhang)
+    cell = max(pad, 1)
+    grid = {}   # (x cell, y cell) -> indices of horizontals whose padded span covers it
+    def span_keys(k):
+        h = horzs[k]
+        cy = math.floor(h[1] / cell)
+        x0 = math.floor((min(h[0], h[2]) - pad) / cell)
+        x1 = math.floor((max(h[0], h[2]) + pad) / cell)
+        return [(cx, cy) for cx in range(x0, x1 + 1)]
+    for k in range(len(horzs)):
+        for key in span_keys(k):
+            grid.setdefault(key, []).append(k)
+    evaluated = 0
     
     for v in verts:
         vx, vy1, vy2 = v[0], min(v[1], v[3]), max(v[1], v[3])
-        for h in horzs:
+
+        cx = math.floor(vx / cell)
+        candidates = set()
+        for cy in range(math.floor((vy1 - pad) / cell), math.floor((vy2 + pad) / cell) + 1):
+            candidates.update(grid.get((cx, cy), ()))
+        evaluated += len(candidates)
+
+        for k in sorted(candidates):
+            h = horzs[k]
             hx1, hx2, hy = min(h[0], h[2]), max(h[0], h[2]), h[1]
             
-            v_near_h = (abs(vy1 - hy) < CORNER_SNAP_DIST) or (abs(vy2 - hy) < CORNER_SNAP_DIST)
-            h_near_v = (abs(hx1 - vx) < CORNER_SNAP_DIST) or (abs(hx2 - vx) < CORNER_SNAP_DIST)
-            v_in_h = (hx1 - 10 <= vx <= hx2 + 10)
-            h_in_v = (vy1 - 10 <= hy <= vy2 + 10)
+            v_near_h = (abs(vy1 - hy) < snap_dist) or (abs(vy2 - hy) < snap_dist)
+            h_near_v = (abs(hx1 - vx) < snap_dist) or (abs(hx2 - vx) < snap_dist)
+            v_in_h = (hx1 - overhang <= vx <= hx2 + overhang)
+            h_in_v = (vy1 - overhang <= hy <= vy2 + overhang)
             
             snap_pt = None
+            old_keys = span_keys(k) if h_near_v else None
             
             if v_near_h and h_near_v:
                 if abs(vy1 - hy) < abs(vy2 - hy): v[1] = hy 
@@ -203,99 +433,349 @@ def connect_corners_vh_and_lock(verticals, horizontals):
                 else:                             h[2] = vx
                 snap_pt = (vx, hy)
                 
+            if old_keys is not None:
+                new_keys = span_keys(k)
+                if new_keys != old_keys:
+                    for key in old_keys: grid[key].remove(k)
+                    for key in new_keys: grid.setdefault(key, []).append(k)
             if snap_pt:
                 locked_points.add((int(snap_pt[0]), int(snap_pt[1])))
-                
+
+    if stats is not None:
+        stats.update(candidate_pairs=evaluated, all_pairs=len(verts) * len(horzs))
     return verts, horzs, locked_points
 
-def is_locked(pt, locked_set):
-    for lp in locked_set:
-        if abs(pt[0]-lp[0]) < 5 and abs(pt[1]-lp[1]) < 5: return True
+def is_locked(pt, locked, tol=5):
+    """
+    True if pt lies within tol (on both axes) of a locked corner.
+    locked is a PointIndex or any iterable of (x, y) points.
+    """
+    if isinstance(locked, PointIndex):
+        return bool(locked.query_box(pt, tol))
+    for lp in locked:
+        if abs(pt[0]-lp[0]) < tol and abs(pt[1]-lp[1]) < tol: return True
     return False
 
-def snap_diagonal_ends_to_locked_corners(diagonals, locked_set):
+def snap_diagonal_ends_to_locked_corners(diagonals, locked, snap_dist=DIAG_SNAP_DIST):
+    """
+    Move each diagonal end onto the nearest locked corner closer than
+    snap_dist. locked is a PointIndex or a set of (x, y) points.
+    """
+    if not isinstance(locked, PointIndex):
+        locked = PointIndex(locked, cell_size=snap_dist)
     for d in diagonals:
         for i in [0, 2]:
-            dx, dy = d[i], d[i+1]
-            best_dist = DIAG_SNAP_DIST
-            best_lock = None
-            for lx, ly in locked_set:
-                dist = math.hypot(dx - lx, dy - ly)
-                if dist < best_dist:
-                    best_dist = dist
-                    best_lock = (lx, ly)
-            if best_lock:
-                d[i], d[i+1] = best_lock
-
-def snap_free_vh_to_diagonal(orthos, diagonals, locked_set):
-    for o in orthos:
-        for i in [0, 2]:
-            ox, oy = o[i], o[i+1]
-            if is_locked((ox, oy), locked_set): continue 
-            
-            best_dist = DIAG_SNAP_DIST
-            best_int = None
-            
-            for d in diagonals:
-                inter = get_intersection(o, d)
-                if inter:
-                    ix, iy = inter
-                    dist = math.hypot(ox - ix, oy - iy)
-                    if dist < best_dist:
-                        dx_min, dx_max = min(d[0], d[2]), max(d[0], d[2])
-                        dy_min, dy_max = min(d[1], d[3]), max(d[1], d[3])
-                        if (dx_min - 20 <= ix <= dx_max + 20) and (dy_min - 20 <= iy <= dy_max + 20):
-                            best_dist = dist
-                            best_int = (int(ix), int(iy))
-            if best_int:
-                o[i], o[i+1] = best_int
-
-def fuse_close_endpoints(lines):
-    points = []
-    for i, l in enumerate(lines):
-        points.append({'idx':i, 'pos':0, 'x':l[0], 'y':l[1]})
-        points.append({'idx':i, 'pos':1, 'x':l[2], 'y':l[3]})
-        
-    for i in range(len(points)):
-        for j in range(i+1, len(points)):
-            p1 = points[i]
-            p2 = points[j]
-            
-            if p1['idx'] == p2['idx']: continue
-            
-            dist = math.hypot(p1['x'] - p2['x'], p1['y'] - p2['y'])
-            
-            if dist < FUSE_DIST:
-                avg_x = (p1['x'] + p2['x']) // 2
-                avg_y = (p1['y'] + p2['y']) // 2
-                
-                p1['x'], p1['y'] = avg_x, avg_y
-                line1 = lines[p1['idx']]
-                if p1['pos'] == 0: line1[0], line1[1] = avg_x, avg_y
-                else:              line1[2], line1[3] = avg_x, avg_y
-                
-                p2['x'], p2['y'] = avg_x, avg_y
-                line2 = lines[p2['idx']]
-                if p2['pos'] == 0: line2[0], line2[1] = avg_x, avg_y
-                else:              line2[2], line2[3] = avg_x, avg_y
-    return lines
+            hit = locked.nearest((d[i], d[i+1]), snap_dist)
+            if hit:
+                d[i], d[i+1] = locked.points[hit[0]]
 
-def process_skeleton(skeleton_img):
+def snap_free_vh_to_diagonal(orthos, diagonals, locked_set, snap_dist=DIAG_SNAP_DIST, lock_tol=5, overhang=20):
     """
-    Process skeleton image and return wall data without saving files.
-    Returns dictionary with walls, stairs, and visualization image.
+    Extend or trim each unlocked V/H end to the nearest intersection of its
+    (infinite) line with a diagonal, if that point is closer than snap_dist
+    and within the diagonal's bounding box padded by overhang.
+
+    Free ends are sorted into spatial tiles and processed SNAP_CHUNK at a
+    time. For each chunk, the diagonals whose padded box can be reached
+    from it are selected. Intersections, distances and box tests are then
+    computed as one NumPy broadcast of ends x those diagonals. The few
+    diagonals that pass are re-checked with get_intersection in diagonal
+    order, so the choice (first nearest) is exactly that of the scalar
+    loop. All first ends are handled before all second ends, because a
+    line's second end is intersected using its already snapped first end.
     """
-    if skeleton_img is None:
-        return None
-    
-    lines = cv2.HoughLinesP(skeleton_img, 1, np.pi/180, threshold=8, minLineLength=10, maxLineGap=20)
-    
+    if not isinstance(locked_set, PointIndex):
+        locked_set = PointIndex(locked_set, cell_size=lock_tol)
+    if not orthos or not diagonals: return
+
+    D = np.array(diagonals, dtype=np.float64).reshape(-1, 4)
+    x3, y3, x4, y4 = D[:, 0], D[:, 1], D[:, 2], D[:, 3]
+    ddx, ddy = x4 - x3, y4 - y3
+    bx_min = np.minimum(x3, x4) - overhang - 1e-9
+    bx_max = np.maximum(x3, x4) + overhang + 1e-9
+    by_min = np.minimum(y3, y4) - overhang - 1e-9
+    by_max = np.maximum(y3, y4) + overhang + 1e-9
+    reach = snap_dist * (1 + 1e-9) + 1e-9
+
+    tile = max(snap_dist, 1) * 8
+    for i in [0, 2]:
+        free = [k for k, o in enumerate(orthos) if not is_locked((o[i], o[i+1]), locked_set, lock_tol)]
+        free.sort(key=lambda k: (math.floor(orthos[k][i+1] / tile), math.floor(orthos[k][i] / tile)))
+        for c in range(0, len(free), SNAP_CHUNK):
+            rows = free[c:c + SNAP_CHUNK]
+            O = np.array([orthos[k] for k in rows], dtype=np.float64).reshape(-1, 4)
+            # The intersection lies within snap_dist of the end and inside the padded box
+            near = np.nonzero((bx_max >= O[:, i].min() - reach) & (bx_min <= O[:, i].max() + reach)
+                              & (by_max >= O[:, i+1].min() - reach) & (by_min <= O[:, i+1].max() + reach))[0]
+            if len(near) == 0: continue
+            x1, y1, x2, y2 = (O[:, n:n+1] for n in range(4))
+            ox, oy = O[:, i:i+1], O[:, i+1:i+2]
+            denom = ddy[near] * (x2 - x1) - ddx[near] * (y2 - y1)
+            valid = np.abs(denom) >= 1e-5
+            ua = (ddx[near] * (y1 - y3[near]) - ddy[near] * (x1 - x3[near])) / np.where(valid, denom, 1.0)
+            ix = x1 + ua * (x2 - x1)
+            iy = y1 + ua * (y2 - y1)
+            hit = (valid & (np.hypot(ox - ix, oy - iy) < reach)
+                   & (bx_min[near] <= ix) & (ix <= bx_max[near]) & (by_min[near] <= iy) & (iy <= by_max[near]))
+
+            for r in np.nonzero(hit.any(axis=1))[0].tolist():
+                o = orthos[rows[r]]
+                ox_, oy_ = o[i], o[i+1]
+                best_dist = snap_dist
+                best_int = None
+                for j in near[hit[r]].tolist():
+                    d = diagonals[j]
+                    inter = get_intersection(o, d)
+                    if inter:
+                        ix_, iy_ = inter
+                        dist = math.hypot(ox_ - ix_, oy_ - iy_)
+                        if dist < best_dist:
+                            dx_min, dx_max = min(d[0], d[2]), max(d[0], d[2])
+                            dy_min, dy_max = min(d[1], d[3]), max(d[1], d[3])
+                            if (dx_min - overhang <= ix_ <= dx_max + overhang) and (dy_min - overhang <= iy_ <= dy_max + overhang):
+                                best_dist = dist
+                                best_int = (int(ix_), int(iy_))
+                if best_int:
+                    o[i], o[i+1] = best_int
+
+def fuse_close_endpoints(lines, fuse_dist=FUSE_DIST):
+    """
+    Weld endpoints of different lines that lie closer than fuse_dist.
+
+    Endpoints are grouped by leader clustering (cluster_points): each
+    member lies within fuse_dist of its cluster's seed, so a chain of
+    close endpoints (stair treads, dense hatching) does not collapse into
+    one point, and the two ends of a line never share a cluster. Every
+    cluster then moves to its (floored) centroid. Unlike pairwise
+    averaging, the result does not depend on line order.
+
+    Args:
+        lines: [x1, y1, x2, y2] lists, modified in place
+        fuse_dist: Distance to the cluster seed (exclusive)
+
+    Returns:
+        The same lines
+    """
+    if not lines: return lines
+    points = np.array(lines, dtype=np.float64).reshape(-1, 2)
+    owner = np.arange(len(points)) // 2
+    labels = cluster_points(points, fuse_dist, groups=owner)
+
+    counts = np.bincount(labels, minlength=len(points))
+    sums_x = np.bincount(labels, weights=points[:, 0], minlength=len(points))
+    sums_y = np.bincount(labels, weights=points[:, 1], minlength=len(points))
+    for k in np.nonzero(counts[labels] > 1)[0].tolist():
+        root = labels[k]
+        x, y = sums_x[root] // counts[root], sums_y[root] // counts[root]
+        line = lines[k // 2]
+        pos = 2 * (k % 2)
+        if isinstance(line[pos], (int, np.integer)): x, y = int(x), int(y)
+        line[pos], line[pos+1] = x, y
+    return lines
+
+# --- 0. LINE DETECTION ---
+def hough_params(scale=1.0):
+    """HoughLinesP threshold, minLineLength and maxLineGap for the given scale."""
+    return (max(2, int(round(HOUGH_THRESHOLD * scale))),
+            max(2, int(round(HOUGH_MIN_LENGTH * scale))),
+            max(1, int(round(HOUGH_MAX_GAP * scale))))
+
+def detect_lines_hough(skeleton_img, scale=1.0):
+    """Run HoughLinesP over the whole skeleton. Returns [x1, y1, x2, y2] lists."""
+    threshold, min_length, max_gap = hough_params(scale)
+    lines = cv2.HoughLinesP(skeleton_img, 1, np.pi/180, threshold=threshold,
+                            minLineLength=min_length, maxLineGap=max_gap)
     if lines is None:
-        return {"walls": [], "stairs": [], "others": []}
-    
+        return []
+    return [[int(v) for v in line[0]] for line in lines]
+
+def filter_small_components(skeleton_img, min_size=MIN_COMPONENT_SIZE):
+    """
+    Label the skeleton's 8-connected components and drop those with fewer
+    than min_size pixels (specks, text fragments).
+
+    Returns:
+        (labels, boxes) where boxes holds (label, x, y, w, h) of every kept
+        component, largest first
+    """
+    n, labels, stats, _ = cv2.connectedComponentsWithStats(skeleton_img, connectivity=8)
+    boxes = [(i, *stats[i][:4]) for i in range(1, n) if stats[i][4] >= min_size]
+    boxes.sort(key=lambda b: stats[b[0]][4], reverse=True)
+    return labels, boxes
+
+def detect_lines_components(skeleton_img, scale=1.0, min_size=MIN_COMPONENT_SIZE, workers=None):
+    """
+    Run HoughLinesP separately on each skeleton component that survives
+    filter_small_components, in a thread pool (OpenCV releases the GIL).
+    Each call only scans the component's bounding box, and segments can no
+    longer chain across unrelated strokes.
+
+    Returns:
+        [x1, y1, x2, y2] lists in skeleton_img coordinates, grouped by
+        component in label order
+    """
+    threshold, min_length, max_gap = hough_params(scale)
+    labels, boxes = filter_small_components(skeleton_img, max(1, int(round(min_size * scale))))
+
+    def run(box):
+        label, x, y, w, h = box
+        mask = (labels[y:y+h, x:x+w] == label).view(np.uint8)
+        found = cv2.HoughLinesP(mask, 1, np.pi/180, threshold=threshold,
+                                minLineLength=min_length, maxLineGap=max_gap)
+        if found is None:
+            return label, []
+        return label, [[int(x1) + x, int(y1) + y, int(x2) + x, int(y2) + y] for x1, y1, x2, y2 in found[:, 0]]
+
+    if workers == 1 or len(boxes) < 2:
+        results = [run(b) for b in boxes]
+    else:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(run, boxes))
+
+    results.sort(key=lambda r: r[0])
+    return [line for _, found in results for line in found]
+
+def detect_lines_lsd(skeleton_img, scale=1.0):
+    """
+    OpenCV's LSD on the skeleton. LSD follows intensity edges, so each stroke
+    may come back as two segments a pixel apart; merge_parallel_lines folds
+    them together.
+    """
+    _, min_length, _ = hough_params(scale)
+    found = cv2.createLineSegmentDetector().detect(skeleton_img)[0]
+    if found is None:
+        return []
+    lines = []
+    for x1, y1, x2, y2 in found[:, 0]:
+        if math.hypot(x2 - x1, y2 - y1) >= min_length:
+            lines.append([int(round(x1)), int(round(y1)), int(round(x2)), int(round(y2))])
+    return lines
+
+def detect_lines_edlines(skeleton_img, scale=1.0):
+    """EDLines-style detection with cv2.ximgproc's EdgeDrawing."""
+    _, min_length, _ = hough_params(scale)
+    ed = cv2.ximgproc.createEdgeDrawing()
+    params = cv2.ximgproc_EdgeDrawing_Params()
+    params.MinLineLength = min_length
+    ed.setParams(params)
+    ed.detectEdges(skeleton_img)
+    found = ed.detectLines()
+    if found is None:
+        return []
+    return [[int(round(x1)), int(round(y1)), int(round(x2)), int(round(y2))] for x1, y1, x2, y2 in found[:, 0]]
+
+def trace_skeleton_paths(skeleton_img):
+    """
+    Split a one-pixel skeleton into pixel paths between nodes (endpoints and
+    junctions, i.e. pixels without exactly two neighbours). Closed loops with
+    no node come back as a single path.
+
+    Returns:
+        List of paths, each a list of (x, y) tuples
+    """
+    binary = (skeleton_img > 0).astype(np.uint8)
+    counts = cv2.filter2D(binary, cv2.CV_8U, np.ones((3, 3), np.float32), borderType=cv2.BORDER_CONSTANT) - binary
+    ys, xs = np.nonzero(binary)
+    pixels = set(zip(xs.tolist(), ys.tolist()))
+    node_mask = (binary > 0) & (counts != 2)
+    nys, nxs = np.nonzero(node_mask)
+    nodes = set(zip(nxs.tolist(), nys.tolist()))
+    # 4-neighbours first so a walk hugs the stroke instead of cutting corners
+    steps = [(1, 0), (0, 1), (-1, 0), (0, -1), (1, 1), (-1, 1), (-1, -1), (1, -1)]
+
+    def neighbours(p):
+        return [q for q in ((p[0] + dx, p[1] + dy) for dx, dy in steps) if q in pixels]
+
+    visited = set()
+    node_links = set()
+    paths = []
+
+    def walk(start, first):
+        path = [start, first]
+        prev, cur = start, first
+        while cur not in nodes:
+            visited.add(cur)
+            nxt = None
+            for q in neighbours(cur):
+                if q != prev and (q in nodes or q not in visited or (q == start and len(path) > 2)):
+                    nxt = q
+                    break
+            if nxt is None:
+                break
+            path.append(nxt)
+            prev, cur = cur, nxt
+            if cur == start:
+                break
+        return path
+
+    for node in sorted(nodes):
+        for q in neighbours(node):
+            if q in nodes:
+                link = (min(node, q), max(node, q))
+                if link not in node_links:
+                    node_links.add(link)
+                    paths.append([node, q])
+            elif q not in visited:
+                paths.append(walk(node, q))
+
+    # Whatever is left are closed loops without any node
+    for p in sorted(pixels - visited - nodes):
+        if p in visited:
+            continue
+        nbrs = neighbours(p)
+        visited.add(p)
+        paths.append(walk(p, nbrs[0]) if nbrs else [p])
+    return paths
+
+def detect_lines_chain(skeleton_img, scale=1.0):
+    """
+    Trace the skeleton graph (trace_skeleton_paths) and simplify every path
+    with approxPolyDP. Each stroke is visited once, so there are no
+    overlapping duplicates to merge afterwards.
+    """
+    _, min_length, _ = hough_params(scale)
+    epsilon = max(1.0, CHAIN_EPSILON * scale)
+    lines = []
+    for path in trace_skeleton_paths(skeleton_img):
+        if len(path) < 2:
+            continue
+        pts = cv2.approxPolyDP(np.array(path, np.int32).reshape(-1, 1, 2), epsilon, False)[:, 0]
+        for (x1, y1), (x2, y2) in zip(pts[:-1], pts[1:]):
+            if math.hypot(x2 - x1, y2 - y1) >= min_length:
+                lines.append([int(x1), int(y1), int(x2), int(y2)])
+    return lines
+
+LINE_DETECTORS = {
+    'hough': detect_lines_hough,
+    'hough_components': detect_lines_components,
+    'lsd': detect_lines_lsd,
+    'chain': detect_lines_chain,
+    'edlines': detect_lines_edlines,
+}
+
+def get_line_detector(detector=DEFAULT_LINE_DETECTOR):
+    """
+    Resolve a line detector by name.
+
+    Args:
+        detector: One of LINE_DETECTORS
+
+    Returns:
+        Callable (skeleton_img, scale) -> list of [x1, y1, x2, y2]
+    """
+    if detector == 'edlines' and not hasattr(cv2, 'ximgproc'):
+        raise ValueError("Line detector 'edlines' needs opencv-contrib (cv2.ximgproc)")
+    if detector not in LINE_DETECTORS:
+        raise ValueError(f"Unknown line detector '{detector}'. Choose from: {', '.join(LINE_DETECTORS)}")
+    return LINE_DETECTORS[detector]
+
+def classify_lines(lines):
+    """
+    Split raw segments into near-horizontal, near-vertical and other lines.
+    Horizontal and vertical lines are squared to their average coordinate.
+    """
     horizontal, vertical, others = [], [], []
-    for line in lines:
-        x1, y1, x2, y2 = line[0]
+    for x1, y1, x2, y2 in lines:
         angle = math.degrees(math.atan2(y2 - y1, x2 - x1))
         if angle < 0: angle += 180
         if 80 <= angle <= 100:
@@ -306,28 +786,54 @@ def process_skeleton(skeleton_img):
             horizontal.append([x1, avg_y, x2, avg_y])
         else:
             others.append([x1, y1, x2, y2])
+    return horizontal, vertical, others
+
+def process_skeleton(skeleton_img, scale=1.0, detector=DEFAULT_LINE_DETECTOR):
+    """
+    Process skeleton image and return wall data without saving files.
+    Returns dictionary with walls, stairs, and visualization image.
+
+    Args:
+        skeleton_img: Skeleton image
+        scale: Resolution of skeleton_img relative to the image the tuning
+               values were chosen for (0.5 = half size); every pixel
+               tolerance is multiplied by it
+        detector: Line detector backend, one of LINE_DETECTORS
+    """
+    if skeleton_img is None:
+        return None
+    
+    detect = get_line_detector(detector)
+    lines = detect(skeleton_img, scale)
+    
+    if not lines:
+        return {"walls": [], "stairs": [], "others": []}
+    
+    horizontal, vertical, others = classify_lines(lines)
 
     # 1. Process V/H
-    final_v = merge_parallel_lines(vertical, 'vertical')
-    final_h = merge_parallel_lines(horizontal, 'horizontal')
-    final_v = stitch_sequential_lines(final_v, 'vertical')
-    final_h = stitch_sequential_lines(final_h, 'horizontal')
+    s = scale
+    final_v = merge_parallel_lines(vertical, 'vertical', MERGE_ALIGN_TOL * s, MERGE_GAP_TOL * s)
+    final_h = merge_parallel_lines(horizontal, 'horizontal', MERGE_ALIGN_TOL * s, MERGE_GAP_TOL * s)
+    final_v = stitch_sequential_lines(final_v, 'vertical', STITCH_ALIGN_TOL * s, STITCH_GAP_TOL * s)
+    final_h = stitch_sequential_lines(final_h, 'horizontal', STITCH_ALIGN_TOL * s, STITCH_GAP_TOL * s)
     
     # 2. Connect V-H & Lock
-    final_v, final_h, locked_set = connect_corners_vh_and_lock(final_v, final_h)
+    final_v, final_h, locked_set = connect_corners_vh_and_lock(final_v, final_h, CORNER_SNAP_DIST * s, 10 * s)
     
     # 3. Process Diagonals
-    final_o = merge_diagonals_wobble(others)
+    final_o = merge_diagonals_wobble(others, PATH_WIDTH_TOL * s, PATH_GAP_TOL * s)
     
     # 4. Snap Diagonals to Locked Corners
-    snap_diagonal_ends_to_locked_corners(final_o, locked_set)
+    locked_index = PointIndex(locked_set, cell_size=DIAG_SNAP_DIST * s)
+    snap_diagonal_ends_to_locked_corners(final_o, locked_index, DIAG_SNAP_DIST * s)
 
     # 5. Snap Free V/H Ends -> Diagonals
-    snap_free_vh_to_diagonal(final_v + final_h, final_o, locked_set)
+    snap_free_vh_to_diagonal(final_v + final_h, final_o, locked_index, DIAG_SNAP_DIST * s, 5 * s, 20 * s)
     
     # 6. FUSE
     all_lines = final_v + final_h + final_o
-    all_lines = fuse_close_endpoints(all_lines)
+    all_lines = fuse_close_endpoints(all_lines, FUSE_DIST * s)
 
     return {
         "walls": all_lines,
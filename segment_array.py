@@ -0,0 +1,262 @@
+"""
+Columnar store for wall and stair segments.
+
+The pipeline stages exchange lists of {x1, y1, x2, y2, ...} dicts. A
+SegmentArray holds the same data as an int32 (N, 4) coordinate array plus
+side columns for the segment type, stair_polygon_id and floors_connected,
+so stages can work on whole columns with NumPy instead of touching one dict
+at a time. Rows are stored grouped by type, which makes the walls and
+stairs blocks zero-copy slices of the coordinate array.
+
+from_json/to_json convert to and from the JSON shape losslessly: the
+original segment order, the key order of every dict and any keys the store
+does not know about are kept, so a stage can switch to SegmentArray while
+its neighbours still read and write plain dicts.
+"""
+
+import json
+import numpy as np
+
+TYPE_NONE = 0
+TYPE_WALL = 1
+TYPE_STAIR = 2
+TYPE_NAMES = {TYPE_WALL: 'wall', TYPE_STAIR: 'stair'}
+TYPE_CODES = {name: code for code, name in TYPE_NAMES.items()}
+
+NO_POLYGON = -1            # stair_polygon_id of segments outside any polygon
+
+COORD_KEYS = ('x1', 'y1', 'x2', 'y2')
+_COLUMN_KEYS = COORD_KEYS + ('type', 'stair_polygon_id', 'floors_connected')
+
+
+def _as_int(value, key, idx):
+    if isinstance(value, (bool, np.bool_)) or not isinstance(value, (int, np.integer)):
+        raise ValueError(f"Segment {idx}: {key}={value!r} is not an integer")
+    return int(value)
+
+
+class SegmentArray:
+    """
+    Segments as columns.
+
+    Attributes:
+        coords: int32 (N, 4) array of x1, y1, x2, y2
+        types: int8 (N,) type codes (TYPE_NONE, TYPE_WALL, TYPE_STAIR)
+        polygon_ids: int32 (N,) stair_polygon_id, NO_POLYGON where absent
+        floors: length-N list of floors_connected values, None where absent
+        extras: length-N list of dicts with any other keys, or None
+        order: int (N,) array; row i came from position order[i] of the
+               JSON list, so to_json can restore the original order
+
+    Rows are kept sorted by type code (stable), so walls and stairs are
+    contiguous blocks. Edit coordinates and ids in place through the
+    arrays; build a new SegmentArray to add or remove rows.
+    """
+
+    def __init__(self, coords, types=None, polygon_ids=None, floors=None, extras=None,
+                 order=None, keys=None):
+        coords = np.asarray(coords, dtype=np.int32).reshape(-1, 4)
+        n = len(coords)
+        types = (np.zeros(n, np.int8) if types is None
+                 else np.asarray(types, dtype=np.int8).reshape(n))
+        polygon_ids = (np.full(n, NO_POLYGON, np.int32) if polygon_ids is None
+                       else np.asarray(polygon_ids, dtype=np.int32).reshape(n))
+        floors = [None] * n if floors is None else list(floors)
+        extras = [None] * n if extras is None else list(extras)
+        keys = [None] * n if keys is None else list(keys)
+        order = np.arange(n) if order is None else np.asarray(order, dtype=np.intp).reshape(n)
+
+        # Group rows by type so each type is one contiguous slice
+        perm = np.argsort(types, kind='stable')
+        if np.any(perm != np.arange(n)):
+            coords, types, polygon_ids, order = (coords[perm], types[perm],
+                                                 polygon_ids[perm], order[perm])
+            floors = [floors[i] for i in perm]
+            extras = [extras[i] for i in perm]
+            keys = [keys[i] for i in perm]
+
+        self.coords = np.ascontiguousarray(coords)
+        self.types = types
+        self.polygon_ids = polygon_ids
+        self.floors = floors
+        self.extras = extras
+        self.order = order
+        self._keys = keys          # Original key order per row, None for new rows
+
+    def __len__(self):
+        return len(self.coords)
+
+    def __repr__(self):
+        return (f"SegmentArray({len(self)} segments: {len(self.walls)} walls, "
+                f"{len(self.stairs)} stairs)")
+
+    # --- Views ---
+
+    def _block(self, code):
+        lo, hi = np.searchsorted(self.types, [code, code + 1])
+        return slice(int(lo), int(hi))
+
+    @property
+    def walls(self):
+        """(W, 4) view of the wall coordinates."""
+        return self.coords[self._block(TYPE_WALL)]
+
+    @property
+    def stairs(self):
+        """(S, 4) view of the stair coordinates."""
+        return self.coords[self._block(TYPE_STAIR)]
+
+    @property
+    def untyped(self):
+        """(U, 4) view of the coordinates of segments with no known type."""
+        return self.coords[self._block(TYPE_NONE)]
+
+    def rows(self, type_name):
+        """Slice of the rows holding segments of type_name ('wall' or 'stair')."""
+        return self._block(TYPE_CODES[type_name])
+
+    @property
+    def endpoints(self):
+        """(2N, 2) view of all endpoints: rows 2i and 2i+1 belong to segment i."""
+        return self.coords.reshape(-1, 2)
+
+    # --- Conversion ---
+
+    @classmethod
+    def from_json(cls, segments, default_type=None):
+        """
+        Build from a list of segment dicts.
+
+        Args:
+            segments: List of dicts with integer x1, y1, x2, y2 and optional
+                      type, stair_polygon_id and floors_connected
+            default_type: 'wall' or 'stair' for dicts without a 'type' key
+                          (e.g. a walls-only file); no 'type' key is added
+                          back on output
+
+        Returns:
+            SegmentArray
+        """
+        default_code = TYPE_CODES[default_type] if default_type else TYPE_NONE
+        n = len(segments)
+        coords = np.empty((n, 4), dtype=np.int32)
+        types = np.full(n, default_code, dtype=np.int8)
+        polygon_ids = np.full(n, NO_POLYGON, dtype=np.int32)
+        floors, extras, keys = [None] * n, [None] * n, [None] * n
+
+        for idx, seg in enumerate(segments):
+            if not isinstance(seg, dict):
+                raise ValueError(f"Segment {idx} is not a dict: {seg!r}")
+            try:
+                coords[idx] = [_as_int(seg[k], k, idx) for k in COORD_KEYS]
+            except KeyError as e:
+                raise ValueError(f"Segment {idx} has no {e.args[0]}") from None
+            extra = None
+            for k, v in seg.items():
+                if k in COORD_KEYS:
+                    continue
+                if k == 'type' and v in TYPE_CODES:
+                    types[idx] = TYPE_CODES[v]
+                elif k == 'type':
+                    types[idx] = TYPE_NONE
+                    extra = extra or {}
+                    extra[k] = v
+                elif (k == 'stair_polygon_id' and isinstance(v, int)
+                      and not isinstance(v, bool) and v != NO_POLYGON):
+                    polygon_ids[idx] = v
+                elif k == 'floors_connected':
+                    floors[idx] = v
+                else:
+                    extra = extra or {}
+                    extra[k] = v
+            extras[idx] = extra
+            keys[idx] = tuple(seg)
+
+        return cls(coords, types, polygon_ids, floors, extras, keys=keys)
+
+    def _row_dict(self, i):
+        x1, y1, x2, y2 = self.coords[i].tolist()
+        extra = self.extras[i]
+        values = dict(extra) if extra else {}      # Columns win over stale extras
+        values.update(x1=x1, y1=y1, x2=x2, y2=y2)
+        code = int(self.types[i])
+        if code != TYPE_NONE:
+            values['type'] = TYPE_NAMES[code]
+        if self.polygon_ids[i] != NO_POLYGON:
+            values['stair_polygon_id'] = int(self.polygon_ids[i])
+        if self.floors[i] is not None:
+            values['floors_connected'] = self.floors[i]
+
+        keys = self._keys[i]
+        if keys is None:
+            ordered = ('type',) + COORD_KEYS + ('stair_polygon_id', 'floors_connected')
+            out = {k: values[k] for k in ordered if k in values}
+            if extra:
+                for k in extra:
+                    out.setdefault(k, values[k])
+            return out
+        # Original keys first, in their order; then columns set since loading
+        out = {k: values[k] for k in keys if k in values}
+        for k in _COLUMN_KEYS:
+            if k in values and k not in out and not (k == 'type' and self._implicit_type(i)):
+                out[k] = values[k]
+        if extra:
+            for k in extra:
+                out.setdefault(k, values[k])
+        return out
+
+    def _implicit_type(self, i):
+        """True if row i took its type from default_type rather than a 'type' key."""
+        return 'type' not in self._keys[i]
+
+    def to_json(self, type_name=None):
+        """
+        Convert back to a list of segment dicts in the original order.
+
+        Args:
+            type_name: Only emit segments of this type ('wall' or 'stair')
+
+        Returns:
+            List of dicts
+        """
+        rows = (range(len(self)) if type_name is None
+                else range(*self.rows(type_name).indices(len(self))))
+        rows = sorted(rows, key=self.order.__getitem__)
+        return [self._row_dict(i) for i in rows]
+
+    @classmethod
+    def load(cls, path, default_type=None):
+        """Read a segments JSON file."""
+        with open(path, 'r') as f:
+            return cls.from_json(json.load(f), default_type)
+
+    def save(self, path, type_name=None):
+        """Write the segments to a JSON file in the repo's usual indent=2 layout."""
+        with open(path, 'w') as f:
+            json.dump(self.to_json(type_name), f, indent=2)
+
+    # --- Combining ---
+
+    def copy(self):
+        """Independent copy (the floors and extras values are shared)."""
+        return SegmentArray(self.coords.copy(), self.types.copy(), self.polygon_ids.copy(),
+                            list(self.floors), list(self.extras), self.order.copy(),
+                            list(self._keys))
+
+    @classmethod
+    def concatenate(cls, arrays):
+        """
+        Join several SegmentArrays; the JSON order is the inputs' orders one
+        after the other.
+        """
+        arrays = list(arrays)
+        if not arrays:
+            return cls(np.empty((0, 4), np.int32))
+        offsets = np.cumsum([0] + [len(a) for a in arrays[:-1]])
+        return cls(np.concatenate([a.coords for a in arrays]),
+                   np.concatenate([a.types for a in arrays]),
+                   np.concatenate([a.polygon_ids for a in arrays]),
+                   [f for a in arrays for f in a.floors],
+                   [e for a in arrays for e in a.extras],
+                   np.concatenate([a.order + off for a, off in zip(arrays, offsets)]),
+                   [k for a in arrays for k in a._keys])
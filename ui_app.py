@@ -19,6 +19,7 @@ from ui_processing import (
     process_stairs,
     process_snap,
     process_match,
+    process_align_floors,
     process_floor_connections,
     save_floor_connection,
     process_entrances_plot,
@@ -284,10 +285,14 @@ elif st.session_state.current_view == 'rooms':
 
 # Match View
 elif st.session_state.current_view == 'match':
-    reference_json_path, target_json_path, threshold, match_button = render_match_view()
+    (reference_json_path, target_json_path, threshold, register, match_button,
+     align_json_paths, align_button) = render_match_view()
     
     if match_button:
-        process_match(reference_json_path, target_json_path, threshold)
+        process_match(reference_json_path, target_json_path, threshold, register=register)
+    
+    if align_button:
+        process_align_floors(align_json_paths)
 
 # Visualize View
 elif st.session_state.current_view == 'visualize':
@@ -5,16 +5,17 @@ import cv2
 import numpy as np
 import os
 import json
-import tempfile
+import shutil
+import time
 import webbrowser
 
 from pipeline_skeleton import get_skeleton
 from pipeline_vectorize import process_skeleton
-from pipeline_jsonfix import align_walls_globally
+from pipeline_jsonfix import align_walls_globally, align_floors_globally
 from pipeline_extend_endpoints import extend_endpoints
 from pipeline_verifycoord import verify_json_coordinates
-from pipeline_snap import snap_stairs_to_walls
-from group_stair_polygons import group_stair_polygons
+from pipeline_snap import SnapSession
+from group_stair_polygons import group_stair_segments, polygon_table
 
 
 def process_walls(selected_image_path):
@@ -56,12 +57,14 @@ def process_walls(selected_image_path):
              "x2": int(line[2]), "y2": int(line[3])}
             for line in wall_data['walls']
         ]
-        aligned_data = align_walls_globally(json_lines)
+        align_stats = {}
+        aligned_data = align_walls_globally(json_lines, stats=align_stats)
         if not aligned_data:
             st.error("Failed to align walls")
             return False
         
-        progress_bar.progress(60, text="Step 4: Extending endpoints...")
+        progress_bar.progress(60, text=f"Step 4: Extending endpoints "
+                                       f"({align_stats['corrected_lines']}/{align_stats['lines']} lines aligned)...")
         
         # Step 4: Extend free endpoints to nearby walls
         extended_data = extend_endpoints(aligned_data, snap_distance=50.0)
@@ -154,12 +157,14 @@ def process_stairs(stairs_image_path):
              "x2": int(line[2]), "y2": int(line[3])}
             for line in stair_data['walls']
         ]
-        aligned_data = align_walls_globally(json_lines)
+        align_stats = {}
+        aligned_data = align_walls_globally(json_lines, stats=align_stats)
         if not aligned_data:
             st.error("Failed to align stairs")
             return False
         
-        progress_bar.progress(60, text="Step 4: Extending endpoints...")
+        progress_bar.progress(60, text=f"Step 4: Extending endpoints "
+                                       f"({align_stats['corrected_lines']}/{align_stats['lines']} lines aligned)...")
         
         # Step 4: Extend free endpoints to nearby walls
         extended_data = extend_endpoints(aligned_data, snap_distance=50.0)
@@ -247,20 +252,30 @@ def process_snap():
         with open(walls_json_path, 'r') as f:
             walls_data = json.load(f)
         
-        # Read stairs from JSON file
-        with open(stairs_json_path, 'r') as f:
-            stairs_data = json.load(f)
-        
         progress_bar.progress(20, text="Snapping stairs to walls...")
         
         # Get thresholds from session state
         endpoint_threshold = st.session_state.get('snap_endpoint_threshold', 50.0)
         line_threshold = st.session_state.get('snap_line_threshold', 30.0)
         
-        # Snap stairs to walls
-        snapped_stairs = snap_stairs_to_walls(
-            stairs_data,
-            walls_data,
+        # Snap stairs to walls. Candidate lists are computed once per file pair
+        # and kept in the session, so a new threshold only needs a lookup.
+        # The session also holds the stairs as they were before snapping: the
+        # result is written back over the stairs file below, and that write
+        # must not make the next run re-snap already-snapped stairs
+        stairs_key = (stairs_json_path, os.path.getmtime(stairs_json_path))
+        walls_key = (walls_json_path, os.path.getmtime(walls_json_path))
+        cached = st.session_state.get('snap_session')
+        if cached is None or cached['stairs_key'] != stairs_key:
+            # Read stairs from JSON file
+            with open(stairs_json_path, 'r') as f:
+                stairs_data = json.load(f)
+            cached = {'stairs_key': stairs_key, 'stairs_data': stairs_data, 'walls_key': None}
+            st.session_state.snap_session = cached
+        if cached['walls_key'] != walls_key:
+            cached['walls_key'] = walls_key
+            cached['session'] = SnapSession(cached['stairs_data'], walls_data)
+        snapped_stairs = cached['session'].snap(
             endpoint_threshold=endpoint_threshold,
             line_threshold=line_threshold
         )
@@ -271,25 +286,8 @@ def process_snap():
         combined_segments = [{'type': 'wall', **wall} for wall in walls_data] + \
                            [{'type': 'stair', **stair} for stair in snapped_stairs]
         
-        # Create temporary files for grouping
-        with tempfile.NamedTemporaryFile(mode='w', suffix='.json', delete=False) as temp_input:
-            json.dump(combined_segments, temp_input)
-            temp_input_path = temp_input.name
-        
-        with tempfile.NamedTemporaryFile(mode='w', suffix='.json', delete=False) as temp_output:
-            temp_output_path = temp_output.name
-        
-        try:
-            group_stair_polygons(temp_input_path, temp_output_path, visualize=False)
-            with open(temp_output_path, 'r') as f:
-                grouped_segments = json.load(f)
-            snapped_stairs = [seg for seg in grouped_segments if seg.get('type') == 'stair']
-        finally:
-            try:
-                os.unlink(temp_input_path)
-                os.unlink(temp_output_path)
-            except:
-                pass
+        grouped_segments, _ = group_stair_segments(combined_segments)
+        snapped_stairs = [seg for seg in grouped_segments if seg.get('type') == 'stair']
         
         progress_bar.progress(75, text="Generating verification...")
         
@@ -312,6 +310,8 @@ def process_snap():
         with open(stairs_json_output, 'w') as f:
             json.dump(snapped_stairs, f, indent=2)
         st.info(f"Snapped stairs saved to {stairs_json_output}")
+        if os.path.abspath(stairs_json_output) == os.path.abspath(stairs_json_path):
+            cached['stairs_key'] = (stairs_json_path, os.path.getmtime(stairs_json_output))
         
         st.session_state.snapped = True
         
@@ -561,7 +561,6 @@ def process_floor_connections(walls_json_path, stairs_json_path):
             ))
     
     # Add stairs (red lines) with polygon IDs
-    stair_polygons = {}
     for item in stairs_data:
         if isinstance(item, dict) and 'x1' in item and 'y1' in item:
             x1, y1 = item['x1'], item['y1']
@@ -569,12 +568,6 @@ def process_floor_connections(walls_json_path, stairs_json_path):
             y2 = item.get('y2', y1)
             poly_id = item.get('stair_polygon_id', -1)
             
-            # Track polygon centers for labels
-            if poly_id not in stair_polygons:
-                stair_polygons[poly_id] = {'xs': [], 'ys': []}
-            stair_polygons[poly_id]['xs'].extend([x1, x2])
-            stair_polygons[poly_id]['ys'].extend([y1, y2])
-            
             fig.add_trace(go.Scatter(
                 x=[x1, x2],
                 y=[y1, y2],
@@ -586,20 +579,20 @@ def process_floor_connections(walls_json_path, stairs_json_path):
             ))
     
     # Add polygon ID labels at centroid
-    for poly_id, coords in stair_polygons.items():
-        if coords['xs'] and coords['ys']:
-            center_x = np.mean(coords['xs'])
-            center_y = np.mean(coords['ys'])
-            fig.add_trace(go.Scatter(
-                x=[center_x],
-                y=[center_y],
-                mode='text',
-                text=[f"P{poly_id}"],
-                textposition='middle center',
-                textfont=dict(size=12, color='red'),
-                hoverinfo='skip',
-                showlegend=False
-            ))
+    labelled = [item for item in stairs_data
+                if isinstance(item, dict) and all(k in item for k in ('x1', 'y1', 'x2', 'y2'))]
+    for poly in polygon_table(labelled):
+        center_x, center_y = poly['centroid']
+        fig.add_trace(go.Scatter(
+            x=[center_x],
+            y=[center_y],
+            mode='text',
+            text=[f"P{poly['id']}"],
+            textposition='middle center',
+            textfont=dict(size=12, color='red'),
+            hoverinfo='skip',
+            showlegend=False
+        ))
     
     # Update layout
     fig.update_layout(
@@ -1103,7 +1096,7 @@ def save_rooms(floor_number, rooms_list, points_dict):
         return False
 
 
-def process_match(reference_json_path, target_json_path, threshold):
+def process_match(reference_json_path, target_json_path, threshold, register=False):
     """
     Match and snap target floor coordinates to reference floor.
     
@@ -1111,6 +1104,8 @@ def process_match(reference_json_path, target_json_path, threshold):
         reference_json_path: Path to reference JSON file
         target_json_path: Path to target JSON file to be modified
         threshold: Snapping threshold in pixels
+        register: Align the target to the reference (shift, scale,
+                  rotation) before snapping
     
     Returns:
         Boolean indicating success
@@ -1149,7 +1144,8 @@ def process_match(reference_json_path, target_json_path, threshold):
         # Perform matching
         progress_bar = st.progress(0, text="Analyzing coordinates...")
         
-        modified_target, stats = match_coordinates(reference_data, target_data, threshold=threshold)
+        modified_target, stats = match_coordinates(reference_data, target_data, threshold=threshold,
+                                                   register=register)
         
         progress_bar.progress(50, text="Saving matched coordinates...")
         
@@ -1173,6 +1169,12 @@ def process_match(reference_json_path, target_json_path, threshold):
                 st.metric("Horizontal Lines Snapped", stats['horizontal_lines_snapped'])
             
             st.write(f"**Result:** {stats['vertical_lines_snapped'] + stats['horizontal_lines_snapped']} out of {stats['total_lines']} building walls were snapped to reference coordinates within {threshold}px threshold ({stats['snap_percentage']:.1f}%).")
+            
+            if 'registration' in stats:
+                reg = stats['registration']
+                st.write(f"**Registration:** shift ({reg['tx']:.1f}, {reg['ty']:.1f}) px, "
+                         f"scale {reg['scale']:.3f}, rotation {reg['rotation']:.2f}°, "
+                         f"{reg['inliers'] * 100:.1f}% of endpoints matched (RMS {reg['rms']:.2f} px)")
         
         return True
         
@@ -1181,3 +1183,74 @@ def process_match(reference_json_path, target_json_path, threshold):
         import traceback
         st.error(traceback.format_exc())
         return False
+
+
+def process_align_floors(walls_json_paths):
+    """
+    Snap the walls of several floors to one building-wide grid.
+    Every file is copied to outputs/backup, then overwritten with its
+    aligned walls.
+    
+    Args:
+        walls_json_paths: Paths to the floors' walls JSON files
+    
+    Returns:
+        Boolean indicating success
+    """
+    try:
+        from pipeline_match import load_json, save_json
+        
+        if len(walls_json_paths) < 2:
+            st.error("Please select at least two walls files")
+            return False
+        
+        for path in walls_json_paths:
+            if not os.path.exists(path):
+                st.error(f"Walls file not found: {path}")
+                return False
+        
+        try:
+            floors_data = {path: load_json(path) for path in walls_json_paths}
+        except json.JSONDecodeError as e:
+            st.error(f"Invalid JSON: {str(e)}")
+            return False
+        
+        progress_bar = st.progress(0, text="Aligning floors...")
+        
+        align_stats = {}
+        aligned = align_floors_globally(floors_data, stats=align_stats)
+        
+        progress_bar.progress(50, text="Saving aligned walls...")
+        
+        # Keep the unaligned files; a bad alignment must not cost every floor
+        backup_dir = os.path.join("outputs", "backup")
+        os.makedirs(backup_dir, exist_ok=True)
+        stamp = time.strftime("%Y%m%d_%H%M%S")
+        for path, lines in aligned.items():
+            name, ext = os.path.splitext(os.path.basename(path))
+            shutil.copy2(path, os.path.join(backup_dir, f"{name}_{stamp}{ext}"))
+            save_json(lines, path)
+        
+        progress_bar.progress(100, text="Complete")
+        
+        st.success(f"✅ Aligned and saved {len(aligned)} floors (originals in {backup_dir})")
+        
+        with st.expander("📊 Alignment Summary", expanded=True):
+            col1, col2, col3 = st.columns(3)
+            with col1:
+                st.metric("Lines", align_stats['lines'])
+            with col2:
+                st.metric("Lines Corrected", align_stats['corrected_lines'])
+            with col3:
+                st.metric("Shared Grid Lines", align_stats['x_rules'] + align_stats['y_rules'])
+            
+            for path, floor_stats in align_stats['floors'].items():
+                st.write(f"**{os.path.basename(path)}:** {floor_stats['corrected_lines']} of {floor_stats['lines']} lines corrected")
+        
+        return True
+        
+    except Exception as e:
+        st.error(f"Error during alignment: {str(e)}")
+        import traceback
+        st.error(traceback.format_exc())
+        return False
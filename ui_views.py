@@ -699,8 +699,30 @@ def render_match_view():
         help="Maximum distance to snap coordinates to reference points"
     )
     
+    register = st.checkbox(
+        "Auto-register target to reference",
+        value=False,
+        key="match_register",
+        help="Estimate and apply the shift, scale and rotation between the floors before snapping"
+    )
+    
     st.markdown("---")
     
     match_button = st.button("Match & Snap Coordinates", key="match_button")
     
-    return reference_json_path, target_json_path, threshold, match_button
+    st.markdown("---")
+    st.subheader("Align All Floors")
+    
+    st.write("Snap the walls of several floors to one shared grid in a single pass, so columns and cores line up on every floor. The original files are copied to outputs/backup first.")
+    
+    walls_files = [f for f in json_files if '_walls' in f]
+    align_files = st.multiselect(
+        "Walls files (will be modified)",
+        walls_files,
+        key="align_floors_select"
+    )
+    align_json_paths = [f"{json_dir}/{f}" for f in align_files]
+    
+    align_button = st.button("Align Floors", key="align_floors_button")
+    
+    return reference_json_path, target_json_path, threshold, register, match_button, align_json_paths, align_button